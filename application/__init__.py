@@ -1,6 +1,7 @@
 import os
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from flask_migrate import Migrate
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
 from flask_limiter import Limiter
@@ -8,6 +9,7 @@ from flask_limiter.util import get_remote_address
 from application.settingssecrets import MAIL_EMAIL, MAIL_PASSWORD
 from flask_mail import Mail
 from celery import Celery
+from redis import Redis
 
 from itsdangerous import URLSafeTimedSerializer
 
@@ -16,18 +18,147 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('SQLALCHEMY_DATABASE')
 db = SQLAlchemy(app)
+
+# Initialize Flask-Migrate, which changes the database's schema with the versioned migrations in the migrations folder
+# ("flask db upgrade"). Batch mode lets the migrations alter tables in SQLite as well
+migrate = Migrate(app, db, render_as_batch=True)
 bcrypt = Bcrypt(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'teacher_login'
 login_manager.login_message_category = 'info'
 login_manager.login_message = 'You must be logged in to view that page.'
 
+# Initialize the Redis client, used for the judge dispatcher's queue and for publishing status events
+app.config['REDIS_URL'] = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+redis_store = Redis.from_url(app.config['REDIS_URL'])
+
+# The longest (in seconds) that a server-sent events stream stays open before the browser has to reconnect. Each open
+# stream holds a (sync) web worker for that long, so a whole class watching its submissions needs about as many
+# workers as students; keeping it short lets the streams take turns with the other requests between reconnects
+app.config['EVENT_STREAM_MAX_DURATION'] = int(os.environ.get('EVENT_STREAM_MAX_DURATION', 60))
+
 # Initialize Celery, the background task manager
 app.config['CELERY_BROKER_URL'] = os.environ.get('CELERY_BROKER_URL')
 app.config['CELERY_RESULT_BACKEND'] = 'redis://localhost:6379/0'
 celery = Celery(app.name, broker=app.config['CELERY_BROKER_URL'])
 celery.conf.update(app.config)
 
+# What runs each submission's test cases: "judge0" (the Judge0 instance below) or "local" (a pool of sandboxed
+# processes on the judge worker itself, with one process per core by default)
+app.config['JUDGE_EXECUTOR'] = os.environ.get('JUDGE_EXECUTOR', 'judge0')
+app.config['LOCAL_JUDGE_WORKERS'] = int(os.environ.get('LOCAL_JUDGE_WORKERS', os.cpu_count() or 1))
+
+# The user (such as "nobody") that the local executor compiles and runs programs as, which must not be able to read the
+# app's files. The worker has to run as root to switch to it. If it isn't set, programs run as the worker's own user
+app.config['LOCAL_JUDGE_USER'] = os.environ.get('LOCAL_JUDGE_USER')
+
+# The Judge0 instance that runs every submission
+app.config['JUDGE0_URL'] = os.environ.get('JUDGE0_URL', 'https://judge0-fhwnc7.vishnus.me')
+
+# The Judge0 instances (nodes) that submissions are spread between, separated by commas (default: only the one above)
+app.config['JUDGE0_URLS'] = os.environ.get('JUDGE0_URLS', app.config['JUDGE0_URL']).split(',')
+
+# The number of errors in a row after which a node is taken out of rotation, the number of seconds before it's
+# tried again, and how often (in seconds) the number of submissions queued on each node is checked
+app.config['JUDGE0_NODE_MAX_ERRORS'] = int(os.environ.get('JUDGE0_NODE_MAX_ERRORS', 3))
+app.config['JUDGE0_NODE_COOLDOWN'] = float(os.environ.get('JUDGE0_NODE_COOLDOWN', 30))
+app.config['JUDGE0_NODE_REFRESH_INTERVAL'] = float(os.environ.get('JUDGE0_NODE_REFRESH_INTERVAL', 5))
+
+# The number of connections each process keeps open to Judge0, the timeout (in
+# seconds) of each request, and the number of times a failed request is retried
+app.config['JUDGE0_POOL_SIZE'] = int(os.environ.get('JUDGE0_POOL_SIZE', 10))
+app.config['JUDGE0_TIMEOUT'] = float(os.environ.get('JUDGE0_TIMEOUT', 10))
+app.config['JUDGE0_RETRIES'] = int(os.environ.get('JUDGE0_RETRIES', 3))
+
+# If set, submissions are judged by the long-lived asyncio judge dispatcher (judge_dispatcher.py) instead of
+# one Celery task each, along with the number of Judge0 batches it can have in flight and its polling interval
+app.config['JUDGE_DISPATCHER'] = os.environ.get('JUDGE_DISPATCHER', '').lower() in ('1', 'true', 'yes')
+app.config['JUDGE_DISPATCHER_MAX_IN_FLIGHT'] = int(os.environ.get('JUDGE_DISPATCHER_MAX_IN_FLIGHT', 500))
+app.config['JUDGE_DISPATCHER_POLL_INTERVAL'] = float(os.environ.get('JUDGE_DISPATCHER_POLL_INTERVAL', 2))
+
+# The longest (in seconds) that the judge dispatcher waits for more submissions to fill a Judge0 batch before
+# sending a partial one
+app.config['JUDGE_DISPATCHER_COALESCE_WAIT'] = float(os.environ.get('JUDGE_DISPATCHER_COALESCE_WAIT', 0.5))
+
+# The maximum size of the test case files that each judge worker keeps cached in memory (default: 64 MB), and how
+# often (in seconds) each worker logs how well its cache is doing
+app.config['TEST_CASE_CACHE_MAX_BYTES'] = int(os.environ.get('TEST_CASE_CACHE_MAX_BYTES', 64000000))
+app.config['TEST_CASE_CACHE_LOG_INTERVAL'] = float(os.environ.get('TEST_CASE_CACHE_LOG_INTERVAL', 300))
+
+# The number of seconds in which a student submitting the same file to the same
+# problem again (such as by double-clicking submit) is treated as the same submission
+app.config['SUBMISSION_IDEMPOTENCY_WINDOW'] = int(os.environ.get('SUBMISSION_IDEMPOTENCY_WINDOW', 10))
+
+# The most times that sending a batch to Judge0 is tried (on every node) before Judge0 is treated as unavailable,
+# and the number of seconds to wait after the first failure, which doubles after each one up to the maximum
+app.config['JUDGE_BACKOFF_ATTEMPTS'] = int(os.environ.get('JUDGE_BACKOFF_ATTEMPTS', 3))
+app.config['JUDGE_BACKOFF_BASE'] = float(os.environ.get('JUDGE_BACKOFF_BASE', 0.5))
+app.config['JUDGE_BACKOFF_MAX'] = float(os.environ.get('JUDGE_BACKOFF_MAX', 60))
+
+# The longest that judging a submission can take: a minimum number of seconds, plus a multiple of the problem's
+# time limit for each test case. Test cases that still haven't finished after that get the "Internal Error" status
+app.config['JUDGE_DEADLINE_MIN'] = float(os.environ.get('JUDGE_DEADLINE_MIN', 120))
+app.config['JUDGE_DEADLINE_MULTIPLIER'] = float(os.environ.get('JUDGE_DEADLINE_MULTIPLIER', 10))
+
+# Submissions that can't be sent to the judge are put in the judge outbox, which is drained every so often (in
+# seconds) by celery beat. Up to a number of submissions are sent again each time, and a submission is given up on
+# after failing a number of times
+app.config['JUDGE_OUTBOX_DRAIN_INTERVAL'] = float(os.environ.get('JUDGE_OUTBOX_DRAIN_INTERVAL', 30))
+app.config['JUDGE_OUTBOX_DRAIN_BATCH'] = int(os.environ.get('JUDGE_OUTBOX_DRAIN_BATCH', 100))
+app.config['JUDGE_OUTBOX_MAX_ATTEMPTS'] = int(os.environ.get('JUDGE_OUTBOX_MAX_ATTEMPTS', 10))
+
+# How often (in seconds) celery beat checks for submissions whose results Judge0 calls back with that have passed their
+# deadline, in case some of their callbacks were lost
+app.config['JUDGE_CALLBACK_SWEEP_INTERVAL'] = float(os.environ.get('JUDGE_CALLBACK_SWEEP_INTERVAL', 30))
+
+# How often (in seconds) celery beat checks how many test cases Judge0 has queued or running, for admission control
+# (see below). A check older than the expiry is ignored, so only the number of submissions being judged is limited
+app.config['JUDGE_BACKLOG_REFRESH_INTERVAL'] = float(os.environ.get('JUDGE_BACKLOG_REFRESH_INTERVAL', 5))
+app.config['JUDGE_BACKLOG_EXPIRY'] = int(os.environ.get('JUDGE_BACKLOG_EXPIRY', 30))
+
+celery.conf.CELERYBEAT_SCHEDULE = {
+    'drain-judge-outbox': {'task': 'application.routes.student.drain_judge_outbox',
+                           'schedule': app.config['JUDGE_OUTBOX_DRAIN_INTERVAL']},
+    'sweep-judge-callbacks': {'task': 'application.routes.student.sweep_judge_callbacks',
+                              'schedule': app.config['JUDGE_CALLBACK_SWEEP_INTERVAL']},
+    'check-judge-backlog': {'task': 'application.routes.student.check_judge_backlog',
+                            'schedule': app.config['JUDGE_BACKLOG_REFRESH_INTERVAL']}
+}
+
+# Admission control: once this many submissions are being judged, or Judge0 has this many test cases queued or
+# running, new submissions are stored and wait in the admission queue until the judge has room for them. A submission
+# that was sent to the judge this many seconds ago and never finished is no longer counted as being judged
+app.config['JUDGE_MAX_RUNNING'] = int(os.environ.get('JUDGE_MAX_RUNNING', 200))
+app.config['JUDGE_MAX_BACKLOG'] = int(os.environ.get('JUDGE_MAX_BACKLOG', 2000))
+app.config['JUDGE_RUNNING_EXPIRY'] = float(os.environ.get('JUDGE_RUNNING_EXPIRY', 900))
+
+# Each student can send up to a burst of submissions to the judge at once, then a number of submissions a minute.
+# Submissions past that wait in the admission queue until the student can send them
+app.config['JUDGE_STUDENT_BURST'] = int(os.environ.get('JUDGE_STUDENT_BURST', 3))
+app.config['JUDGE_STUDENT_RATE'] = float(os.environ.get('JUDGE_STUDENT_RATE', 6))
+
+# The number of seconds of recently finished submissions that the judge's throughput
+# is measured over, to estimate how long a submission in the admission queue will wait
+app.config['JUDGE_THROUGHPUT_WINDOW'] = float(os.environ.get('JUDGE_THROUGHPUT_WINDOW', 300))
+
+# The outputs of a test case are saved in its result compressed. If they're still bigger than this (in bytes), they're
+# stored in S3 instead, and the result only keeps a number of characters from the start of each one
+app.config['RESULT_OUTPUT_MAX_BYTES'] = int(os.environ.get('RESULT_OUTPUT_MAX_BYTES', 4000))
+app.config['RESULT_OUTPUT_PREVIEW_LENGTH'] = int(os.environ.get('RESULT_OUTPUT_PREVIEW_LENGTH', 1000))
+
+# The most chunks of test cases (each about a full Judge0 batch) that a rejudge of a problem's submissions runs at once
+app.config['REJUDGE_CONCURRENCY'] = int(os.environ.get('REJUDGE_CONCURRENCY', 4))
+
+# If set, Judge0 sends each finished test case to this URL (the judge0_callback route, such as
+# "https://codeio.tech/judge0-callback") instead of the judge workers polling Judge0 for it
+app.config['JUDGE0_CALLBACK_URL'] = os.environ.get('JUDGE0_CALLBACK_URL')
+
+# Every request's queries are counted, timed, and logged at the debug level. If set, they're also sent in each
+# response's X-Query-Count and X-Query-Time (in milliseconds) headers. Each view has a budget of queries it can run
+# (see query_budget.py), and going over it is logged as a warning, or raises an error in strict mode (such as in tests)
+app.config['QUERY_STATS_HEADER'] = os.environ.get('QUERY_STATS_HEADER', '').lower() in ('1', 'true', 'yes')
+app.config['QUERY_BUDGET_STRICT'] = os.environ.get('QUERY_BUDGET_STRICT', '').lower() in ('1', 'true', 'yes')
+
 # Initialize Flask-Mail, used for sending confirmation emails
 app.config['MAIL_SERVER'] = 'smtp.codeio.tech'
 app.config['MAIL_PORT'] = 587
@@ -0,0 +1,59 @@
+import json
+import time
+from flask import Response
+from application import app, redis_store
+
+
+# Publish an event (a JSON-serializable dict) to everyone listening on a channel
+def publish_event(channel, data):
+    try:
+        redis_store.publish(f'events:{channel}', json.dumps(data))
+
+    # Listeners fall back to polling, so an event that couldn't be sent must never fail the caller
+    except Exception:
+        app.logger.exception(f'Could not publish an event to {channel}')
+
+
+# Subscribe to a channel. This is done before getting the current state that is sent
+# first, so that no event published in between can be missed
+def subscribe(channel):
+    pubsub = redis_store.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(f'events:{channel}')
+    return pubsub
+
+
+# Format a dict as a server-sent event
+def format_event(data):
+    return f'data: {json.dumps(data)}\n\n'
+
+
+# Create a server-sent events response that first sends the current state, then every event published to the
+# channel until one has a final state (SUCCESS or ERROR) or the stream has been open for too long, at which
+# point the browser's EventSource reconnects by itself and gets the current state again
+def event_stream(pubsub, initial):
+    def generate():
+        try:
+            yield format_event(initial)
+
+            if initial.get('state') in ('SUCCESS', 'ERROR'):
+                return
+
+            end = time.time() + app.config['EVENT_STREAM_MAX_DURATION']
+            while time.time() < end:
+                message = pubsub.get_message(timeout=15)
+
+                # Send a comment every so often, so proxies don't close the idle connection
+                if message is None:
+                    yield ': keep-alive\n\n'
+                    continue
+
+                data = json.loads(message['data'])
+                yield format_event(data)
+
+                if data.get('state') in ('SUCCESS', 'ERROR'):
+                    return
+        finally:
+            pubsub.close()
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
@@ -3,7 +3,7 @@ from flask_wtf import FlaskForm
 from flask_wtf.file import FileField
 from wtforms import StringField, SubmitField, SelectField
 from wtforms.validators import DataRequired, ValidationError
-from application.models.general import Language
+from application.registry import registry
 
 
 # The student login form
@@ -21,7 +21,7 @@ class SubmitSolutionForm(FlaskForm):
 
     # Ensure that the file extension matches the language's file extension
     def validate_file(self, file):
-        lang = Language.query.filter_by(number=self.language.data).first()
+        lang = registry.language(self.language.data)
         if lang.file_extension != file.data.filename.split('.')[-1]:
             flash('There were some errors uploading your file. Scroll down to view the error(s).', 'danger')
             raise ValidationError(f'Please upload a .{lang.file_extension} file.')
@@ -2,7 +2,7 @@ from flask import flash
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileAllowed
 from wtforms import StringField, PasswordField, SubmitField, BooleanField, TextAreaField, SelectMultipleField, \
-    IntegerField, DecimalField
+    IntegerField, DecimalField, SelectField
 from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationError, Optional, InputRequired
 from application.models.general import User
 
@@ -65,6 +65,14 @@ class CheckPlagiarismForm(FlaskForm):
     submit = SubmitField('Check for plagiarism')
 
 
+# The form to run a problem's submissions through the judge again (such as after its test cases were fixed)
+class RejudgeProblemForm(FlaskForm):
+    submissions = SelectField('Submissions', choices=[('all', 'All submissions'),
+                                                      ('latest', "Each student's latest submission"),
+                                                      ('not_full_marks', "Submissions without full marks")])
+    submit = SubmitField('Rejudge submissions')
+
+
 # The form to create a new class
 class NewClassForm(FlaskForm):
     # The relevant fields as well as their validators
@@ -97,6 +105,7 @@ class NewProblemForm(FlaskForm):
     allow_multiple_submissions = BooleanField('Allow multiple submissions')
     visible = BooleanField('Visible to students')
     auto_grade = BooleanField('Auto Grade')
+    fail_fast = BooleanField('Stop judging at the first failed test case')
     total_marks = IntegerField('Marks out of:', validators=[DataRequired()])
     languages = SelectMultipleField('Languages', coerce=int, validators=[DataRequired()])
 
@@ -269,12 +278,14 @@ class EditProblemForm(FlaskForm):
     allow_multiple_submissions = BooleanField('Allow multiple submissions')
     allow_more_submissions = BooleanField('Allow more submissions')
     visible = BooleanField('Visible to students')
+    fail_fast = BooleanField('Stop judging at the first failed test case')
     total_marks = IntegerField('Marks out of:', validators=[DataRequired()])
+    priority = IntegerField('Judging priority', render_kw={'placeholder': 'Default: 1'}, validators=[Optional()])
     languages = SelectMultipleField('Languages', coerce=int, validators=[DataRequired()])
 
     submit = SubmitField('Update problem')
 
-    # Custom validators to make sure the memory limit and time limit aren't too high or too low
+    # Custom validators to make sure the memory limit, time limit, and judging priority aren't too high or too low
     def validate_memory_limit(self, memory_limit):
         if memory_limit.data:
             if memory_limit.data < 3 or memory_limit.data > 512:
@@ -287,3 +298,9 @@ class EditProblemForm(FlaskForm):
                 flash('There were some errors creating the problem. Scroll down to see the error(s).', 'danger')
                 raise ValidationError('The time limit must be greater than 1 second and no greater than 5 seconds',
                                       'danger')
+
+    def validate_priority(self, priority):
+        if priority.data is not None:
+            if priority.data < 1 or priority.data > 10:
+                flash('There were some errors creating the problem. Scroll down to see the error(s).', 'danger')
+                raise ValidationError('The judging priority must be from 1 to 10')
@@ -0,0 +1,159 @@
+from time import time
+from application import app, celery, redis_store
+from application.events import publish_event
+from application.judge.queue import enqueue_judge_job
+from application.judge.client import get_judge0_client
+from application.judge.executor import JudgeUnavailable
+from application.judge.scheduler import take_token, waiting_count, add_job, take_job, job_position
+
+# The Redis sorted sets of the submissions being judged (by when they were sent to the judge)
+# and the recently finished submissions (by when they finished)
+RUNNING = 'judge:running'
+FINISHED = 'judge:finished'
+
+# The number of test cases queued or running on the healthy Judge0 nodes, as last checked by refresh_judge_backlog
+# (or JUDGE_DOWN if every node was out of rotation)
+BACKLOG = 'judge:backlog'
+JUDGE_DOWN = -1
+
+
+# Get the job to judge a submission, with the same arguments as the student_judge_code task, the submission's UUID
+# (which the task is given as its id, so its status can be found by the submission's UUID), and what the scheduler
+# needs to know to give each class and problem its share of the judge
+def judge_job(language, file, problem, student_id, submission_id, uuid):
+    return {'language': int(language), 'file': file, 'problem': problem.id, 'student': student_id,
+            'submission': submission_id, 'uuid': uuid, 'class': problem.class_id, 'priority': problem.priority or 1}
+
+
+# Send a submission to the judge (the judge dispatcher, or a Celery task) and count it as being judged
+def send_to_judge(job):
+    redis_store.zadd(RUNNING, {job['submission']: time()})
+
+    if app.config['JUDGE_DISPATCHER']:
+        enqueue_judge_job(job['language'], job['file'], job['problem'], job['submission'])
+    else:
+        celery.send_task('application.routes.student.student_judge_code', task_id=job['uuid'],
+                         args=[job['language'], job['file'], job['problem'], job['student'], job['submission']])
+
+
+# Get the number of submissions being judged. Submissions that were sent a long time ago
+# and never finished (such as when a worker crashed) stop being counted
+def running_count():
+    redis_store.zremrangebyscore(RUNNING, '-inf', time() - app.config['JUDGE_RUNNING_EXPIRY'])
+    return redis_store.zcard(RUNNING)
+
+
+# Check the number of test cases queued or running on the healthy Judge0 nodes, and save it for judge_backlog (this
+# is run by celery beat, so that submitting never waits for Judge0). A node whose queue can't be checked only counts
+# the test cases sent to it since it was last checked
+def refresh_judge_backlog():
+    if app.config['JUDGE_EXECUTOR'] != 'judge0':
+        return 0
+
+    try:
+        backlog = sum(node.outstanding for node in get_judge0_client().choose())
+    except JudgeUnavailable:
+        backlog = JUDGE_DOWN
+
+    redis_store.set(BACKLOG, backlog, ex=app.config['JUDGE_BACKLOG_EXPIRY'])
+
+    return backlog
+
+
+# Get the number of test cases queued or running on the healthy Judge0 nodes when they were last checked (0 when the
+# local executor is used). Raises JudgeUnavailable if every node was out of rotation
+def judge_backlog():
+    if app.config['JUDGE_EXECUTOR'] != 'judge0':
+        return 0
+
+    backlog = redis_store.get(BACKLOG)
+
+    # If it hasn't been checked recently (such as when celery beat isn't running), only the number of submissions
+    # being judged is limited
+    if backlog is None:
+        return 0
+
+    if int(backlog) == JUDGE_DOWN:
+        raise JudgeUnavailable('Every Judge0 node was out of rotation when the judge was last checked')
+
+    return int(backlog)
+
+
+# Get whether the judge has room for another submission
+def has_capacity():
+    if running_count() >= app.config['JUDGE_MAX_RUNNING']:
+        return False
+
+    # If the judge is down, the submission would only end up in the judge outbox, so it waits here instead
+    try:
+        return judge_backlog() < app.config['JUDGE_MAX_BACKLOG']
+    except JudgeUnavailable:
+        return False
+
+
+# Send a submission to the judge if it has room, nothing else is waiting, and the student hasn't used up their tokens
+# (so no student can flood the judge), else add it to the scheduler's queues. Returns the submission's position in
+# the queue, or None if it was sent to the judge
+def admit(job):
+    available_at = take_token(job['student'])
+
+    if available_at <= time() and not waiting_count() and has_capacity():
+        send_to_judge(job)
+        return None
+
+    add_job(job, available_at)
+
+    # If the judge has room after all (the submissions before it are just about to be sent), send it right away
+    release_waiting()
+
+    return job_position(job['submission'])
+
+
+# Send as many waiting submissions to the judge as it has room for, in the order that the scheduler gives them. Taking
+# a job from the scheduler is atomic, so several processes releasing at once never send the same one twice
+def release_waiting():
+    released = 0
+
+    while waiting_count() and has_capacity():
+        job = take_job()
+        if job is None:
+            break
+
+        send_to_judge(job)
+        released += 1
+
+        # Let anyone watching the submission know that it's no longer waiting
+        publish_event(f"submission:{job['submission']}", {'state': 'PENDING'})
+
+    return released
+
+
+# Stop counting a submission as being judged (and count it towards the judging throughput if it finished rather than
+# going to the judge outbox), then send the submissions waiting in the admission queue that the judge now has room for
+def judging_stopped(submission_id, finished=True):
+    try:
+        redis_store.zrem(RUNNING, submission_id)
+
+        if finished:
+            now = time()
+            redis_store.zadd(FINISHED, {submission_id: now})
+            redis_store.zremrangebyscore(FINISHED, '-inf', now - app.config['JUDGE_THROUGHPUT_WINDOW'])
+
+        release_waiting()
+
+    # The submission has already been saved, so this must never fail the caller. Anything left waiting
+    # is sent by drain_judge_outbox instead, and a submission left counted as running expires
+    except Exception:
+        app.logger.exception(f'Could not release the judge after submission {submission_id}')
+
+
+# Get the estimated number of seconds until a submission at a position in the admission queue is sent to the judge,
+# from the number of submissions that finished judging recently, or None if none have
+def estimated_wait(position):
+    window = app.config['JUDGE_THROUGHPUT_WINDOW']
+    finished = redis_store.zcount(FINISHED, time() - window, '+inf')
+
+    if not finished:
+        return None
+
+    return round(position * window / finished)
@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import base64
+import threading
+from collections import OrderedDict
+from application import app
+from application.events import publish_event, subscribe
+
+# The channel that a problem's files being changed or deleted is published on, so that every process (each judge
+# worker and the dispatcher, not only the web process that changed them) drops them from its cache
+INVALIDATIONS_CHANNEL = 'test-case-cache:invalidate'
+
+
+# Get the key that a test case file is cached under. Files uploaded with a content hash are
+# content-addressed, so re-uploading a problem's files can never return stale data. Older
+# files without a hash fall back to their path and row id, which also changes on re-upload
+def test_case_key(file):
+    if file.content_hash:
+        return file.content_hash
+
+    return f'{file.file_path}:{file.id}'
+
+
+# A size-bounded, least recently used (LRU) in-memory cache of the test case files
+# that the judge workers download from S3, so the same files are not fetched on every run.
+# Since the files are cached by their key, a process that misses an invalidation can never
+# return stale data, it only keeps the files until they're evicted
+class TestCaseCache:
+    def __init__(self, max_bytes):
+        # The maximum number of bytes of file data to keep before evicting the least recently used file
+        self.max_bytes = max_bytes
+        self.size = 0
+
+        # The hit and miss counters
+        self.hits = 0
+        self.misses = 0
+
+        # The cached file data (ordered from least to most recently used)
+        # and the keys that are cached for each problem
+        self._entries = OrderedDict()
+        self._problems = {}
+
+        # Celery may run tasks in threads, so every access is guarded by a lock
+        self._lock = threading.Lock()
+
+        # This process's subscription to the invalidations (and the process that it belongs to, since a forked
+        # process can't share its parent's connection), along with when the stats were last logged
+        self._invalidations = None
+        self._invalidations_pid = None
+        self._invalidations_lock = threading.Lock()
+        self._logged_at = time.time()
+
+    # Get a file's data from the cache, or None if it is not cached
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+
+            # Mark the file as the most recently used
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+    # Add a file's data to the cache, then evict the least recently used files until the cache fits
+    def put(self, key, problem_id, data):
+        size = len(data)
+
+        # Don't cache files that could never fit
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self.size -= len(self._entries.pop(key))
+
+            self._entries[key] = data
+            self.size += size
+            self._problems.setdefault(problem_id, set()).add(key)
+
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    # Remove every cached file of a problem, for when its files are changed or deleted, in every process
+    def invalidate(self, problem_id):
+        self._drop(problem_id)
+        publish_event(INVALIDATIONS_CHANNEL, {'problem': problem_id})
+
+    # Remove every cached file of a problem from this process's cache
+    def _drop(self, problem_id):
+        with self._lock:
+            for key in self._problems.pop(problem_id, set()):
+                if key in self._entries:
+                    self.size -= len(self._entries.pop(key))
+
+    # Drop the files of the problems that were invalidated (by any process) since this was last checked. The process
+    # subscribes the first time it uses the cache, so it only misses the invalidations from before it had anything
+    # cached
+    def receive_invalidations(self):
+        with self._invalidations_lock:
+            try:
+                if self._invalidations_pid != os.getpid():
+                    self._invalidations = subscribe(INVALIDATIONS_CHANNEL)
+                    self._invalidations_pid = os.getpid()
+
+                while True:
+                    message = self._invalidations.get_message()
+                    if message is None:
+                        break
+
+                    self._drop(json.loads(message['data'])['problem'])
+
+            # Subscribe again next time
+            except Exception:
+                app.logger.exception('Could not receive the test case cache invalidations')
+                self._invalidations_pid = None
+
+    # Remove every cached file
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._problems.clear()
+            self.size = 0
+
+    # Get the hit and miss counters along with the size of the cache
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries), 'size': self.size,
+                    'max_size': self.max_bytes}
+
+    # Log the cache's stats every TEST_CASE_CACHE_LOG_INTERVAL seconds (each process has a cache of its own)
+    def log_stats(self):
+        if time.time() - self._logged_at < app.config['TEST_CASE_CACHE_LOG_INTERVAL']:
+            return
+
+        self._logged_at = time.time()
+        stats = self.stats()
+        lookups = stats['hits'] + stats['misses']
+
+        app.logger.info(f"Test case cache (process {os.getpid()}): {stats['hits']} hits, {stats['misses']} misses "
+                        f"({stats['hits'] / lookups if lookups else 0:.0%} hit rate), {stats['entries']} files, "
+                        f"{stats['size']} of {stats['max_size']} bytes")
+
+    # Get the text of an input or output file, downloading it from S3 only if it is not already cached
+    def fetch(self, s3, bucket_name, file):
+        self.receive_invalidations()
+        self.log_stats()
+
+        key = test_case_key(file)
+        data = self.get(key)
+
+        if data is None:
+            data = s3.Object(bucket_name, file.file_path).get()['Body'].read().decode('utf-8')
+            self.put(key, file.problem_id, data)
+
+        return data
+
+    # Get an input or output file's contents base64 encoded, as they're sent to the judge, downloading them only if
+    # they are not already cached. The copy that was encoded when the file was uploaded is used, so the file never has
+    # to be decoded and encoded again (files uploaded before those copies were stored are encoded once, here)
+    def fetch_payload(self, s3, bucket_name, file):
+        self.receive_invalidations()
+        self.log_stats()
+
+        key = f'{test_case_key(file)}:base64'
+        data = self.get(key)
+
+        if data is None:
+            if file.payload_path:
+                data = s3.Object(bucket_name, file.payload_path).get()['Body'].read().decode('ascii')
+            else:
+                data = base64.b64encode(s3.Object(bucket_name, file.file_path).get()['Body'].read()).decode('ascii')
+
+            self.put(key, file.problem_id, data)
+
+        return data
+
+
+# The cache shared by every judge task in this worker process
+test_case_cache = TestCaseCache(app.config['TEST_CASE_CACHE_MAX_BYTES'])
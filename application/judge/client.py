@@ -0,0 +1,309 @@
+import os
+import json
+import time
+import threading
+from requests import Session
+from requests.exceptions import ConnectionError, HTTPError, RequestException
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from application import app
+from application.settingssecrets import JUDGE0_AUTHN_TOKEN
+from application.judge.executor import Executor, JudgeUnavailable, backoff_delay
+
+# The only fields of a finished Judge0 submission that are stored in a Result
+RESULT_FIELDS = 'token,stdout,stderr,time,memory,compile_output,status'
+
+# The gateway errors that a proxy in front of Judge0 returns when the request never reached it
+GATEWAY_ERRORS = (502, 503, 504)
+
+# The most tokens Judge0 accepts in one batch request
+JUDGE0_BATCH_SIZE = 20
+
+
+# Make sure that Judge0 returned something for every submission in a batch: its token, or the errors of a submission
+# that Judge0 rejected (such as one with an unknown language), which only fail that submission (see token_error)
+def check_tokens(judge0_tokens, count):
+    if not isinstance(judge0_tokens, list) or len(judge0_tokens) != count or \
+            not all(isinstance(jt, dict) and jt for jt in judge0_tokens):
+        raise JudgeUnavailable(f'Judge0 returned invalid tokens: {str(judge0_tokens)[:500]}')
+
+    return judge0_tokens
+
+
+# Get Judge0's error message for a submission in a batch that it rejected instead of returning a token (such as
+# "language_id: language with id 999 doesn't exist"), or None if it returned a token
+def token_error(jt):
+    if jt.get('token'):
+        return None
+
+    errors = [f"{field}: {', '.join(map(str, e)) if isinstance(e, list) else e}"
+              for field, e in jt.items() if field != 'node']
+
+    return '; '.join(errors)[:1000] or 'Judge0 did not return a token'
+
+
+# Make sure that Judge0 returned every submission in a batch, each with its status
+def check_batch(batch, count):
+    submissions = batch.get('submissions') if isinstance(batch, dict) else None
+
+    if not isinstance(submissions, list) or len(submissions) != count or \
+            not all(isinstance(s, dict) and s.get('token') and isinstance(s.get('status'), dict) for s in submissions):
+        raise JudgeUnavailable(f'Judge0 returned an invalid batch: {str(batch)[:500]}')
+
+    return submissions
+
+
+# Whether an error from a node means that the node itself is unhealthy: it couldn't be reached, timed out, or failed
+# with a server error. Anything else (such as Judge0 rejecting a request, or a response that doesn't make sense) is
+# about the request rather than the node, so it doesn't count towards taking the node out of rotation
+def node_error(e):
+    if isinstance(e, HTTPError):
+        return e.response is None or e.response.status_code >= 500
+
+    return isinstance(e, RequestException)
+
+
+# A client for the Judge0 API that reuses its connections (keep-alive) instead
+# of doing a new TCP and TLS handshake for every request
+class Judge0Client:
+    def __init__(self, base_url, auth_token, pool_size, timeout, retries):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+        # Retry requests that couldn't connect or that failed with a gateway error, backing off between each
+        # attempt. POST requests are only retried if they never reached Judge0, so a batch is never sent twice
+        retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(502, 503, 504),
+                      allowed_methods=frozenset(['GET']))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'X-Auth-Token': auth_token})
+
+    # Send a GET request to Judge0 and return the JSON response
+    def get(self, path, **params):
+        response = self.session.get(f'{self.base_url}{path}', params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    # Send a batch of submissions (base64 encoded) to Judge0 and return their tokens
+    def create_batch(self, submissions):
+        response = self.session.post(f'{self.base_url}/submissions/batch', params={'base64_encoded': 'true'},
+                                     data=json.dumps({'submissions': submissions}),
+                                     headers={'Content-Type': 'application/json'}, timeout=self.timeout)
+        response.raise_for_status()
+
+        try:
+            return check_tokens(response.json(), len(submissions))
+        except ValueError:
+            raise JudgeUnavailable(f'Judge0 returned invalid JSON: {response.text[:500]}')
+
+    # Get a batch of submissions (base64 encoded) by their tokens, with only the fields that are stored
+    def get_batch(self, tokens):
+        try:
+            batch = self.get('/submissions/batch', tokens=','.join(tokens), base64_encoded='true',
+                             fields=RESULT_FIELDS)
+        except ValueError:
+            raise JudgeUnavailable('Judge0 returned invalid JSON')
+
+        return check_batch(batch, len(tokens))
+
+    # Get every language that Judge0 supports
+    def languages(self):
+        return self.get('/languages/')
+
+    # Get a single language, including its source file name
+    def language(self, language_id):
+        return self.get(f'/languages/{language_id}')
+
+    # Get Judge0's queues, with the number of submissions waiting in and being run from each
+    def workers(self):
+        return self.get('/workers')
+
+
+# A Judge0 instance in the pool, with its client and how busy and healthy it is
+class Judge0Node:
+    def __init__(self, url, client):
+        self.url = url
+        self.client = client
+
+        # The number of submissions queued or running in the node when it was last checked (None if its queue
+        # couldn't be checked), and the number of test cases that have been sent to it since then
+        self.queue_depth = 0
+        self.sent = 0
+        self.checked_at = None
+
+        # The number of errors in a row, and the time until which the node is out of rotation
+        self.errors = 0
+        self.down_until = 0
+
+    # The number of test cases that the node has to run before any new one (as far as is known)
+    @property
+    def outstanding(self):
+        return (self.queue_depth or 0) + self.sent
+
+    def succeeded(self):
+        self.errors = 0
+
+    # Count an error, and if there have been too many in a row, take the node out of rotation for a while
+    def failed(self):
+        self.errors += 1
+
+        if self.errors >= app.config['JUDGE0_NODE_MAX_ERRORS']:
+            self.down_until = time.time() + app.config['JUDGE0_NODE_COOLDOWN']
+            app.logger.warning(f'Taking Judge0 node {self.url} out of rotation after {self.errors} errors')
+
+
+# A pool of Judge0 instances (nodes). Each batch is sent to the healthy node with the fewest outstanding test cases
+# (the submissions it reported as queued or running, plus what has been sent to it since). Tokens only exist on the
+# node that created them, so each token is returned with its node, and polled from it
+class Judge0Pool(Executor):
+    supports_callbacks = True
+
+    def __init__(self, urls, auth_token, pool_size, timeout, retries):
+        self.nodes = [Judge0Node(url.rstrip('/'), Judge0Client(url, auth_token, pool_size, timeout, retries))
+                      for url in urls]
+        self.nodes_by_url = {n.url: n for n in self.nodes}
+        self.lock = threading.Lock()
+
+    # Check how many submissions are queued or running on a node, if it hasn't been checked recently
+    def _check(self, node):
+        if node.checked_at is not None and time.time() - node.checked_at < app.config['JUDGE0_NODE_REFRESH_INTERVAL']:
+            return
+
+        node.checked_at = time.time()
+        node.sent = 0
+
+        try:
+            node.queue_depth = sum(q.get('size', 0) + q.get('working', 0) for q in node.client.workers())
+            node.succeeded()
+
+        # Not being able to see the node's queue (such as when the token isn't allowed to) doesn't mean that it can't
+        # run submissions, so the node stays in rotation, and only the test cases sent to it since are counted
+        except Exception as e:
+            if node.queue_depth is not None:
+                app.logger.warning(f'Could not check the queue of Judge0 node {node.url}, so its capacity is '
+                                   f'unknown: {e}')
+            node.queue_depth = None
+
+    # Get the healthy nodes in the order they should be tried, with the fewest outstanding test cases first. This
+    # is the pool's circuit breaker: while every node is out of rotation, nothing is sent to Judge0 at all, and once
+    # a node's cooldown is over it's tried again (and taken out again right away if it fails)
+    def choose(self):
+        with self.lock:
+            for node in self.nodes:
+                if node.down_until <= time.time():
+                    self._check(node)
+
+            healthy = [n for n in self.nodes if n.down_until <= time.time()]
+
+            if not healthy:
+                raise JudgeUnavailable('Every Judge0 node is out of rotation')
+
+            return sorted(healthy, key=lambda n: n.outstanding)
+
+    # Raise JudgeUnavailable if every node is out of rotation
+    def check(self):
+        self.choose()
+
+    # Get the node that a token was sent to (the first node, if it isn't known)
+    def node(self, url):
+        return self.nodes_by_url.get(url, self.nodes[0])
+
+    # Send a batch to the best node. If the batch never reached a node (it couldn't be connected to, or a proxy
+    # returned a gateway error), the next best node is tried instead, and if it never reached any of them, they're
+    # all tried again after backing off. A batch that reached a node but failed isn't sent again, since Judge0 may
+    # already be running it
+    def create_batch(self, submissions):
+        error = None
+
+        for attempt in range(app.config['JUDGE_BACKOFF_ATTEMPTS']):
+            if attempt:
+                time.sleep(backoff_delay(attempt - 1))
+
+            for node in self.choose():
+                try:
+                    judge0_tokens = node.client.create_batch(submissions)
+                except (ConnectionError, HTTPError) as e:
+                    if node_error(e):
+                        node.failed()
+                    error = e
+
+                    if isinstance(e, HTTPError) and e.response.status_code not in GATEWAY_ERRORS:
+                        raise JudgeUnavailable(f'Judge0 node {node.url} failed: {e}') from e
+
+                    continue
+                except JudgeUnavailable:
+                    raise
+                except Exception as e:
+                    if node_error(e):
+                        node.failed()
+                    raise JudgeUnavailable(f'Judge0 node {node.url} failed: {e}') from e
+
+                node.succeeded()
+                node.sent += len(submissions)
+
+                return [{**jt, 'node': node.url} for jt in judge0_tokens]
+
+        raise JudgeUnavailable(f'Could not reach any Judge0 node: {error}') from error
+
+    # Get a batch of tokens, asking each node for the tokens that it created
+    def get_batch(self, tokens, nodes=None):
+        nodes = nodes or {}
+
+        tokens_by_node = {}
+        for token in tokens:
+            tokens_by_node.setdefault(self.node(nodes.get(token)), []).append(token)
+
+        batch = []
+        for node, node_tokens in tokens_by_node.items():
+            try:
+                batch.extend(node.client.get_batch(node_tokens))
+            except JudgeUnavailable:
+                raise
+            except Exception as e:
+                if node_error(e):
+                    node.failed()
+                raise JudgeUnavailable(f'Could not get tokens from Judge0 node {node.url}: {e}') from e
+
+            node.succeeded()
+
+        return batch
+
+    # Get every language that Judge0 supports (from the first node that answers)
+    def languages(self):
+        return self._first(lambda client: client.languages())
+
+    # Get a single language, including its source file name
+    def language(self, language_id):
+        return self._first(lambda client: client.language(language_id))
+
+    def _first(self, f):
+        nodes = self.choose()
+
+        for i, node in enumerate(nodes):
+            try:
+                return f(node.client)
+            except Exception as e:
+                if node_error(e):
+                    node.failed()
+                if i == len(nodes) - 1:
+                    raise
+
+
+_client = None
+_client_pid = None
+
+
+# Get this process's pool of Judge0 nodes. Celery's workers are forked from the main process, and
+# connections can't be shared between processes, so each process creates its own pool
+def get_judge0_client():
+    global _client, _client_pid
+
+    if _client is None or _client_pid != os.getpid():
+        _client = Judge0Pool(app.config['JUDGE0_URLS'], JUDGE0_AUTHN_TOKEN, app.config['JUDGE0_POOL_SIZE'],
+                             app.config['JUDGE0_TIMEOUT'], app.config['JUDGE0_RETRIES'])
+        _client_pid = os.getpid()
+
+    return _client
@@ -0,0 +1,486 @@
+import asyncio
+import aiohttp
+from time import time
+from concurrent.futures import ThreadPoolExecutor
+from application import app, db
+from application.models.general import Problem, Result, Submission
+from application.judge.queue import pop_judge_job
+from application.judge.client import RESULT_FIELDS, GATEWAY_ERRORS, JUDGE0_BATCH_SIZE, Judge0Pool, check_tokens, \
+    check_batch
+from application.judge.executor import get_executor, JudgeUnavailable, backoff_delay
+from application.judge.grading import PENDING_STATUSES, build_judge0_submissions, create_pending_results, \
+    record_result, finish_submission, copy_identical_results, record_result_in_order, judge_deadline, \
+    expire_pending_results, skip_remaining_results, add_to_outbox
+
+
+# Whether an error from a node means that the node itself is unhealthy (see client.node_error)
+def node_error(e):
+    if isinstance(e, aiohttp.ClientResponseError):
+        return e.status >= 500
+
+    return isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError))
+
+
+# A long-lived, asyncio-based judge that keeps hundreds of submissions in flight in Judge0 at once from a single
+# process, sending the test cases of many submissions together in full batches and polling all of their tokens
+# together, instead of blocking one Celery worker per submission
+class JudgeDispatcher:
+    def __init__(self, s3, bucket_name, auth_token, max_in_flight=None, poll_interval=None, coalesce_wait=None):
+        self.s3 = s3
+        self.bucket_name = bucket_name
+        self.auth_token = auth_token
+        self.max_in_flight = max_in_flight or app.config['JUDGE_DISPATCHER_MAX_IN_FLIGHT']
+        self.poll_interval = poll_interval or app.config['JUDGE_DISPATCHER_POLL_INTERVAL']
+
+        # What runs the test cases. Judge0 is called directly with aiohttp, and any other
+        # executor (such as the local one) is called on a thread instead
+        self.executor = get_executor()
+        self.judge0 = isinstance(self.executor, Judge0Pool)
+
+        # The submissions that are in flight, mapping each submission's id to a dict of its tokens and the ids
+        # of the results they belong to, the Judge0 node that each in-flight token was sent to, and the time by
+        # which each submission must have finished judging
+        self.in_flight = {}
+        self.token_nodes = {}
+        self.deadlines = {}
+
+        # The in-flight submissions whose finished test cases couldn't be recorded (or that couldn't be given up on),
+        # mapping each one's id to the number of times in a row that it failed and the time it's tried again at
+        self._failures = {}
+        self._retry_at = {}
+
+        # The submissions whose runs are waiting to be sent to Judge0 together, the total number of their runs,
+        # the longest that a partial batch waits for more runs, and the timer that sends a partial batch
+        self._waiting = []
+        self._waiting_runs = 0
+        self.coalesce_wait = app.config['JUDGE_DISPATCHER_COALESCE_WAIT'] if coalesce_wait is None else coalesce_wait
+        self._flush_timer = None
+
+        # The database session isn't thread-safe, so every database call runs on this one thread
+        self._db = ThreadPoolExecutor(max_workers=1)
+
+    # Run a function that uses the database on the database thread, then reset the session
+    # so the next call doesn't see stale objects
+    async def _in_db(self, f, *args):
+        def call():
+            try:
+                return f(*args)
+            finally:
+                db.session.remove()
+
+        return await asyncio.get_event_loop().run_in_executor(self._db, call)
+
+    # Run a function that uses the database on the database thread, trying it again after backing off if it fails
+    # (such as while the database is restarting), up to JUDGE_BACKOFF_ATTEMPTS times in all
+    async def _in_db_retrying(self, f, *args):
+        attempts = app.config['JUDGE_BACKOFF_ATTEMPTS']
+
+        for attempt in range(attempts):
+            if attempt:
+                await asyncio.sleep(backoff_delay(attempt - 1))
+
+            try:
+                return await self._in_db(f, *args)
+            except Exception:
+                if attempt == attempts - 1:
+                    raise
+
+                app.logger.exception(f'Database call {f.__name__} failed, trying it again')
+
+    # Take submissions from the queue and send them to Judge0 forever
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+
+        connector = aiohttp.TCPConnector(limit=app.config['JUDGE0_POOL_SIZE'])
+        timeout = aiohttp.ClientTimeout(total=app.config['JUDGE0_TIMEOUT'])
+
+        async with aiohttp.ClientSession(headers={'X-Auth-Token': self.auth_token}, connector=connector,
+                                         timeout=timeout) as session:
+            self.session = session
+            poller = asyncio.ensure_future(self._poll_forever())
+
+            try:
+                while True:
+                    # Wait until there is room for another submission, then wait for one
+                    await self._slots.acquire()
+                    job = await loop.run_in_executor(None, pop_judge_job, 1)
+
+                    if job is None:
+                        self._slots.release()
+                        continue
+
+                    asyncio.ensure_future(self._dispatch(job))
+            finally:
+                poller.cancel()
+
+    # Get the Judge0 batch of a queued submission, whether its test cases must be judged one by one, and its
+    # deadline, or None if an identical submission's results were copied to it instead (runs on the database thread)
+    def _build(self, job):
+        problem = Problem.query.filter_by(id=job['problem']).first()
+        submission = Submission.query.filter_by(id=job['submission']).first()
+
+        if copy_identical_results(submission, problem, job['file'], job['language']):
+            return None
+
+        return build_judge0_submissions(job['language'], job['file'], problem, self.s3, self.bucket_name), \
+            problem.fail_fast, judge_deadline(problem)
+
+    # Put a submission that couldn't be sent to the judge in the judge outbox (runs on the database thread)
+    def _add_to_outbox(self, job, error):
+        submission = Submission.query.filter_by(id=job['submission']).first()
+        add_to_outbox(submission, job['file'], job['language'], error)
+
+    # Give up on a submission's test cases that haven't finished by its deadline, skipping any that haven't
+    # been sent yet (runs on the database thread)
+    def _expire(self, submission_id, first=None):
+        submission = Submission.query.filter_by(id=submission_id).first()
+        expire_pending_results(submission)
+
+        if first is not None:
+            skip_remaining_results(submission, submission.problem, first)
+
+        finish_submission(submission)
+
+    # Create the pending results of a submission, starting at its first given test case, returning a dict of each
+    # token and its result's id, without the test cases that Judge0 rejected. If an earlier attempt already saved
+    # them (and failed after that), those are used instead (runs on the database thread)
+    def _create_results(self, job, judge0_tokens, first=0):
+        problem = Problem.query.filter_by(id=job['problem']).first()
+        submission = Submission.query.filter_by(id=job['submission']).first()
+
+        input_ids = [f.id for f in problem.input_files[first:first + len(judge0_tokens)]]
+        results = Result.query.filter(Result.submission_id == submission.id, Result.input_id.in_(input_ids)).all()
+
+        if not results:
+            results = create_pending_results(submission, problem, judge0_tokens, first)
+
+        return {r.token: r.id for r in results if r.token}
+
+    # Build a submission's test cases and add them to the runs waiting to be sent to Judge0
+    async def _dispatch(self, job):
+        try:
+            built = await self._in_db(self._build, job)
+        except Exception:
+            app.logger.exception(f"Could not build submission {job['submission']}")
+            self._slots.release()
+            return
+
+        # If the results were copied from an identical submission, it's already done
+        if built is None:
+            self._slots.release()
+            return
+
+        runs, fail_fast, self.deadlines[job['submission']] = built
+
+        # If the problem stops judging at the first failed test case, send the test cases one at a time instead
+        if fail_fast:
+            await self._judge_in_order(job, runs)
+            return
+
+        self._waiting.append((job, runs))
+        self._waiting_runs += len(runs)
+
+        # Send the runs as soon as there are enough to fill a batch, else wait a little for
+        # more submissions to arrive before sending a partial batch
+        if self._waiting_runs >= JUDGE0_BATCH_SIZE:
+            await self._flush()
+        elif self._flush_timer is None:
+            self._flush_timer = asyncio.get_event_loop().call_later(
+                self.coalesce_wait, lambda: asyncio.ensure_future(self._flush()))
+
+    # Send the waiting runs of as many submissions as fit into each Judge0 batch, then start tracking their tokens
+    async def _flush(self):
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+
+        while self._waiting:
+            # Take whole submissions until the batch is full (a submission's runs are never split between batches)
+            jobs = []
+            runs = 0
+            while self._waiting and (not jobs or runs + len(self._waiting[0][1]) <= JUDGE0_BATCH_SIZE):
+                jobs.append(self._waiting.pop(0))
+                runs += len(jobs[-1][1])
+            self._waiting_runs -= runs
+
+            await self._send(jobs)
+
+    # Send a batch of runs to the best Judge0 node (or the executor) and return their tokens. If a node can't be
+    # connected to (so it never got the batch), the next best node is tried instead
+    async def _create_batch(self, runs):
+        loop = asyncio.get_event_loop()
+
+        if not self.judge0:
+            return await loop.run_in_executor(None, self.executor.create_batch, runs)
+
+        # Choosing a node may check the nodes' queues, so it's done on a thread. If every node is out of rotation,
+        # this raises JudgeUnavailable. Only nodes that never got the batch are moved on from (see Judge0Pool)
+        nodes = await loop.run_in_executor(None, self.executor.choose)
+
+        error = None
+        for node in nodes:
+            try:
+                async with self.session.post(f'{node.url}/submissions/batch?base64_encoded=true',
+                                             json={'submissions': runs}) as response:
+                    if response.status in GATEWAY_ERRORS:
+                        raise aiohttp.ClientConnectionError(f'Judge0 returned {response.status}')
+
+                    response.raise_for_status()
+                    judge0_tokens = check_tokens(await response.json(content_type=None), len(runs))
+            except aiohttp.ClientConnectionError as e:
+                node.failed()
+                error = e
+                continue
+            except JudgeUnavailable:
+                raise
+            except Exception as e:
+                if node_error(e):
+                    node.failed()
+                raise JudgeUnavailable(f'Judge0 node {node.url} failed: {e}') from e
+
+            node.succeeded()
+            node.sent += len(runs)
+
+            for jt in judge0_tokens:
+                if jt.get('token'):
+                    self.token_nodes[jt['token']] = node.url
+
+            return [{**jt, 'node': node.url} for jt in judge0_tokens]
+
+        raise JudgeUnavailable(f'Could not reach any Judge0 node: {error}') from error
+
+    # Put a submission that couldn't be sent to the judge in the judge outbox, then free up its slot
+    async def _give_back(self, job, error):
+        self.deadlines.pop(job['submission'], None)
+
+        try:
+            await self._in_db(self._add_to_outbox, job, error)
+        except Exception:
+            app.logger.exception(f"Could not add submission {job['submission']} to the judge outbox")
+        finally:
+            self._slots.release()
+
+    # Send the runs of several submissions to Judge0 in one batch, then give each submission back its own tokens
+    async def _send(self, jobs):
+        try:
+            judge0_tokens = await self._create_batch([s for _, runs in jobs for s in runs])
+        except Exception as e:
+            app.logger.warning(f'Could not send submissions {[job["submission"] for job, _ in jobs]} to the '
+                               f'judge, adding them to the outbox: {e}')
+            for job, _ in jobs:
+                await self._give_back(job, e)
+            return
+
+        # The tokens come back in the same order as the runs were sent. If a submission's results can't be saved
+        # even after trying again, it's put in the judge outbox, so it's sent again instead of never finishing
+        i = 0
+        for job, runs in jobs:
+            try:
+                results = await self._in_db_retrying(self._create_results, job, judge0_tokens[i:i + len(runs)])
+            except Exception as e:
+                app.logger.exception(f"Could not create the results of submission {job['submission']}, adding it "
+                                     f"to the outbox")
+                await self._give_back(job, e)
+                i += len(runs)
+                continue
+
+            # If Judge0 rejected every test case of the submission, it's already done
+            if results:
+                self.in_flight[job['submission']] = results
+            else:
+                self.deadlines.pop(job['submission'], None)
+                self._slots.release()
+
+            i += len(runs)
+
+    # Get a batch of tokens from the Judge0 node that they were sent to (or the executor)
+    async def _get_batch(self, node_url, tokens):
+        if not self.judge0:
+            return await asyncio.get_event_loop().run_in_executor(None, self.executor.get_batch, tokens)
+
+        node = self.executor.node(node_url)
+
+        try:
+            async with self.session.get(f"{node.url}/submissions/batch?tokens={','.join(tokens)}"
+                                        f"&base64_encoded=true&fields={RESULT_FIELDS}") as response:
+                response.raise_for_status()
+                batch = check_batch(await response.json(content_type=None), len(tokens))
+        except Exception as e:
+            if node_error(e):
+                node.failed()
+            raise
+
+        node.succeeded()
+
+        return batch
+
+    # Stop tracking which node a finished token was sent to
+    def _forget(self, token):
+        self.token_nodes.pop(token, None)
+
+    # Fill in the results of a submission's finished tokens, then mark the submission as done if
+    # they were its last ones (runs on the database thread)
+    def _record(self, submission_id, tokens, finished):
+        submission = Submission.query.filter_by(id=submission_id).first()
+
+        for token in tokens:
+            record_result(Result.query.filter_by(id=self.in_flight[submission_id][token]).first(), finished[token],
+                          submission.problem)
+
+        db.session.commit()
+
+        finish_submission(submission)
+
+    # Fill in the result of a test case that was sent on its own, skipping the rest if it failed. Returns
+    # whether the next test case should be run (runs on the database thread)
+    def _record_in_order(self, job, result_id, s, index):
+        problem = Problem.query.filter_by(id=job['problem']).first()
+        submission = Submission.query.filter_by(id=job['submission']).first()
+        result = Result.query.filter_by(id=result_id).first()
+        return record_result_in_order(submission, problem, result, s, index)
+
+    # Send a submission's test cases one at a time, in order, stopping at the first one that fails. If the judge
+    # goes down, the submission is put in the judge outbox, and if its deadline passes, it's given up on
+    async def _judge_in_order(self, job, runs):
+        deadline = self.deadlines.pop(job['submission'])
+
+        try:
+            for i, run in enumerate(runs):
+                try:
+                    judge0_tokens = await self._create_batch([run])
+                except JudgeUnavailable as e:
+                    app.logger.warning(f"Could not send submission {job['submission']} to the judge, adding it "
+                                       f"to the outbox: {e}")
+                    await self._in_db(self._add_to_outbox, job, e)
+                    return
+
+                try:
+                    results = await self._in_db_retrying(self._create_results, job, judge0_tokens, i)
+                except Exception as e:
+                    app.logger.exception(f"Could not create the results of submission {job['submission']}, adding "
+                                         f"it to the outbox")
+                    await self._in_db(self._add_to_outbox, job, e)
+                    return
+
+                # If Judge0 rejected the test case, it failed, so the rest are skipped
+                if not results:
+                    await self._in_db(self._expire, job['submission'], i + 1)
+                    return
+
+                (token, result_id), = results.items()
+
+                # Wait for the test case to finish
+                while True:
+                    await asyncio.sleep(self.poll_interval)
+
+                    if time() > deadline:
+                        self._forget(token)
+                        await self._in_db(self._expire, job['submission'], i + 1)
+                        return
+
+                    try:
+                        s = (await self._get_batch(self.token_nodes.get(token), [token]))[0]
+                    except JudgeUnavailable:
+                        continue
+
+                    if s['status']['id'] not in PENDING_STATUSES:
+                        break
+
+                self._forget(token)
+
+                if not await self._in_db(self._record_in_order, job, result_id, s, i):
+                    break
+        except Exception:
+            app.logger.exception(f"Could not judge submission {job['submission']}")
+        finally:
+            self._slots.release()
+
+    # Poll every in-flight token at once, in as few Judge0 requests as possible
+    async def _poll_forever(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+
+            # Group the tokens by the node that they were sent to
+            tokens_by_node = {}
+            for submission_tokens in self.in_flight.values():
+                for token in submission_tokens:
+                    tokens_by_node.setdefault(self.token_nodes.get(token), []).append(token)
+
+            if not tokens_by_node:
+                continue
+
+            # Get every batch of tokens from every node concurrently
+            batches = await asyncio.gather(
+                *[self._get_batch(node_url, tokens[i:i + JUDGE0_BATCH_SIZE])
+                  for node_url, tokens in tokens_by_node.items() for i in range(0, len(tokens), JUDGE0_BATCH_SIZE)],
+                return_exceptions=True)
+
+            finished = {}
+            for batch in batches:
+                if isinstance(batch, Exception):
+                    app.logger.warning(f'Could not poll Judge0: {batch}')
+                    continue
+
+                for s in batch:
+                    if s['status']['id'] not in PENDING_STATUSES:
+                        finished[s['token']] = s
+
+            # Save each finished test case right away (so students see it as soon as possible), then stop polling
+            # it. Once a submission has no more tokens, free up its slot. If they can't be saved, the submission's
+            # tokens stay in flight, and they're saved the next time they're polled after backing off
+            for submission_id, submission_tokens in list(self.in_flight.items()):
+                finished_tokens = [token for token in submission_tokens if token in finished]
+                if not finished_tokens or self._retry_at.get(submission_id, 0) > time():
+                    continue
+
+                try:
+                    await self._in_db(self._record, submission_id, finished_tokens, finished)
+                except Exception:
+                    app.logger.exception(f'Could not record the results of submission {submission_id}, trying again')
+                    self._failed(submission_id)
+                    continue
+
+                self._failures.pop(submission_id, None)
+                self._retry_at.pop(submission_id, None)
+
+                for token in finished_tokens:
+                    del submission_tokens[token]
+                    self._forget(token)
+
+                if not submission_tokens:
+                    self._done(submission_id)
+
+            # Give up on the submissions that haven't finished by their deadline (the ones that can't be given up on
+            # right now stay in flight, and are tried again after backing off)
+            for submission_id, submission_tokens in list(self.in_flight.items()):
+                if time() <= self.deadlines.get(submission_id, time()) or self._retry_at.get(submission_id, 0) > time():
+                    continue
+
+                app.logger.warning(f'Submission {submission_id} did not finish judging before its deadline')
+
+                try:
+                    await self._in_db(self._expire, submission_id)
+                except Exception:
+                    app.logger.exception(f'Could not give up on submission {submission_id}, trying again')
+                    self._failed(submission_id)
+                    continue
+
+                for token in submission_tokens:
+                    self._forget(token)
+
+                self._done(submission_id)
+
+    # Count a failure to record an in-flight submission's results (or to give up on it), and back off before it's
+    # tried again
+    def _failed(self, submission_id):
+        self._failures[submission_id] = self._failures.get(submission_id, 0) + 1
+        self._retry_at[submission_id] = time() + backoff_delay(self._failures[submission_id] - 1)
+
+    # Stop tracking a submission that has finished judging (or was given up on), and free up its slot
+    def _done(self, submission_id):
+        del self.in_flight[submission_id]
+        self.deadlines.pop(submission_id, None)
+        self._failures.pop(submission_id, None)
+        self._retry_at.pop(submission_id, None)
+        self._slots.release()
@@ -0,0 +1,49 @@
+import random
+from application import app
+
+
+# Raised when test cases can't be sent to or gotten from the judge, such as when every Judge0 node is out of rotation,
+# or a node didn't answer properly even after being retried
+class JudgeUnavailable(Exception):
+    pass
+
+
+# Get the number of seconds to wait before trying something for the given time again (starting at 0), which doubles
+# each time up to a maximum, with some randomness so that everything waiting doesn't try again at the same moment
+def backoff_delay(attempt):
+    return min(app.config['JUDGE_BACKOFF_BASE'] * 2 ** attempt, app.config['JUDGE_BACKOFF_MAX']) * \
+        random.uniform(0.5, 1)
+
+
+# Something that runs test cases, such as Judge0 or the local executor. Test cases are sent and returned in Judge0's
+# format (with the source code, stdin, expected output and outputs base64 encoded, and Judge0's status ids), so
+# every executor creates the same results
+class Executor:
+    # Whether the executor can send each finished test case to a callback URL instead of being polled
+    supports_callbacks = False
+
+    # Start running a batch of test cases, returning a list with a dict with the token of each one (and the
+    # node that it was sent to, for executors with more than one)
+    def create_batch(self, submissions):
+        raise NotImplementedError
+
+    # Get a batch of test cases by their tokens, which have the status "In Queue" or "Processing" until they finish.
+    # nodes is a dict of the node that each token was sent to
+    def get_batch(self, tokens, nodes=None):
+        raise NotImplementedError
+
+    # Raise JudgeUnavailable if test cases can't be run right now
+    def check(self):
+        pass
+
+
+# Get this process's executor, chosen by the JUDGE_EXECUTOR setting
+def get_executor():
+    # Imported here, since both executors are built on the Executor class above
+    from application.judge.client import get_judge0_client
+    from application.judge.local import get_local_executor
+
+    if app.config['JUDGE_EXECUTOR'] == 'local':
+        return get_local_executor()
+
+    return get_judge0_client()
@@ -0,0 +1,550 @@
+import json
+import base64
+from time import sleep, time
+from hashlib import sha256
+from datetime import datetime, timedelta
+from sqlalchemy import case, cast, func
+from sqlalchemy.exc import IntegrityError
+from application import app, db, redis_store
+from application.models.general import Result, Submission, JudgeOutbox, StudentProblemScore
+from application.registry import registry
+from application.events import publish_event
+from application.judge.cache import test_case_cache, test_case_key
+from application.judge.executor import JudgeUnavailable, backoff_delay
+from application.judge.client import token_error
+from application.judge.admission import judging_stopped
+from application.judge.output import save_output
+from application.utils import count_finished_submission
+
+
+# Judge0 statuses of test cases that haven't finished running (1: in queue, 2: processing)
+PENDING_STATUSES = (1, 2)
+
+# The status of test cases that were never run, because an earlier one failed in a problem that stops
+# judging at the first failed test case (it isn't a Judge0 status, so it's added by reset_database.py and the
+# migrations)
+SKIPPED_STATUS = 15
+
+# The status of test cases that the judge never finished running (before the deadline)
+INTERNAL_ERROR_STATUS = 13
+
+# The test cases that Judge0 called back with before their submission's pending results were saved, by their token,
+# which are recorded once they are (see record_callback). Kept for an hour at most
+EARLY_CALLBACKS = 'judge:callbacks:early:{}'
+EARLY_CALLBACKS_EXPIRY = 3600
+
+# The submissions whose results Judge0 calls back with, by their deadline, after which the test cases that
+# still haven't called back are polled, and the ones that still haven't finished are given up on
+CALLBACK_SUBMISSIONS = 'judge:callbacks:submissions'
+
+
+# Raised when a status that judging needs isn't in the database, such as when the migrations haven't been run
+class MissingStatus(Exception):
+    pass
+
+
+# Get a status that judging needs by its number, which must be in the database
+def required_status(number):
+    status = registry.status(number)
+
+    if status is None:
+        raise MissingStatus(f'Status {number} is not in the status table, run "flask db upgrade" to add it')
+
+    return status
+
+
+# Decode a base64 field returned by Judge0, if it exists
+def decode_field(value):
+    if value:
+        return base64.b64decode(value).decode()
+    return value
+
+
+# Build the Judge0 submission (one per test case) for a submission's source code. If callback_url is given, Judge0
+# will PUT each finished test case to it
+def build_judge0_submissions(language, file, problem, s3, bucket_name, callback_url=None):
+    submissions = []
+
+    # The source code is the same for every test case, so it's only encoded once
+    source_code = base64.b64encode(file.encode()).decode()
+
+    # For every input file (and its output file) in the problem
+    for input_file, output_file in zip(problem.input_files, problem.output_files):
+        # Get the files already base64 encoded from the test case cache, which only downloads them from S3 if this
+        # worker hasn't already
+        # Add the language, source code, the STDIN (standard input), expected output, time limit, and memory limit
+        judge0_submission = {'language_id': int(language), 'source_code': source_code,
+                             'stdin': test_case_cache.fetch_payload(s3, bucket_name, input_file),
+                             'expected_output': test_case_cache.fetch_payload(s3, bucket_name, output_file),
+                             'cpu_time_limit': problem.time_limit,
+                             'memory_limit': problem.memory_limit * 1000}
+
+        if callback_url:
+            judge0_submission['callback_url'] = callback_url
+
+        submissions.append(judge0_submission)
+
+    return submissions
+
+
+# Get the key of everything that decides a submission's results: the problem, the code, the language, the version
+# of the problem's test cases (the keys of its files), the time and memory limits, and whether it stops judging at
+# the first failed test case
+def get_judge_key(problem, file, language):
+    test_cases = ','.join(test_case_key(f) for f in problem.input_files + problem.output_files)
+    key = f'{problem.id}:{sha256(file.encode()).hexdigest()}:{int(language)}:{test_cases}:' \
+          f'{problem.time_limit}:{problem.memory_limit}:{problem.fail_fast}'
+
+    return sha256(key.encode()).hexdigest()
+
+
+# If an identical submission (one with the same judge key) has already been judged, copy its results to the
+# submission and finish it instead of running it through Judge0 again. Returns whether the results were copied.
+# Submissions that the judge didn't finish cleanly (any of their test cases got the "Internal Error" status, such as
+# after the deadline or when it was given up on in the judge outbox) are never copied, so they're judged again
+def copy_identical_results(submission, problem, file, language):
+    submission.judge_key = get_judge_key(problem, file, language)
+    db.session.commit()
+
+    unfinished = [registry.status(number).id for number in PENDING_STATUSES + (INTERNAL_ERROR_STATUS,)]
+    failed = Result.query.filter(Result.submission_id == Submission.id, Result.status_id.in_(unfinished)).exists()
+
+    previous = Submission.query.filter(Submission.judge_key == submission.judge_key, Submission.done == True,
+                                       Submission.id != submission.id, ~failed).order_by(Submission.id.desc()).first()
+
+    if previous is None or not previous.results:
+        return False
+
+    # Each test case is weighted equally (the problem's marks may have changed since)
+    total_marks = round(problem.total_marks / len(problem.input_files), 2)
+
+    # The outputs are copied still compressed (and the ones stored in S3 are shared)
+    for r in Result.query.filter_by(submission_id=previous.id).options(db.undefer_group('output')).all():
+        db.session.add(Result(input_id=r.input_id, output_id=r.output_id, submission=submission, token=r.token,
+                              stderr_data=r.stderr_data, stdout_data=r.stdout_data, time=r.time, memory=r.memory,
+                              compile_output_data=r.compile_output_data, output_path=r.output_path,
+                              correct=r.correct, status_id=r.status_id, marks_out_of=total_marks,
+                              marks=total_marks if r.correct else 0))
+
+    db.session.commit()
+
+    finish_submission(submission)
+
+    return True
+
+
+# A finished Judge0 submission (in the format that Judge0 returns) for a test case that Judge0 rejected instead of
+# returning its token, with the "Internal Error" status and Judge0's error message as its standard error
+def rejected_submission(jt):
+    return {'token': '', 'status': {'id': INTERNAL_ERROR_STATUS},
+            'stderr': base64.b64encode(token_error(jt).encode()).decode()}
+
+
+# Create a result for each test case of a submission as soon as Judge0 returns its tokens, in the "In Queue"
+# status, so any worker (or the callback route) can later fill in the result by its token. The tokens belong to
+# the test cases starting at the first one given (when the test cases are sent one by one). Test cases that Judge0
+# rejected are recorded right away as failed, without failing the rest of the submission (or the batch)
+def create_pending_results(submission, problem, judge0_tokens, first=0):
+    in_queue = registry.status(1)
+
+    # Each test case is weighted equally
+    total_marks = round(problem.total_marks / len(problem.input_files), 2)
+
+    # The submission has been sent, so if it was in the judge outbox, it's no longer there
+    if first == 0:
+        JudgeOutbox.query.filter_by(submission_id=submission.id).delete()
+
+    results = []
+    rejected = False
+    for i, jt in enumerate(judge0_tokens, start=first):
+        r = Result(input_file=problem.input_files[i], output_file=problem.output_files[i], submission=submission,
+                   token=jt.get('token') or '', node=jt.get('node'), status_id=in_queue.id, marks_out_of=total_marks,
+                   marks=0)
+
+        if token_error(jt):
+            app.logger.warning(f'Judge0 rejected a test case of submission {submission.id}: {token_error(jt)}')
+            record_result(r, rejected_submission(jt), problem)
+            rejected = True
+
+        db.session.add(r)
+        results.append(r)
+
+    db.session.commit()
+
+    # If Judge0 rejected every test case, the submission is already done
+    if rejected:
+        finish_submission(submission)
+
+    return results
+
+
+# Fill in a pending result of a problem with a finished Judge0 submission (the "s" dict, base64 encoded)
+def record_result(result, s, problem):
+    # Get the relevant status based on the status id that was returned
+    status = registry.status(s['status']['id'])
+
+    result.time = s.get('time')
+    result.memory = s.get('memory')
+    result.status_id = status.id
+
+    save_output(result, problem, {'stdout': decode_field(s.get('stdout')), 'stderr': decode_field(s.get('stderr')),
+                                  'compile_output': decode_field(s.get('compile_output'))})
+
+    # If the status id is 3 "Accepted", then set correct to True and give the result its marks
+    result.correct = status.number == 3
+    result.marks = result.marks_out_of if result.correct else 0
+
+    return result
+
+
+# Create a "Skipped" result (or a result with another status), which earns no marks, for each
+# test case starting at the first one given
+def skip_remaining_results(submission, problem, first, status_number=SKIPPED_STATUS):
+    status = required_status(status_number)
+
+    # Each test case is weighted equally
+    total_marks = round(problem.total_marks / len(problem.input_files), 2)
+
+    for i in range(first, len(problem.input_files)):
+        db.session.add(Result(input_file=problem.input_files[i], output_file=problem.output_files[i],
+                              submission=submission, token='', status_id=status.id, correct=False,
+                              marks_out_of=total_marks, marks=0))
+
+    db.session.commit()
+
+
+# Get the time by which a submission to a problem must have finished judging: a minimum, plus a multiple of the
+# problem's time limit for each test case
+def judge_deadline(problem):
+    return time() + app.config['JUDGE_DEADLINE_MIN'] + \
+        len(problem.input_files) * problem.time_limit * app.config['JUDGE_DEADLINE_MULTIPLIER']
+
+
+# Give up on the test cases of a submission that still haven't finished (after its deadline), which get the
+# "Internal Error" status and earn no marks
+def expire_pending_results(submission):
+    internal_error = registry.status(INTERNAL_ERROR_STATUS)
+
+    for r in Result.query.filter_by(submission_id=submission.id).all():
+        if registry.status_by_id(r.status_id).number in PENDING_STATUSES:
+            r.status_id = internal_error.id
+            r.correct = False
+            r.marks = 0
+
+    db.session.commit()
+
+
+# Put a submission that couldn't be sent to the judge in the outbox, so it's sent again (from the start, so any
+# results it already has are deleted) once the judge recovers. After failing too many times, it's given up on and
+# every test case gets the "Internal Error" status
+def add_to_outbox(submission, code, language, error):
+    Result.query.filter_by(submission_id=submission.id).delete()
+
+    entry = JudgeOutbox.query.filter_by(submission_id=submission.id).first()
+    if entry is None:
+        entry = JudgeOutbox(submission_id=submission.id, code=code, language=int(language), attempts=0)
+        db.session.add(entry)
+
+    entry.attempts += 1
+    entry.error = str(error)[:1000]
+    entry.next_attempt_date_time = datetime.utcnow() + timedelta(seconds=backoff_delay(entry.attempts - 1))
+
+    if entry.attempts >= app.config['JUDGE_OUTBOX_MAX_ATTEMPTS']:
+        db.session.delete(entry)
+        db.session.commit()
+
+        skip_remaining_results(submission, submission.problem, 0, INTERNAL_ERROR_STATUS)
+        finish_submission(submission)
+        return
+
+    db.session.commit()
+
+    # The submission isn't being judged while it's in the outbox, so it doesn't take up the judge's room
+    judging_stopped(submission.id, finished=False)
+
+
+# Fill in the result of a test case that was sent on its own (in a problem that stops judging at the first failed
+# test case), and if it failed, skip every test case after it. Returns whether the next test case should be run
+def record_result_in_order(submission, problem, result, s, index):
+    record_result(result, s, problem)
+    db.session.commit()
+
+    if not result.correct:
+        skip_remaining_results(submission, problem, index + 1)
+
+    return not finish_submission(submission)
+
+
+# Judge a submission's test cases one at a time, in order, and stop at the first one that fails (including when
+# the code doesn't compile, which the first test case finds out), so broken code only costs Judge0 one run. If the
+# deadline passes, the test case that is running gets the "Internal Error" status, and the rest are skipped
+def judge_in_order(client, submission, problem, judge0_submissions, deadline, poll_interval=2):
+    for i, judge0_submission in enumerate(judge0_submissions):
+        result, = create_pending_results(submission, problem, client.create_batch([judge0_submission]), i)
+
+        # If Judge0 rejected the test case, it failed, so the rest are skipped
+        if not result.token:
+            skip_remaining_results(submission, problem, i + 1)
+            finish_submission(submission)
+            return
+
+        # Wait for the test case to finish
+        while True:
+            sleep(poll_interval)
+
+            if time() > deadline:
+                expire_pending_results(submission)
+                skip_remaining_results(submission, problem, i + 1)
+                finish_submission(submission)
+                return
+
+            try:
+                s = client.get_batch([result.token], {result.token: result.node})[0]
+            except JudgeUnavailable:
+                continue
+
+            if s['status']['id'] not in PENDING_STATUSES:
+                break
+
+        if not record_result_in_order(submission, problem, result, s, i):
+            break
+
+
+# If every result of a submission has finished, total up the marks and mark the submission as done.
+# Returns whether the submission is done
+def finish_submission(submission):
+    if submission.done:
+        return True
+
+    # Query the results again, since other workers or callbacks may have just recorded some of them
+    results = Result.query.filter_by(submission_id=submission.id).all()
+
+    # Let anyone watching the submission know which of its test cases have finished so far (test cases that are
+    # sent one by one don't have a result until they are sent, so there may also be fewer results than test cases)
+    if len(results) < len(submission.problem.input_files) or \
+            any(registry.status_by_id(r.status_id).number in PENDING_STATUSES for r in results):
+        publish_event(f'submission:{submission.id}', {'state': 'PROGRESS', 'result': submission_result(submission)})
+        return False
+
+    # Get the total marks earned from that submission and mark it as done, unless another worker (or callback) just
+    # has, so the submission is only counted in its student's score once
+    marks = round(sum(r.marks for r in results), 2)
+    if not Submission.query.filter_by(id=submission.id, done=False) \
+            .update({Submission.marks: marks, Submission.done: True}, synchronize_session='evaluate'):
+        return True
+
+    add_to_score(submission)
+    count_finished_submission(submission)
+
+    db.session.commit()
+
+    publish_event(f'submission:{submission.id}', {'state': 'SUCCESS', 'result': submission_result(submission)})
+
+    # Let the judge take the next submissions waiting in the admission queue
+    judging_stopped(submission.id)
+
+    return True
+
+
+# Count a submission that just finished in its student's score in its problem (in the same transaction as the
+# submission), creating the score if it's the student's first finished submission. An existing score is changed in
+# one UPDATE, so submissions of the same student that finish at once can't overwrite each other's changes
+def add_to_score(submission):
+    marks = submission.marks or 0
+    solved = marks >= submission.problem.total_marks
+    higher = StudentProblemScore.best_marks < marks
+    later = StudentProblemScore.last_submission_date_time < submission.date_time
+
+    updated = StudentProblemScore.query.filter_by(student_id=submission.student_id, problem_id=submission.problem_id) \
+        .update({StudentProblemScore.attempts: StudentProblemScore.attempts + 1,
+                 StudentProblemScore.best_marks: case([(higher, marks)], else_=StudentProblemScore.best_marks),
+                 StudentProblemScore.solved: case([(higher, solved)], else_=StudentProblemScore.solved),
+                 StudentProblemScore.last_submission_date_time: case(
+                     [(later, submission.date_time)],
+                     else_=func.coalesce(StudentProblemScore.last_submission_date_time, submission.date_time))},
+                synchronize_session=False)
+
+    if updated:
+        return
+
+    try:
+        with db.session.begin_nested():
+            db.session.add(StudentProblemScore(student_id=submission.student_id, problem_id=submission.problem_id,
+                                               best_marks=marks, attempts=1, solved=solved,
+                                               last_submission_date_time=submission.date_time))
+
+    # Another submission of the student created the score first, so update it instead
+    except IntegrityError:
+        add_to_score(submission)
+
+
+# Work out the scores of a problem's students (or only of one student) again from their finished submissions, after
+# their marks were changed (by a rescore, a rejudge, or a teacher). The scores of students who no longer have any
+# finished submissions are removed
+def refresh_scores(problem, student_id=None):
+    query = db.session.query(Submission.student_id, func.max(Submission.marks), func.count(Submission.id),
+                             func.max(Submission.date_time)) \
+        .filter(Submission.problem_id == problem.id, Submission.done == True).group_by(Submission.student_id)
+    scores = StudentProblemScore.query.filter_by(problem_id=problem.id)
+
+    if student_id is not None:
+        query = query.filter(Submission.student_id == student_id)
+        scores = scores.filter_by(student_id=student_id)
+
+    scores = {score.student_id: score for score in scores}
+
+    for student_id, best_marks, attempts, last_submission_date_time in query.all():
+        score = scores.pop(student_id, None)
+        if score is None:
+            score = StudentProblemScore(student_id=student_id, problem_id=problem.id)
+            db.session.add(score)
+
+        score.best_marks = best_marks or 0
+        score.attempts = attempts
+        score.last_submission_date_time = last_submission_date_time
+        score.solved = score.best_marks >= problem.total_marks
+
+    for score in scores.values():
+        db.session.delete(score)
+
+    db.session.commit()
+
+
+# Rescore every submission of a problem after its total marks changed, in a few UPDATE statements instead of loading
+# each result: each result's marks out of (every test case is weighted equally) and its marks, then each finished
+# submission's marks from its results (or the full marks, if the problem isn't auto graded). Marks that a teacher set
+# by hand are kept, but never more than the new total
+def rescore_problem(problem):
+    submission_ids = db.session.query(Submission.id).filter(Submission.problem_id == problem.id)
+    not_overridden = Submission.marks_overridden.isnot(True)
+
+    if problem.auto_grade and problem.input_files:
+        total_marks = round(problem.total_marks / len(problem.input_files), 2)
+
+        Result.query.filter(Result.submission_id.in_(submission_ids.subquery())).update(
+            {Result.marks_out_of: total_marks, Result.marks: case([(Result.correct == True, total_marks)], else_=0)},
+            synchronize_session=False)
+
+        earned = db.session.query(func.coalesce(func.sum(Result.marks), 0)) \
+            .filter(Result.submission_id == Submission.id).as_scalar()
+
+        Submission.query.filter(Submission.problem_id == problem.id, Submission.done == True, not_overridden) \
+            .update({Submission.marks: func.round(cast(earned, db.Numeric), 2)}, synchronize_session=False)
+
+    else:
+        Submission.query.filter(Submission.problem_id == problem.id, not_overridden) \
+            .update({Submission.marks: problem.total_marks}, synchronize_session=False)
+
+    Submission.query.filter(Submission.problem_id == problem.id, Submission.marks_overridden == True,
+                            Submission.marks > problem.total_marks) \
+        .update({Submission.marks: problem.total_marks}, synchronize_session=False)
+
+    db.session.commit()
+
+    # Then the students' best scores from their new marks
+    refresh_scores(problem)
+
+
+# Get the result of a submission in the same format as the judge task's result. While the submission is still
+# running, each test case says whether it has finished, and the total only counts the finished test cases
+def submission_result(submission):
+    result = {'submissions': []}
+    for r in sorted(submission.results, key=lambda r: r.id):
+        status = registry.status_by_id(r.status_id)
+        result['submissions'].append({"time": r.time,
+                                      "memory": r.memory,
+                                      "status": status.name,
+                                      "correct": r.correct,
+                                      "total_marks": r.marks_out_of,
+                                      "marks": r.marks,
+                                      "finished": status.number not in PENDING_STATUSES})
+
+    if submission.done:
+        result['total_marks_earned'] = submission.marks
+    else:
+        result['total_marks_earned'] = round(sum(r.marks for r in submission.results if r.marks), 2)
+
+    result['total_marks'] = submission.problem.total_marks
+
+    return result
+
+
+# Record a result that Judge0 sent to the callback route, then finish the submission if that was its last result.
+# Judge0 can call back before the worker that sent the test cases has saved their pending results, so a test case
+# whose result doesn't exist yet is kept until record_early_callbacks records it. It's kept before checking for the
+# result again, and whichever of the two takes it out first records it, so it can't be missed by both
+def record_callback(submission_id, s):
+    result = Result.query.filter_by(submission_id=submission_id, token=s.get('token')).first()
+
+    if result is None:
+        key = EARLY_CALLBACKS.format(submission_id)
+        redis_store.hset(key, s.get('token'), json.dumps(s))
+        redis_store.expire(key, EARLY_CALLBACKS_EXPIRY)
+
+        # Start a new transaction, so the results that were saved in the meantime can be seen
+        db.session.rollback()
+        result = Result.query.filter_by(submission_id=submission_id, token=s.get('token')).first()
+
+        if result is None or not redis_store.hdel(key, s.get('token')):
+            return
+
+    record_result(result, s, result.submission.problem)
+
+    # Commit the result before checking the others, so two callbacks arriving
+    # at the same time can't both see each other's result as still pending
+    db.session.commit()
+
+    finish_submission(Submission.query.filter_by(id=submission_id).first())
+
+
+# Record the test cases of a submission that Judge0 called back with before its pending results were saved, and
+# expect the rest by the deadline (see sweep_callback_submissions)
+def record_early_callbacks(submission, problem, results, deadline):
+    redis_store.zadd(CALLBACK_SUBMISSIONS, {submission.id: deadline})
+
+    key = EARLY_CALLBACKS.format(submission.id)
+    pending = {r.token: r for r in results if r.token}
+
+    for token, s in redis_store.hgetall(key).items():
+        token = token.decode()
+
+        if token in pending and redis_store.hdel(key, token):
+            record_result(pending[token], json.loads(s), problem)
+
+    db.session.commit()
+
+    finish_submission(submission)
+
+
+# Poll the test cases of the submissions that Judge0 calls back with whose deadline has passed (in case their
+# callbacks were lost), then give up on the ones that still haven't finished. Returns the number of submissions
+def sweep_callback_submissions(client):
+    submission_ids = redis_store.zrangebyscore(CALLBACK_SUBMISSIONS, '-inf', time())
+
+    for submission_id in submission_ids:
+        submission = Submission.query.filter_by(id=int(submission_id)).first()
+
+        if submission is not None and not submission.done:
+            pending = {r.token: r for r in submission.results
+                       if registry.status_by_id(r.status_id).number in PENDING_STATUSES}
+
+            try:
+                batch = client.get_batch(list(pending), {t: r.node for t, r in pending.items()}) if pending else []
+            except JudgeUnavailable as e:
+                app.logger.warning(f'Could not get the results of submission {submission.id}: {e}')
+                batch = []
+
+            for s in batch:
+                if s['status']['id'] not in PENDING_STATUSES and s['token'] in pending:
+                    record_result(pending[s['token']], s, submission.problem)
+
+            db.session.commit()
+
+            if not finish_submission(submission):
+                app.logger.warning(f'Submission {submission.id} did not finish judging before its deadline')
+                expire_pending_results(submission)
+                finish_submission(submission)
+
+        redis_store.zrem(CALLBACK_SUBMISSIONS, submission_id)
+
+    return len(submission_ids)
@@ -0,0 +1,338 @@
+import os
+import pwd
+import math
+import time
+import uuid
+import base64
+import shutil
+import signal
+import resource
+import tempfile
+import threading
+import subprocess
+from hashlib import sha256
+from concurrent.futures import ThreadPoolExecutor
+from application import app
+from application.judge.executor import Executor
+
+
+# How to compile (if needed) and run each language that the local executor supports, by its Judge0 language id.
+# Programs are compiled in their build directory, then run from it ({build}) in a directory of their own
+C = {'source_file': 'main.c', 'compile': ['gcc', '-O2', '-o', 'main', 'main.c', '-lm'], 'run': ['{build}/main']}
+CPP = {'source_file': 'main.cpp', 'compile': ['g++', '-O2', '-o', 'main', 'main.cpp'], 'run': ['{build}/main']}
+PYTHON = {'source_file': 'main.py', 'compile': None, 'run': ['python3', '{build}/main.py']}
+LANGUAGES = {48: C, 49: C, 50: C, 75: C, 52: CPP, 53: CPP, 54: CPP, 76: CPP, 71: PYTHON}
+
+# The Judge0 statuses that the local executor gives its test cases
+STATUSES = {1: 'In Queue', 2: 'Processing', 3: 'Accepted', 4: 'Wrong Answer', 5: 'Time Limit Exceeded',
+            6: 'Compilation Error', 7: 'Runtime Error (SIGSEGV)', 8: 'Runtime Error (SIGXFSZ)',
+            9: 'Runtime Error (SIGFPE)', 10: 'Runtime Error (SIGABRT)', 11: 'Runtime Error (NZEC)',
+            12: 'Runtime Error (Other)', 13: 'Internal Error'}
+
+# The statuses of programs that were killed by each signal
+SIGNAL_STATUSES = {signal.SIGSEGV: 7, signal.SIGXFSZ: 8, signal.SIGFPE: 9, signal.SIGABRT: 10}
+
+# The longest (in seconds) that compiling a program can take, the most memory (in bytes) that the compiler can use,
+# and the most output (in bytes) that a program can write
+COMPILE_TIME_LIMIT = 10
+COMPILE_MEMORY_LIMIT = 1024 * 1024 * 1024
+OUTPUT_LIMIT = 16000000
+
+# The only environment variables that compilers and programs get, so they can't read the worker's (such as its secret
+# key, database URL, and AWS credentials)
+ENVIRONMENT = {'PATH': '/usr/local/bin:/usr/bin:/bin', 'LANG': 'C.UTF-8'}
+
+# How often (in seconds) a running program's memory is checked
+MEMORY_SAMPLE_INTERVAL = 0.005
+
+
+# Get the most memory (in kilobytes) that a running process has used so far, or 0 if it has already exited
+def peak_memory(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+
+    return 0
+
+
+# Get a function that limits the process it's run in (before a compiler or program starts) to an amount of CPU time
+# and memory (address space), then switches to the user that programs are run as (LOCAL_JUDGE_USER, if set), so it
+# can't read the app's files. A process that goes over its CPU time limit is killed
+def limit_process(cpu_time_limit, memory_limit):
+    user = app.config['LOCAL_JUDGE_USER'] and pwd.getpwnam(app.config['LOCAL_JUDGE_USER'])
+
+    def set_limits():
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_time_limit, cpu_time_limit + 1))
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+        resource.setrlimit(resource.RLIMIT_FSIZE, (OUTPUT_LIMIT, OUTPUT_LIMIT))
+        resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+
+        if user:
+            os.setgroups([])
+            os.setgid(user.pw_gid)
+            os.setuid(user.pw_uid)
+
+    return set_limits
+
+
+# Make a temporary directory for compiling or running a program, which the user that programs are run as can use
+def make_directory(prefix):
+    directory = tempfile.mkdtemp(prefix=prefix)
+
+    if app.config['LOCAL_JUDGE_USER']:
+        user = pwd.getpwnam(app.config['LOCAL_JUDGE_USER'])
+        os.chown(directory, user.pw_uid, user.pw_gid)
+
+    return directory
+
+
+# Base64 encode a field in the same way as Judge0, if it exists
+def encode_field(value):
+    if value:
+        return base64.b64encode(value).decode()
+    return None
+
+
+# Get a test case in Judge0's format with a status (and any other fields)
+def with_status(status_id, **fields):
+    return {'stdout': None, 'stderr': None, 'compile_output': None, 'time': None, 'memory': None,
+            **fields, 'status': {'id': status_id, 'description': STATUSES[status_id]}}
+
+
+# A program that is compiled once, then run by every test case of the submissions with the same source code
+class Build:
+    def __init__(self):
+        # Held while the program is being compiled, so the other test cases wait for it instead of compiling it again
+        self.lock = threading.Lock()
+        self.compiled = False
+
+        # The directory of the compiled program, the compiler's output (shared by every
+        # test case), and the test case to return instead of running if it couldn't be compiled
+        self.directory = None
+        self.compile_output = None
+        self.error = None
+
+        # The number of test cases that haven't run the program yet
+        self.runs = 0
+
+
+# An executor that runs test cases on this machine instead of in Judge0, in a pool with one thread per program that
+# can run at once. A submission's code is compiled once, then each of its test cases runs the compiled program in its
+# own temporary directory, with its CPU time, memory (address space), and output limited with rlimits. It isn't as
+# isolated as Judge0, so it's meant for judging next to the workers and for load testing without Judge0
+class LocalExecutor(Executor):
+    def __init__(self, workers):
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+
+        # The test cases that haven't been returned by get_batch yet, by their token
+        self.runs = {}
+
+        # The programs that test cases are going to run, by the key of their language and source code. A program
+        # is deleted once every test case has run it
+        self.builds = {}
+        self.builds_lock = threading.Lock()
+
+    def create_batch(self, submissions):
+        tokens = []
+        for s in submissions:
+            key = sha256(f"{s['language_id']}:{s['source_code']}".encode()).hexdigest()
+
+            with self.builds_lock:
+                self.builds.setdefault(key, Build()).runs += 1
+
+            token = str(uuid.uuid4())
+            self.runs[token] = self.pool.submit(self._run, s, key)
+            tokens.append({'token': token})
+
+        return tokens
+
+    def get_batch(self, tokens, nodes=None):
+        batch = []
+        for token in tokens:
+            future = self.runs.get(token)
+
+            # The token doesn't exist (it was created by another process, or was already returned)
+            if future is None:
+                s = with_status(13, compile_output=encode_field(b'The test case could not be found'))
+
+            elif not future.done():
+                s = with_status(2 if future.running() else 1)
+
+            # Once a test case has finished, it's returned once, then forgotten
+            else:
+                del self.runs[token]
+
+                try:
+                    s = future.result()
+                except Exception:
+                    app.logger.exception(f'Could not run test case {token}')
+                    s = with_status(13)
+
+            s['token'] = token
+            batch.append(s)
+
+        return batch
+
+    # Run a test case with its program, which the first test case to get here compiles for the others
+    def _run(self, submission, key):
+        build = self.builds[key]
+
+        try:
+            language = LANGUAGES.get(int(submission['language_id']))
+
+            if language is None:
+                return with_status(13, compile_output=encode_field(
+                    f"Language {submission['language_id']} can't be run by the local judge".encode()))
+
+            with build.lock:
+                if not build.compiled:
+                    self._compile(build, language, submission)
+
+            # If the program couldn't be compiled, every test case gets the same compilation error
+            if build.error:
+                return dict(build.error)
+
+            command = [part.format(build=build.directory) for part in language['run']]
+            directory = make_directory('codeio-judge-')
+
+            try:
+                return self._execute(command, directory, submission, build.compile_output)
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+        finally:
+            self._release(key)
+
+    # Write a program's source code to its build directory and compile it (if its language needs to be)
+    def _compile(self, build, language, submission):
+        build.directory = make_directory('codeio-build-')
+        build.compiled = True
+
+        source_path = os.path.join(build.directory, language['source_file'])
+        with open(source_path, 'wb') as f:
+            f.write(base64.b64decode(submission['source_code']))
+        os.chmod(source_path, 0o644)
+
+        if not language['compile']:
+            return
+
+        # The compiler is limited like the programs are, and it's killed (along with
+        # anything it started, such as the compiler's own stages) after a wall clock limit
+        process = subprocess.Popen(language['compile'], cwd=build.directory, env=ENVIRONMENT, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT, preexec_fn=limit_process(COMPILE_TIME_LIMIT,
+                                                                                     COMPILE_MEMORY_LIMIT),
+                                   start_new_session=True)
+
+        try:
+            output, _ = process.communicate(timeout=COMPILE_TIME_LIMIT)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+            process.communicate()
+            build.error = with_status(6, compile_output=encode_field(b'Compilation took too long'))
+            return
+
+        build.compile_output = encode_field(output)
+
+        if process.returncode != 0:
+            build.error = with_status(6, compile_output=build.compile_output)
+
+    # Let a program know that one of its test cases has run it, and delete it once they all have
+    def _release(self, key):
+        with self.builds_lock:
+            build = self.builds[key]
+            build.runs -= 1
+
+            if build.runs == 0:
+                del self.builds[key]
+
+                if build.directory:
+                    shutil.rmtree(build.directory, ignore_errors=True)
+
+    # Run a compiled program with the test case's input and limits, and check its output. Only the time that the
+    # program itself takes counts, since compiling it is shared by every test case
+    def _execute(self, command, directory, submission, compile_output):
+        time_limit = float(submission['cpu_time_limit'])
+
+        # Judge0's memory limit is in kilobytes
+        memory_limit = int(submission['memory_limit']) * 1024
+
+        # The CPU time limit is rounded up to a whole second, so the exact limit is checked after
+        set_limits = limit_process(math.ceil(time_limit), memory_limit)
+
+        stdin_path = os.path.join(directory, 'stdin')
+        stdout_path = os.path.join(directory, 'stdout')
+        stderr_path = os.path.join(directory, 'stderr')
+
+        with open(stdin_path, 'wb') as f:
+            f.write(base64.b64decode(submission.get('stdin') or ''))
+
+        with open(stdin_path, 'rb') as stdin, open(stdout_path, 'wb') as stdout, open(stderr_path, 'wb') as stderr:
+            process = subprocess.Popen(command, cwd=directory, env=ENVIRONMENT, stdin=stdin, stdout=stdout,
+                                       stderr=stderr, preexec_fn=set_limits, start_new_session=True)
+
+        # A program that is sleeping or waiting for input doesn't use any CPU time, so
+        # it's also killed (along with anything it started) after a wall clock limit
+        deadline = time.monotonic() + time_limit * 2 + 1
+        killed = False
+
+        # Wait for the program, checking how much memory it has used until it exits. The memory that wait4 returns
+        # can't be used, since it also counts the memory of this process, which the program was forked from
+        memory = 0
+        while True:
+            pid, exit_status, usage = os.wait4(process.pid, os.WNOHANG)
+            if pid:
+                break
+
+            memory = max(memory, peak_memory(process.pid))
+
+            if not killed and time.monotonic() > deadline:
+                os.killpg(process.pid, signal.SIGKILL)
+                killed = True
+
+            time.sleep(MEMORY_SAMPLE_INTERVAL)
+
+        process.returncode = exit_status
+
+        with open(stdout_path, 'rb') as f:
+            output = f.read()
+        with open(stderr_path, 'rb') as f:
+            error = f.read()
+
+        cpu_time = usage.ru_utime + usage.ru_stime
+
+        # The time (in seconds) and memory (in kilobytes), in the same format as Judge0
+        fields = {'stdout': encode_field(output), 'stderr': encode_field(error), 'time': f'{cpu_time:.3f}',
+                  'memory': memory or None, 'compile_output': compile_output}
+
+        if killed or cpu_time > time_limit or \
+                (os.WIFSIGNALED(exit_status) and os.WTERMSIG(exit_status) == signal.SIGXCPU):
+            return with_status(5, **fields)
+
+        if os.WIFSIGNALED(exit_status):
+            return with_status(SIGNAL_STATUSES.get(os.WTERMSIG(exit_status), 12), **fields)
+
+        if os.WEXITSTATUS(exit_status) != 0:
+            return with_status(11, **fields)
+
+        # Compare the output to the expected output, ignoring whitespace at the start and end
+        expected_output = base64.b64decode(submission.get('expected_output') or '')
+        return with_status(3 if output.strip() == expected_output.strip() else 4, **fields)
+
+
+_executor = None
+_executor_pid = None
+
+
+# Get this process's local executor. Celery's workers are forked from the main process, and
+# a thread pool can't be shared between processes, so each process creates its own executor
+def get_local_executor():
+    global _executor, _executor_pid
+
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = LocalExecutor(app.config['LOCAL_JUDGE_WORKERS'])
+        _executor_pid = os.getpid()
+
+    return _executor
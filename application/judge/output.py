@@ -0,0 +1,57 @@
+import json
+import zlib
+import boto3
+from hashlib import sha256
+from application import app
+from application.settingssecrets import AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_BUCKET_NAME
+
+# Initialize AWS's Python SDK (Boto3) resource (higher-level API), used to store outputs too big for the database
+s3 = boto3.resource('s3', aws_access_key_id=AWS_ACCESS_KEY_ID,
+                    aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
+
+# Set AWS bucket name
+bucket_name = AWS_BUCKET_NAME
+
+# The outputs of a test case that are saved in its result
+OUTPUT_FIELDS = ('stdout', 'stderr', 'compile_output')
+
+# The most characters of a test case's standard output that are kept
+STDOUT_MAX_LENGTH = 10000
+
+
+def compress(text):
+    if text is None:
+        return None
+
+    return zlib.compress(text.encode())
+
+
+# Cut off text after a number of characters
+def truncate(text, length):
+    if text is not None and len(text) > length:
+        return text[:length] + '\n(...)'
+
+    return text
+
+
+# Save the outputs of a test case (a dict of each field in OUTPUT_FIELDS) in its result, compressed. If they're still
+# too big to keep in the database, they're stored in S3 (under the problem's folder, by their hash, so identical outputs
+# are only stored once), and the result only keeps the start of each one
+def save_output(result, problem, outputs):
+    outputs = dict(outputs, stdout=truncate(outputs.get('stdout'), STDOUT_MAX_LENGTH))
+    compressed = {field: compress(outputs.get(field)) for field in OUTPUT_FIELDS}
+
+    result.output_path = None
+
+    if sum(len(data) for data in compressed.values() if data) > app.config['RESULT_OUTPUT_MAX_BYTES']:
+        data = zlib.compress(json.dumps(outputs).encode())
+        result.output_path = f'classes/{problem.class_.identifier}/problems/{problem.identifier}/outputs/' \
+                             f'{sha256(data).hexdigest()}'
+        s3.Object(bucket_name, result.output_path).put(Body=data)
+
+        compressed = {field: compress(truncate(outputs.get(field), app.config['RESULT_OUTPUT_PREVIEW_LENGTH']))
+                      for field in OUTPUT_FIELDS}
+
+    result.stdout_data = compressed['stdout']
+    result.stderr_data = compressed['stderr']
+    result.compile_output_data = compressed['compile_output']
@@ -0,0 +1,21 @@
+import json
+from application import redis_store
+
+# The Redis list that the judge dispatcher takes submissions to judge from
+DISPATCH_QUEUE = 'judge:dispatch'
+
+
+# Add a submission to the judge dispatcher's queue, with the same arguments as the student_judge_code task
+def enqueue_judge_job(language, file, problem_id, submission_id):
+    job = {'language': int(language), 'file': file, 'problem': problem_id, 'submission': submission_id}
+    redis_store.rpush(DISPATCH_QUEUE, json.dumps(job))
+
+
+# Take the next submission from the judge dispatcher's queue, waiting up to timeout seconds for one
+def pop_judge_job(timeout=1):
+    job = redis_store.blpop(DISPATCH_QUEUE, timeout=timeout)
+
+    if job is None:
+        return None
+
+    return json.loads(job[1])
@@ -0,0 +1,193 @@
+from time import sleep, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from sqlalchemy import func
+from application import app, db
+from application.models.general import Result, Submission
+from application.judge.client import JUDGE0_BATCH_SIZE, token_error
+from application.judge.executor import get_executor, JudgeUnavailable
+from application.judge.grading import PENDING_STATUSES, SKIPPED_STATUS, INTERNAL_ERROR_STATUS, \
+    build_judge0_submissions, get_judge_key, record_result, refresh_scores, rejected_submission, required_status
+
+# Get the submissions of a problem that a rejudge runs again: every submission that has finished judging ("all"),
+# each student's latest one ("latest"), or the ones that didn't earn full marks ("not_full_marks")
+def rejudge_candidates(problem, which):
+    query = Submission.query.filter_by(problem_id=problem.id, done=True)
+
+    if which == 'latest':
+        latest = db.session.query(func.max(Submission.id)).filter_by(problem_id=problem.id, done=True) \
+            .group_by(Submission.student_id)
+        query = query.filter(Submission.id.in_(latest))
+
+    elif which == 'not_full_marks':
+        query = query.filter(Submission.marks < problem.total_marks)
+
+    # Along with each submission's language, which the submissions are grouped by
+    return query.options(db.joinedload(Submission.language)).order_by(Submission.id).all()
+
+
+# Run the test cases of a chunk of programs through the judge together: send them in full batches, then poll all of
+# their tokens at once until they've finished or the deadline has passed. Returns the finished Judge0 submissions of
+# each program, in the same order as its test cases (None for the ones that never finished, and a failed one for the
+# ones that Judge0 rejected). This runs in a thread, so it must not use the database
+def judge_chunk(executor, chunk, deadline, poll_interval=2):
+    runs = [s for _, judge0_submissions in chunk for s in judge0_submissions]
+
+    tokens = []
+    for i in range(0, len(runs), JUDGE0_BATCH_SIZE):
+        tokens.extend(executor.create_batch(runs[i:i + JUDGE0_BATCH_SIZE]))
+
+    nodes = {jt['token']: jt.get('node') for jt in tokens if jt.get('token')}
+    finished = {}
+
+    while len(finished) < len(nodes) and time() < deadline:
+        sleep(poll_interval)
+
+        pending = [token for token in nodes if token not in finished]
+
+        try:
+            for i in range(0, len(pending), JUDGE0_BATCH_SIZE):
+                for s in executor.get_batch(pending[i:i + JUDGE0_BATCH_SIZE], nodes):
+                    if s['status']['id'] not in PENDING_STATUSES:
+                        finished[s['token']] = s
+
+        # If the judge can't be reached, try again next time (until the deadline)
+        except JudgeUnavailable as e:
+            app.logger.warning(f'Could not get the results of a rejudge: {e}')
+
+    results = {}
+    start = 0
+    for key, judge0_submissions in chunk:
+        results[key] = [rejected_submission(jt) if token_error(jt) else finished.get(jt['token'])
+                        for jt in tokens[start:start + len(judge0_submissions)]]
+        start += len(judge0_submissions)
+
+    return results
+
+
+# Rejudge submissions of a problem (after its test cases were fixed) without a task for each one. Submissions with the
+# same code and language are only run once. Their test cases are sent in chunks of about a full Judge0 batch, with up
+# to REJUDGE_CONCURRENCY chunks running at once, and as each chunk finishes, the results of its submissions are
+# replaced and their marks recomputed in bulk. progress (if given) is called with the number of submissions rejudged so
+# far and the total. Submissions whose chunk couldn't be sent to the judge keep their old results
+def rejudge_submissions(problem, submissions, s3, bucket_name, progress=None):
+    executor = get_executor()
+
+    # Group the submissions by their program (submissions from before the code's hash was saved are on their own)
+    groups = {}
+    for submission in submissions:
+        groups.setdefault((submission.language.number, submission.source_hash or submission.id), []).append(submission)
+
+    keys = list(groups)
+    file_paths = [groups[key][0].file_path for key in keys]
+
+    # Everything needed to build the results, loaded before any thread starts (threads can't use the session)
+    input_files, output_files = list(problem.input_files), list(problem.output_files)
+    total_marks = round(problem.total_marks / len(input_files), 2) if input_files else 0
+    statuses = {number: required_status(number) for number in (SKIPPED_STATUS, INTERNAL_ERROR_STATUS)}
+
+    rejudged = failed = 0
+    with ThreadPoolExecutor(max_workers=app.config['REJUDGE_CONCURRENCY']) as pool:
+        # Download each program's code once, in parallel
+        codes = dict(zip(keys, pool.map(lambda path: s3.Object(bucket_name, path).get()['Body'].read()
+                                        .decode('utf-8'), file_paths)))
+
+        programs = {}
+        for key in keys:
+            programs[key] = build_judge0_submissions(key[0], codes[key], problem, s3, bucket_name)
+
+        # Split the programs into chunks of up to a full batch of test cases (a program with more test cases than
+        # that is a chunk on its own)
+        chunks = [[]]
+        for key in keys:
+            runs = sum(len(judge0_submissions) for _, judge0_submissions in chunks[-1])
+            if chunks[-1] and runs + len(programs[key]) > JUDGE0_BATCH_SIZE:
+                chunks.append([])
+            chunks[-1].append((key, programs[key]))
+
+        futures = {}
+        for chunk in chunks:
+            if not chunk:
+                continue
+
+            runs = sum(len(judge0_submissions) for _, judge0_submissions in chunk)
+            deadline = time() + app.config['JUDGE_DEADLINE_MIN'] + \
+                runs * problem.time_limit * app.config['JUDGE_DEADLINE_MULTIPLIER']
+
+            futures[pool.submit(judge_chunk, executor, chunk, deadline)] = chunk
+
+        for future in as_completed(futures):
+            chunk = futures[future]
+            chunk_submissions = [s for key, _ in chunk for s in groups[key]]
+
+            try:
+                chunk_results = future.result()
+            except JudgeUnavailable as e:
+                app.logger.warning(f'Could not rejudge submissions {[s.id for s in chunk_submissions]}: {e}')
+                failed += len(chunk_submissions)
+
+                if progress:
+                    progress(rejudged + failed, len(submissions))
+
+                continue
+
+            results = []
+            marks = []
+            for key, _ in chunk:
+                judge_key = get_judge_key(problem, codes[key], key[0])
+
+                for submission in groups[key]:
+                    submission_results = build_results(problem, submission, chunk_results[key], input_files,
+                                                       output_files, total_marks, statuses)
+                    results.extend(submission_results)
+
+                    # Marks that a teacher set by hand are kept
+                    update = {'id': submission.id, 'judge_key': judge_key}
+                    if not submission.marks_overridden:
+                        update['marks'] = round(sum(r.marks for r in submission_results), 2)
+                    marks.append(update)
+
+            # Replace the chunk's results and marks in bulk
+            Result.query.filter(Result.submission_id.in_([s.id for s in chunk_submissions])) \
+                .delete(synchronize_session=False)
+            db.session.bulk_save_objects(results)
+            db.session.bulk_update_mappings(Submission, marks)
+            db.session.commit()
+
+            rejudged += len(chunk_submissions)
+
+            if progress:
+                progress(rejudged + failed, len(submissions))
+
+    # The submissions' results were replaced behind the session's back
+    db.session.expire_all()
+
+    # Work out the students' best scores from the new marks
+    refresh_scores(problem)
+
+    return {'rejudged': rejudged, 'failed': failed, 'total': len(submissions)}
+
+
+# Build a submission's new results from its program's finished Judge0 submissions. Test cases that never finished
+# get the "Internal Error" status, and in a problem that stops judging at the first failed test case, every test case
+# after the first one that failed is "Skipped" (a rejudge runs them all, so it can send them together)
+def build_results(problem, submission, judged, input_files, output_files, total_marks, statuses):
+    results = []
+    failed = False
+
+    for i, s in enumerate(judged):
+        skipped = failed and problem.fail_fast
+
+        r = Result(input_id=input_files[i].id, output_id=output_files[i].id, submission_id=submission.id,
+                   token=s['token'] if s and not skipped else '', marks_out_of=total_marks, marks=0, correct=False)
+
+        if skipped:
+            r.status_id = statuses[SKIPPED_STATUS].id
+        elif s is None:
+            r.status_id = statuses[INTERNAL_ERROR_STATUS].id
+        else:
+            record_result(r, s, problem)
+
+        failed = failed or not r.correct
+        results.append(r)
+
+    return results
@@ -0,0 +1,188 @@
+import json
+import math
+from time import time
+from application import app, redis_store
+
+# The submissions waiting for the judge are kept in Redis: their jobs in a hash by their id, and their ids in a list
+# for each problem (in the order they arrived). The problems with waiting submissions are in a sorted set for each
+# class, and the classes with waiting submissions are in a sorted set, both by their pass (see take_job). Submissions
+# from students who have run out of tokens wait in another sorted set, by the time that their student gets a token
+JOBS = 'judge:waiting:jobs'
+CLASSES = 'judge:waiting:classes'
+CLASS_PROBLEMS = 'judge:waiting:class:{}'
+PROBLEM_JOBS = 'judge:waiting:problem:{}'
+PRIORITIES = 'judge:waiting:priorities'
+DEFERRED = 'judge:waiting:deferred'
+
+# Each job in a problem's queue gets the next number of the problem's sequence, so the position of a job in the queue
+# is the difference between its number and the number of the job at the front
+SEQUENCES = 'judge:waiting:sequences'
+PROBLEM_SEQUENCE = 'judge:waiting:problem:{}:sequence'
+
+# Held while jobs are being added to or taken from the queues, so processes doing it at once don't interleave
+LOCK = 'judge:waiting:lock'
+
+# Each student's token bucket
+BUCKET = 'judge:bucket:{}'
+
+
+# Take a token from a student's token bucket, which holds up to JUDGE_STUDENT_BURST tokens and gets another one every
+# 60 / JUDGE_STUDENT_RATE seconds. The bucket is stored as the time at which it will be full again, from which the
+# time that the token is available is worked out. Returns that time (now, if the bucket wasn't empty)
+def take_token(student_id):
+    interval = 60 / app.config['JUDGE_STUDENT_RATE']
+    key = BUCKET.format(student_id)
+    now = time()
+
+    with redis_store.lock(f'{key}:lock', timeout=5):
+        full_at = max(float(redis_store.get(key) or 0), now)
+        available_at = max(now, full_at - (app.config['JUDGE_STUDENT_BURST'] - 1) * interval)
+
+        full_at += interval
+        redis_store.set(key, full_at, ex=math.ceil(full_at - now) + 1)
+
+    return available_at
+
+
+# Get the number of submissions waiting for the judge (including the ones waiting for their student's token)
+def waiting_count():
+    return redis_store.hlen(JOBS)
+
+
+# Add a submission's job to the queues, to be sent to the judge once its student has a token (at available_at)
+def add_job(job, available_at):
+    redis_store.hset(JOBS, job['submission'], json.dumps(job))
+
+    if available_at > time():
+        redis_store.zadd(DEFERRED, {job['submission']: available_at})
+        return
+
+    with redis_store.lock(LOCK, timeout=10):
+        _enqueue(job)
+
+
+# Add a job to the end of its problem's queue. A problem or class that had nothing waiting starts at the lowest pass
+# of the ones that are waiting, so it's next in line, but can't make up for the time that it wasn't waiting
+def _enqueue(job):
+    class_problems = CLASS_PROBLEMS.format(job['class'])
+
+    redis_store.hset(SEQUENCES, job['submission'], redis_store.incr(PROBLEM_SEQUENCE.format(job['problem'])))
+    redis_store.rpush(PROBLEM_JOBS.format(job['problem']), job['submission'])
+    redis_store.hset(PRIORITIES, job['problem'], job['priority'])
+
+    if redis_store.zscore(class_problems, job['problem']) is None:
+        redis_store.zadd(class_problems, {job['problem']: _lowest_pass(class_problems)})
+
+    if redis_store.zscore(CLASSES, job['class']) is None:
+        redis_store.zadd(CLASSES, {job['class']: _lowest_pass(CLASSES)})
+
+
+def _lowest_pass(key):
+    lowest = redis_store.zrange(key, 0, 0, withscores=True)
+    return lowest[0][1] if lowest else 0
+
+
+# Take the next job to send to the judge, or None if nothing can be sent yet. This is weighted round-robin (stride
+# scheduling): the class with the lowest pass goes next, and within it, the problem with the lowest pass. Each job
+# that is taken adds 1 to its class's pass, so every class with waiting submissions gets an equal share of the judge
+# (no matter how many submissions it has waiting or the priorities of its problems), and 1 / its problem's priority to
+# its problem's pass, so a problem with a higher priority gets a bigger share of its class's turns
+def take_job():
+    with redis_store.lock(LOCK, timeout=10):
+        # Queue the jobs whose students have gotten their token since
+        for submission_id in redis_store.zrangebyscore(DEFERRED, '-inf', time()):
+            redis_store.zrem(DEFERRED, submission_id)
+
+            job = redis_store.hget(JOBS, submission_id)
+            if job is not None:
+                _enqueue(json.loads(job))
+
+        while True:
+            next_class = redis_store.zrange(CLASSES, 0, 0)
+            if not next_class:
+                return None
+
+            class_id = next_class[0].decode()
+            class_problems = CLASS_PROBLEMS.format(class_id)
+
+            next_problem = redis_store.zrange(class_problems, 0, 0)
+            if not next_problem:
+                redis_store.zrem(CLASSES, class_id)
+                continue
+
+            problem_id = next_problem[0].decode()
+            problem_jobs = PROBLEM_JOBS.format(problem_id)
+
+            submission_id = redis_store.lpop(problem_jobs)
+            job = submission_id and redis_store.hget(JOBS, submission_id)
+
+            if submission_id is not None:
+                redis_store.hdel(SEQUENCES, submission_id)
+
+            # Remove the problem and class once they have nothing else waiting, else move them along by their pass
+            if not redis_store.llen(problem_jobs):
+                redis_store.zrem(class_problems, problem_id)
+                redis_store.hdel(PRIORITIES, problem_id)
+                redis_store.delete(PROBLEM_SEQUENCE.format(problem_id))
+
+            if job is None:
+                continue
+
+            redis_store.hdel(JOBS, submission_id)
+            job = json.loads(job)
+
+            if redis_store.zscore(class_problems, problem_id) is not None:
+                redis_store.zincrby(class_problems, 1 / job['priority'], problem_id)
+
+            if redis_store.zcard(class_problems):
+                redis_store.zincrby(CLASSES, 1, class_id)
+            else:
+                redis_store.zrem(CLASSES, class_id)
+
+            return job
+
+
+# Get the estimated position of a waiting submission (starting at 1): the number of submissions that will be sent to
+# the judge before it (and it). Its class takes a turn for each submission ahead of it in its problem's queue (and
+# it), plus the turns that each other problem in the class gets for each of its problem's, and every other class gets
+# as many turns as its class in that time (or until it has nothing left waiting). Returns None if it isn't waiting
+def job_position(submission_id):
+    job = redis_store.hget(JOBS, submission_id)
+    if job is None:
+        return None
+
+    job = json.loads(job)
+
+    # A submission waiting for its student's token is behind everything that is queued
+    if redis_store.zscore(DEFERRED, submission_id) is not None:
+        return waiting_count()
+
+    sequence = redis_store.hget(SEQUENCES, submission_id)
+    first = redis_store.lindex(PROBLEM_JOBS.format(job['problem']), 0)
+    first_sequence = first and redis_store.hget(SEQUENCES, first)
+    if sequence is None:
+        return None
+
+    # The job at the front may have just been taken, in which case this one is next
+    turns = int(sequence) - int(first_sequence) + 1 if first_sequence is not None else 1
+    class_turns = turns
+
+    for problem_id in redis_store.zrange(CLASS_PROBLEMS.format(job['class']), 0, -1):
+        if int(problem_id) == job['problem']:
+            continue
+
+        priority = int(redis_store.hget(PRIORITIES, problem_id) or 1)
+        waiting = redis_store.llen(PROBLEM_JOBS.format(problem_id.decode()))
+        class_turns += min(waiting, math.ceil(turns * priority / job['priority']))
+
+    position = class_turns
+
+    for class_id in redis_store.zrange(CLASSES, 0, -1):
+        if class_id.decode() == str(job['class']):
+            continue
+
+        waiting = sum(redis_store.llen(PROBLEM_JOBS.format(problem_id.decode()))
+                      for problem_id in redis_store.zrange(CLASS_PROBLEMS.format(class_id.decode()), 0, -1))
+        position += min(waiting, class_turns)
+
+    return position
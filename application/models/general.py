@@ -47,15 +47,16 @@ class User(db.Model, UserMixin):
 class Student(db.Model):
     id = db.Column(db.Integer, primary_key=True)
 
-    # Name and student code (identifier)
+    # Name and student code (identifier, which the student logs in with, so it's unique)
     name = db.Column(db.String, nullable=False)
-    identifier = db.Column(db.String, nullable=False)
+    identifier = db.Column(db.String, nullable=False, unique=True, index=True)
 
-    # The submissions the student has made
+    # The submissions the student has made, and their best score in each problem
     submissions = db.relationship('Submission', backref='student', lazy=True, cascade='all, delete')
+    scores = db.relationship('StudentProblemScore', backref='student', lazy=True, cascade='all, delete')
 
     # The class the student is associated to
-    class_id = db.Column(db.Integer, db.ForeignKey('class_.id'), nullable=False)
+    class_id = db.Column(db.Integer, db.ForeignKey('class_.id'), nullable=False, index=True)
 
 
 # A class table
@@ -63,7 +64,7 @@ class Class_(db.Model):
     id = db.Column(db.Integer, primary_key=True)
 
     # Identifier, name, and the description of the class
-    identifier = db.Column(db.String, nullable=False)
+    identifier = db.Column(db.String, nullable=False, unique=True, index=True)
     name = db.Column(db.String, nullable=False)
     description = db.Column(db.String)
 
@@ -79,6 +80,9 @@ class Class_(db.Model):
 
 # A problem table
 class Problem(db.Model):
+    # Problems are looked up by their identifier, and by their identifier in a class
+    __table_args__ = (db.UniqueConstraint('identifier', 'class_id', name='uq_problem_identifier_class_id'),)
+
     id = db.Column(db.Integer, primary_key=True)
 
     # The problem's identifier, title, description (in markdown
@@ -91,6 +95,11 @@ class Problem(db.Model):
     memory_limit = db.Column(db.Integer, nullable=False, default=512)
     total_marks = db.Column(db.Integer, nullable=False)
     auto_grade = db.Column(db.Boolean, nullable=False, default=False)
+    fail_fast = db.Column(db.Boolean, nullable=False, default=False)
+
+    # How big a share of the judge the problem's submissions get when submissions are waiting for it (a problem
+    # with a priority of 2 has two submissions sent to the judge for each one of a problem with a priority of 1)
+    priority = db.Column(db.Integer, nullable=False, default=1)
     allow_multiple_submissions = db.Column(db.Boolean, nullable=False, default=False)
     allow_more_submissions = db.Column(db.Boolean, nullable=False, default=True)
     visible = db.Column(db.Boolean, nullable=False)
@@ -100,8 +109,15 @@ class Problem(db.Model):
     input_files = db.relationship('InputFile', backref='problem', lazy=True, cascade='all, delete')
     output_files = db.relationship('OutputFile', backref='problem', lazy=True, cascade='all, delete')
 
-    # The submissions associated to that problem
+    # The number of students that have submitted to the problem, of its submissions, and of its submissions that
+    # have finished judging, kept up to date as submissions are made, finish, and are deleted (see application/utils.py)
+    submitters_count = db.Column(db.Integer, nullable=False, default=0)
+    submissions_count = db.Column(db.Integer, nullable=False, default=0)
+    done_submissions_count = db.Column(db.Integer, nullable=False, default=0)
+
+    # The submissions associated to that problem, and each student's best score in it
     submissions = db.relationship('Submission', backref='problem', lazy=True, cascade='all, delete')
+    scores = db.relationship('StudentProblemScore', backref='problem', lazy=True, cascade='all, delete')
 
     # The languages associated to that problem (many-to-many using the association table)
     languages = db.relationship('Language', secondary=problem_language_association_table, lazy=True,
@@ -114,7 +130,7 @@ class Problem(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
 
     # The class that the problem is in
-    class_id = db.Column(db.Integer, db.ForeignKey('class_.id'), nullable=False)
+    class_id = db.Column(db.Integer, db.ForeignKey('class_.id'), nullable=False, index=True)
 
 
 # A table to hold the MOSS results
@@ -122,7 +138,7 @@ class MOSSResult(db.Model):
     id = db.Column(db.Integer, primary_key=True)
 
     # The Celery task's UUID
-    uuid = db.Column(db.String, nullable=False)
+    uuid = db.Column(db.String, nullable=False, index=True)
 
     # The link to the MOSS result
     link = db.Column(db.String, nullable=False)
@@ -140,7 +156,7 @@ class Language(db.Model):
     id = db.Column(db.Integer, primary_key=True)
 
     # The number (Judge0 id), name, and file extension of the language's source file
-    number = db.Column(db.Integer, nullable=False)
+    number = db.Column(db.Integer, nullable=False, unique=True, index=True)
     name = db.Column(db.String, nullable=False)
     short_name = db.Column(db.String)
     file_extension = db.Column(db.String, nullable=False)
@@ -158,6 +174,13 @@ class InputFile(db.Model):
     file_path = db.Column(db.String, nullable=False)
     file_size = db.Column(db.Integer)
 
+    # The SHA-256 hash of the file's contents, used as the file's key in the judge workers' test case cache
+    content_hash = db.Column(db.String)
+
+    # The S3 path of the file's contents already base64 encoded, as they're sent to the judge (files uploaded
+    # before this was added don't have one, so the judge workers encode them instead)
+    payload_path = db.Column(db.String)
+
     # The problem that the input file is a part of
     problem_id = db.Column(db.Integer, db.ForeignKey('problem.id'), nullable=False)
 
@@ -178,6 +201,13 @@ class OutputFile(db.Model):
     file_size = db.Column(db.String)
     problem_id = db.Column(db.Integer, db.ForeignKey('problem.id'), nullable=False)
 
+    # The SHA-256 hash of the file's contents, used as the file's key in the judge workers' test case cache
+    content_hash = db.Column(db.String)
+
+    # The S3 path of the file's contents already base64 encoded, as they're sent to the judge (files uploaded
+    # before this was added don't have one, so the judge workers encode them instead)
+    payload_path = db.Column(db.String)
+
     # The input file that is associated to the output file
     input_id = db.Column(db.Integer, db.ForeignKey('input_file.id'), nullable=False)
 
@@ -187,11 +217,14 @@ class OutputFile(db.Model):
 
 # A submission table
 class Submission(db.Model):
+    # A problem's submissions are looked up by student and by whether they're done
+    __table_args__ = (db.Index('ix_submission_problem_id_student_id_done', 'problem_id', 'student_id', 'done'),)
+
     id = db.Column(db.Integer, primary_key=True)
 
     # The UUID (also the task id), file_path of the code, the date and time
     # in which it was submitted, the file_size, and the marks it earned
-    uuid = db.Column(db.String, nullable=False)
+    uuid = db.Column(db.String, nullable=False, unique=True, index=True)
     file_path = db.Column(db.String, nullable=False)
     date_time = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
     file_size = db.Column(db.Integer)
@@ -199,18 +232,50 @@ class Submission(db.Model):
 
     marks = db.Column(db.Integer)
 
+    # Whether a teacher changed the submission's marks by hand, so they're kept when the submission is rescored
+    marks_overridden = db.Column(db.Boolean, default=False)
+
+    # The SHA-256 hash of the submitted code, and the key of everything that decides
+    # its results (the code, language, test cases, and limits), used to reuse the
+    # results of an identical submission instead of running it through Judge0 again
+    source_hash = db.Column(db.String)
+    judge_key = db.Column(db.String, index=True)
+
     # Whether the submission has finished executing in Judge0 or not
     done = db.Column(db.Boolean, default=False)
 
     # The results associated to the submission
     results = db.relationship('Result', backref='submission', lazy=True, cascade='all, delete')
 
+    # The submission's entry in the judge outbox, if it couldn't be sent to the judge
+    outbox = db.relationship('JudgeOutbox', backref='submission', lazy=True, cascade='all, delete')
+
     # The problem, student, and language that is the submission is a part of
     problem_id = db.Column(db.Integer, db.ForeignKey('problem.id'), nullable=False)
-    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False, index=True)
     language_id = db.Column(db.Integer, db.ForeignKey('language.id'), nullable=False)
 
 
+# A table of each student's best score in each problem that they've submitted to, kept up to date as their submissions
+# finish (see application/judge/grading.py), so pages don't have to go through every submission to show it
+class StudentProblemScore(db.Model):
+    __table_args__ = (db.UniqueConstraint('student_id', 'problem_id',
+                                          name='uq_student_problem_score_student_id_problem_id'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    # The highest marks of the student's finished submissions, how many of them there are, when the latest
+    # one was submitted, and whether the student has earned the problem's full marks
+    best_marks = db.Column(db.Float, nullable=False, default=0)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_submission_date_time = db.Column(db.DateTime)
+    solved = db.Column(db.Boolean, nullable=False, default=False)
+
+    # The student and the problem that the score is for
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
+    problem_id = db.Column(db.Integer, db.ForeignKey('problem.id'), nullable=False, index=True)
+
+
 # A result table
 class Result(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -219,36 +284,60 @@ class Result(db.Model):
     input_id = db.Column(db.Integer, db.ForeignKey('input_file.id'), nullable=False)
     output_id = db.Column(db.Integer, db.ForeignKey('output_file.id'), nullable=False)
 
-    # The Judge0 token of the result
+    # The Judge0 token of the result, and the Judge0 node that it was sent to (only that node knows the token)
     token = db.Column(db.String, nullable=False)
+    node = db.Column(db.String)
 
-    # The standard error, standard output, time and memory token, compile
-    # output, expected output, and whether or not the result was correct
-    stderr = db.Column(db.String)
-    stdout = db.Column(db.String)
+    # The time and memory token, and whether or not the result was correct (the expected output is the output file's)
     time = db.Column(db.String)
     memory = db.Column(db.Integer)
-    compile_output = db.Column(db.String)
-    expected_output = db.Column(db.String)
     correct = db.Column(db.Boolean)
 
+    # The standard error, standard output, and compile output, compressed with zlib and only loaded when they're used
+    # (see application/judge/output.py). If they were too big to keep here, they're stored in S3 at output_path, and
+    # only the start of each one is kept here
+    stderr_data = db.deferred(db.Column(db.LargeBinary), group='output')
+    stdout_data = db.deferred(db.Column(db.LargeBinary), group='output')
+    compile_output_data = db.deferred(db.Column(db.LargeBinary), group='output')
+    output_path = db.Column(db.String)
+
     # The marks that the result earned the the total marks of the submission
     marks = db.Column(db.Float)
     marks_out_of = db.Column(db.Float)
 
     # The submission that the result is associated with
-    submission_id = db.Column(db.Integer, db.ForeignKey('submission.id'), nullable=False)
+    submission_id = db.Column(db.Integer, db.ForeignKey('submission.id'), nullable=False, index=True)
 
     # The status that the result is associated with
     status_id = db.Column(db.Integer, db.ForeignKey('status.id'), nullable=False)
 
 
+# A table of the submissions that couldn't be sent to the judge (such as while every Judge0 node
+# is down), which are sent again once it recovers
+class JudgeOutbox(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+
+    # The submission's code and Judge0 language id, so it can be sent again without downloading it from S3
+    code = db.Column(db.String, nullable=False)
+    language = db.Column(db.Integer, nullable=False)
+
+    # The number of times sending the submission has failed, the last error,
+    # and the earliest date and time that it can be sent again
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.String)
+    next_attempt_date_time = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
+    create_date_time = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
+
+    # The submission that couldn't be sent
+    submission_id = db.Column(db.Integer, db.ForeignKey('submission.id'), nullable=False, unique=True)
+
+
 # A table that contains every Judge0 status
 class Status(db.Model):
     id = db.Column(db.Integer, primary_key=True)
 
     # The Judge0 number and name of the status
-    number = db.Column(db.Integer, nullable=False)
+    number = db.Column(db.Integer, nullable=False, unique=True, index=True)
     name = db.Column(db.String, nullable=False)
 
     # The results that the status is associated with
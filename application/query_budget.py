@@ -0,0 +1,69 @@
+import time
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from application import app
+
+
+# Raised (in strict mode) when a view runs more queries in a request than its budget allows
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+# A decorator that sets the most queries a view can run in a request, including the ones run by its decorators (such
+# as loading the logged in user) and its template. Views without a budget are counted, but never checked: the ones that
+# don't show or change a class's data (such as signing in), and the ones whose queries grow with the data on purpose
+def query_budget(limit):
+    def decorator(f):
+        f.query_budget = limit
+        return f
+
+    return decorator
+
+
+# Start counting the queries of a request
+@app.before_request
+def start_query_stats():
+    g.query_count = 0
+    g.query_time = 0
+
+
+# Time every query run by any engine, and add it to the current request's count (queries run outside of a request,
+# such as by Celery tasks, aren't counted)
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    context.query_start_time = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'query_count' in g:
+        g.query_count += 1
+        g.query_time += time.perf_counter() - context.query_start_time
+
+
+# Log the number of queries the request ran and how long they took (and send them in the response's headers if
+# QUERY_STATS_HEADER is set), then check them against the view's budget
+@app.after_request
+def check_query_budget(response):
+    if 'query_count' not in g:
+        return response
+
+    query_time = round(g.query_time * 1000, 2)
+    app.logger.debug(f'{request.endpoint} ran {g.query_count} queries in {query_time} ms')
+
+    if app.config['QUERY_STATS_HEADER']:
+        response.headers['X-Query-Count'] = str(g.query_count)
+        response.headers['X-Query-Time'] = str(query_time)
+
+    budget = getattr(app.view_functions.get(request.endpoint), 'query_budget', None)
+
+    if budget is not None and g.query_count > budget:
+        message = f'{request.endpoint} ran {g.query_count} queries, more than its budget of {budget}'
+
+        if app.config['QUERY_BUDGET_STRICT']:
+            raise QueryBudgetExceeded(message)
+
+        app.logger.warning(message)
+
+    return response
@@ -0,0 +1,76 @@
+import threading
+from application import db
+from application.models.general import Status, Language
+
+
+# A process-wide cache of the Status and Language tables, which only change when reset_database.py is run, so
+# that looking them up never queries the database. The objects are detached from any session, so only their
+# columns can be read; use attach to add one to a relationship
+class Registry:
+    def __init__(self):
+        self._statuses = None
+        self._statuses_by_id = None
+        self._languages = None
+        self._languages_by_id = None
+        self._lock = threading.Lock()
+
+    # Load both tables from the database in their own session, replacing what was cached
+    def reload(self):
+        session = db.create_session({})()
+
+        try:
+            statuses = session.query(Status).all()
+            languages = session.query(Language).order_by(Language.id).all()
+            session.expunge_all()
+        finally:
+            session.close()
+
+        with self._lock:
+            self._statuses = {s.number: s for s in statuses}
+            self._statuses_by_id = {s.id: s for s in statuses}
+            self._languages = {l.number: l for l in languages}
+            self._languages_by_id = {l.id: l for l in languages}
+
+    # Load the tables the first time they are needed
+    def _load(self):
+        if self._statuses is None:
+            self.reload()
+
+    # Look a key up in one of the tables, reloading them once if it isn't found (in case it was just added)
+    def _get(self, table, key):
+        self._load()
+
+        if key not in getattr(self, table):
+            self.reload()
+
+        return getattr(self, table).get(key)
+
+    # Get a status by its Judge0 number
+    def status(self, number):
+        return self._get('_statuses', int(number))
+
+    # Get a status by its id
+    def status_by_id(self, status_id):
+        return self._get('_statuses_by_id', status_id)
+
+    # Get a language by its Judge0 number
+    def language(self, number):
+        return self._get('_languages', int(number))
+
+    # Get a language by its id
+    def language_by_id(self, language_id):
+        return self._get('_languages_by_id', language_id)
+
+    # Get every language
+    def languages(self):
+        self._load()
+        return list(self._languages.values())
+
+    # Get a copy of a cached object that belongs to the current session (without querying the
+    # database), so it can be used in a relationship, such as appending a language to a problem
+    def attach(self, obj):
+        return db.session.merge(obj, load=False)
+
+
+# The registry shared by everything in this process
+registry = Registry()
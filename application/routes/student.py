@@ -1,16 +1,25 @@
-import sys
-import json
+import os
 import boto3
-import base64
+from hashlib import sha256
 from functools import wraps
-from time import sleep
-from requests import get, post
+from time import sleep, time
+from datetime import datetime, timedelta
 from flask import render_template, url_for, jsonify, flash, redirect, request, abort, session
-from application import app, db, celery, limiter
+from application import app, db, celery, limiter, serializer, redis_store
 from application.forms.student import *
 from application.models.general import *
-from application.utils import upload_submission_file, delete_submission_files
-from application.settingssecrets import JUDGE0_AUTHN_TOKEN, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_BUCKET_NAME
+from application.utils import upload_submission_file, delete_submission_files, count_finished_submission
+from application.events import subscribe, event_stream
+from application.query_budget import query_budget
+from application.judge.executor import get_executor, JudgeUnavailable
+from application.judge.admission import judge_job, admit, send_to_judge, release_waiting, estimated_wait, \
+    refresh_judge_backlog
+from application.judge.scheduler import job_position
+from application.judge.grading import PENDING_STATUSES, build_judge0_submissions, create_pending_results, \
+    record_result, finish_submission, submission_result, record_callback, record_early_callbacks, \
+    sweep_callback_submissions, copy_identical_results, judge_in_order, judge_deadline, expire_pending_results, \
+    add_to_outbox, add_to_score
+from application.settingssecrets import AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_BUCKET_NAME
 
 # Initialize AWS's Python SDK (Boto3) resource (higher-level API) with the access key and secret access key
 s3 = boto3.resource('s3', aws_access_key_id=AWS_ACCESS_KEY_ID,
@@ -176,6 +185,7 @@ def student_login():
 
 # A student's dashboard
 @app.route('/student-dashboard')
+@query_budget(8)
 @login_student_not_found
 def student_dashboard():
     # Get the student and all of the problems in the class that the student is in
@@ -186,17 +196,13 @@ def student_dashboard():
 
     submitted = {}
 
-    student_submissions = Submission.query.filter_by(done=True, student=student)
+    # Get the student's best score in each problem that they've submitted to
+    scores = {score.problem_id: score for score in StudentProblemScore.query.filter_by(student_id=student.id)}
 
     # If the student has submitted a problem, make the background colour green, else make it red
     for i, p in enumerate(problems):
-        if p in [sub.problem for sub in student_submissions]:
-            max_submission = 0
-            for subm in student.submissions:
-                if p == subm.problem:
-                    max_submission = max(max_submission, subm.marks)
-
-            if max_submission == p.total_marks:
+        if p.id in scores:
+            if scores[p.id].solved:
                 submitted[p] = 'has-background-success-light'
 
             else:
@@ -256,6 +262,22 @@ def student_submit_problem(class_identifier, problem_identifier):
         # Go back to the beginning of the file, so if read is called again, the same text is returned
         file.seek(0)
 
+        # Collapse duplicate submissions of the same file (such as from double-clicking submit) that arrive within
+        # the idempotency window into the first one, by holding a short-lived key in Redis for the submission
+        idempotency_key = f'submit:{student.id}:{problem.id}:{sha256(file_data).hexdigest()}'
+        idempotency_window = app.config['SUBMISSION_IDEMPOTENCY_WINDOW']
+
+        if not redis_store.set(idempotency_key, '', nx=True, ex=idempotency_window):
+            flash('That file has already been submitted.', 'info')
+
+            # If the first submission has been created, go to it, else go back to the same page
+            duplicate_uuid = redis_store.get(idempotency_key)
+            if duplicate_uuid:
+                return redirect(url_for('student_submission', task_id=duplicate_uuid.decode()))
+
+            return redirect(url_for('student_submit_problem', class_identifier=class_identifier,
+                                    problem_identifier=problem_identifier))
+
         # If the problem is not to be auto graded
         if not problem.auto_grade:
 
@@ -268,6 +290,7 @@ def student_submit_problem(class_identifier, problem_identifier):
             if type(submission_file) is not tuple:
                 # Flash the string that was returned by the function, then
                 # redirect back to the same page to avoid submit on reload
+                redis_store.delete(idempotency_key)
                 flash(submission_file, 'danger')
                 return redirect(url_for('student_submit_problem', class_identifier=class_identifier,
                                         problem_identifier=problem_identifier))
@@ -275,11 +298,16 @@ def student_submit_problem(class_identifier, problem_identifier):
             # if the file was submitted successfully, get the submission object and the UUID
             submission_file, uuid = submission_file
 
-            # Flash that the file was submitted successfully, assign the
-            # highest marks, then redirect back to the same page
+            # Flash that the file was submitted successfully, assign the highest marks (there's nothing
+            # to judge, so the submission is done) and count it in the student's score, then redirect
+            # back to the same page
             flash('Your file has been submitted successfully.', 'success')
             submission_file.marks = problem.total_marks
+            submission_file.done = True
+            add_to_score(submission_file)
+            count_finished_submission(submission_file)
             db.session.commit()
+            redis_store.set(idempotency_key, submission_file.uuid, ex=idempotency_window)
             return redirect(url_for('student_submit_problem', class_identifier=class_identifier,
                                     problem_identifier=problem_identifier))
 
@@ -291,6 +319,7 @@ def student_submit_problem(class_identifier, problem_identifier):
         if type(submission_file) is not tuple:
             # Flash the string that was returned by the function, then
             # redirect back to the same page to avoid submit on reload
+            redis_store.delete(idempotency_key)
             flash(submission_file, 'danger')
             return redirect(url_for('student_submit_problem', class_identifier=class_identifier,
                                     problem_identifier=problem_identifier))
@@ -298,16 +327,21 @@ def student_submit_problem(class_identifier, problem_identifier):
         # if the file was submitted successfully, get the submission object and the UUID
         submission_file, uuid = submission_file
 
-        # Call the Celery task to judge the code, then return the result
-        task = student_judge_code.delay(form.language.data, file_data.decode('utf-8'), problem.id, student.id,
-                                        submission_file.id)
+        # Send the submission to the judge (the judge dispatcher, or the student_judge_code Celery task, whose id is
+        # the submission's UUID). If the judge is too busy, the submission is stored and waits in the admission queue
+        # until the judge has room for it, and the student is told where it is in the queue
+        job = judge_job(form.language.data, file_data.decode('utf-8'), problem, student.id, submission_file.id,
+                        submission_file.uuid)
+        position = admit(job)
 
-        # Set the submission's UUID to the Celery task's ID
-        submission_file.uuid = task.id
-        db.session.commit()
+        if position:
+            flash(f'The judge is busy right now, so your submission is number {position} in the queue. '
+                  f'It will be judged as soon as possible.', 'info')
+
+        redis_store.set(idempotency_key, submission_file.uuid, ex=idempotency_window)
 
         # Redirect to the student's submission page
-        return redirect(url_for('student_submission', task_id=task.id))
+        return redirect(url_for('student_submission', task_id=submission_file.uuid))
 
     return render_template('student/general/submit.html', problem=problem, class_=class_, form=form,
                            student_can_submit=student_can_submit, submissions=submissions, student=student,
@@ -323,139 +357,167 @@ def student_judge_code(self, language, file, problem, student, submission):
     student = Student.query.filter_by(id=student).first()
     submission = Submission.query.filter_by(id=submission).first()
 
-    # Create the body to be sent to the Judge0 API through a POST request
-    body = {
-        "submissions": [
-        ]
-    }
-
-    # For every input file in the problem
-    for i, _ in enumerate(problem.input_files):
-        # Get the input and output file
-        input_file = problem.input_files[i]
-        output_file = problem.output_files[i]
-
-        # Get the text from S3
-        input_file_data = s3.Object(bucket_name, input_file.file_path).get()['Body'].read().decode('utf-8')
-        output_file_data = s3.Object(bucket_name, output_file.file_path).get()['Body'].read().decode('utf-8')
-
-        # Add the language, source code, the STDIN (standard input), expected output, time limit, and memory limit
-        body['submissions'].append(
-            {'language_id': int(language), 'source_code': base64.b64encode(file.encode()).decode(),
-             'stdin': base64.b64encode(input_file_data.encode()).decode(),
-             'expected_output': base64.b64encode(output_file_data.encode()).decode(),
-             'cpu_time_limit': problem.time_limit,
-             'memory_limit': problem.memory_limit * 1000})
-
-    # Send the API request and get the tokens from Judge0
-    judge0_tokens = json.loads(
-        post('https://judge0-fhwnc7.vishnus.me/submissions/batch?base64_encoded=true', data=json.dumps(body),
-             headers={'X-Auth-Token': JUDGE0_AUTHN_TOKEN, 'Content-Type': 'application/json'}).text)
+    # If the exact same code has already been judged against the same test cases, reuse its results
+    if copy_identical_results(submission, problem, file, language):
+        return submission_result(submission), submission.id
 
-    # Wait 2 seconds to allow execution to complete
-    sleep(2)
+    # Get what runs the test cases (Judge0, or the local executor), as chosen by the JUDGE_EXECUTOR setting
+    client = get_executor()
 
-    # Get a comma-separated string for each token
-    tokens = ''
+    # If Judge0 callbacks are enabled, Judge0 will PUT each finished test case to this URL (which contains the
+    # submission's id, signed so that nobody else can post results to it). Test cases that are judged one by one
+    # are always polled, since each one has to finish before the next one is sent
+    callback_url = None
+    if app.config['JUDGE0_CALLBACK_URL'] and client.supports_callbacks and not problem.fail_fast:
+        key = serializer.dumps(submission.id, salt=os.environ.get('SECRET_KEY') + 'judge0-callback')
+        callback_url = f"{app.config['JUDGE0_CALLBACK_URL'].rstrip('/')}/{key}"
 
-    # For each token from the first to the second last, append the token as well as a comma
-    for jt in judge0_tokens[:-1]:
-        tokens += jt['token'] + ','
+    # Create the submissions to be sent to the Judge0 API through a POST request
+    judge0_submissions = build_judge0_submissions(language, file, problem, s3, bucket_name, callback_url)
 
-    # Append the last token with no comma
-    tokens += judge0_tokens[-1]['token']
+    # The time by which the submission must have finished judging
+    deadline = judge_deadline(problem)
+
+    try:
+        # If the problem stops judging at the first failed test case, send the test cases one at a time instead
+        if problem.fail_fast:
+            judge_in_order(client, submission, problem, judge0_submissions, deadline)
+            return submission_result(submission), submission.id
+
+        # Send the test cases and get their tokens
+        judge0_tokens = client.create_batch(judge0_submissions)
+
+    # If the judge is down, put the submission in the judge outbox, so it's judged once the judge recovers
+    # (by drain_judge_outbox) instead of this worker waiting for it
+    except JudgeUnavailable as e:
+        app.logger.warning(f'Could not send submission {submission.id} to the judge, adding it to the outbox: {e}')
+        add_to_outbox(submission, file, language, e)
+        return None, submission.id
+
+    # Create a pending result for each token, so the results can be filled in by their token
+    results = create_pending_results(submission, problem, judge0_tokens)
+
+    # If Judge0 will call back with the results, this worker is done once it has recorded any that called back
+    # already; the callback route finishes the submission (or sweep_judge_callbacks, if callbacks are lost)
+    if callback_url:
+        record_early_callbacks(submission, problem, results, deadline)
+        return None, submission.id
+
+    # Wait 2 seconds to allow execution to complete
+    sleep(2)
+
+    # The results that are still running (Judge0 rejected the ones without a token), by their token
+    pending = {r.token: r for r in results if r.token}
 
     # Continue calling the Judge0 API to get the results, until the results finally arrive
     while True:
 
-        # Pass each token to get a batch of submission
-        result = json.loads(get(
-            f'https://judge0-fhwnc7.vishnus.me/submissions/batch?tokens={tokens}&base64_encoded=true&fields=token,stdout,stderr,language_id,time,memory,expected_output,compile_output,status',
-            headers={'X-Auth-Token': JUDGE0_AUTHN_TOKEN}).text)
-
-        # Since result is now a Python dict object, we can set the total
-        # marks earned and total available marks in the dict itself
-        result['total_marks_earned'] = 0
-        result['total_marks'] = problem.total_marks
-
-        # If the any of the submissions are still being processed (a status of 1: in queue. a status of 2: processing)
-        if 1 in [s['status']['id'] for s in result['submissions']] or 2 in [s['status']['id'] for s in
-                                                                            result['submissions']]:
-            # Wait two seconds, then go into the while loop again
-            sleep(2)
-            continue
+        # Pass each token that is still running (along with the node it was sent to) to get a batch of submission.
+        # If the judge can't be reached, try again next time (until the deadline)
+        try:
+            batch = client.get_batch(list(pending), {t: r.node for t, r in pending.items()})
+        except JudgeUnavailable as e:
+            app.logger.warning(f'Could not get the results of submission {submission.id}: {e}')
+            batch = []
 
-        # For each submission that was returned
-        for i, s in enumerate(result['submissions']):
-            # get the input and output files and the relevant info, such as the time, memory, standard errors, etc
-            inp = problem.input_files[i]
-            out = problem.output_files[i]
-            time = s['time']
-            memory = s['memory']
-            stderr = s['stderr']
-            if stderr:
-                stderr = base64.b64decode(s['stderr']).decode()
-            stdout = s['stdout']
-            if stdout:
-                stdout = base64.b64decode(s['stdout']).decode()
-            if sys.getsizeof(stdout) > 10000:
-                stdout = stdout[:10000] + '\n(...)'
-            token = s['token']
-            compile_output = s['compile_output']
-            if compile_output:
-                compile_output = base64.b64decode(s['compile_output']).decode()
-            expected_output = s['expected_output']
-            if expected_output:
-                expected_output = base64.b64decode(s['expected_output']).decode()
-
-            # Get the relevant status DB object based on the status id that was returned
-            status = Status.query.filter_by(number=s['status']['id']).first()
-
-            # If the status id is 2 "Accepted", then set correct to True for that result
-            correct = True if status.number == 3 else False
-
-            # Get the total marks for that specific result, such that each result is weighted equally
-            total_marks = round(problem.total_marks / len(problem.input_files), 2)
-
-            # Get the marks earned
-            marks = round(problem.total_marks / len(problem.input_files), 2) if correct else 0
-
-            # Set the relevant fields to be returned, such as whether it was correct, the
-            # name of the status, the marks earned, total marks, etc.
-            result['submissions'][i]['correct'] = correct
-            result['submissions'][i]['status'] = status.name
-            result['submissions'][i]['total_marks'] = total_marks
-            result['submissions'][i]['marks'] = marks
-            result['total_marks_earned'] += marks
-
-            # Delete the expected output field to the user cannot see it on the front-end
-            del result['submissions'][i]['expected_output']
-
-            # Create a new result and associate it to the input and output files, a status, etc
-            r = Result(input_file=inp, output_file=out, submission=submission, token=token, stderr=stderr,
-                       stdout=stdout,
-                       memory=memory, compile_output=compile_output, time=time, expected_output=expected_output,
-                       correct=correct, status=status, marks_out_of=total_marks, marks=marks)
-
-            db.session.add(r)
-
-        # Get the total marks earned from that submission
-        submission.marks = round(result['total_marks_earned'], 2)
-
-        submission.done = True
-
-        # Send that as well
-        result['total_marks_earned'] = submission.marks
+        for s in batch:
+            # If the submission is still being processed (a status of 1: in queue. a status of 2: processing)
+            if s['status']['id'] in PENDING_STATUSES:
+                continue
+
+            # Save each test case as soon as it finishes (so the student can see it
+            # right away), and stop asking Judge0 for it
+            record_result(pending.pop(s['token']), s, problem)
 
-        # Commit the changes
         db.session.commit()
 
-        # Return the result and the submission's id
-        return result, submission.id
+        # Let anyone watching the submission know which test cases have finished,
+        # and once they all have, total up the marks and mark the submission as done
+        if finish_submission(submission):
+            break
+
+        # If the deadline has passed, give up on the test cases that are still running
+        if time() > deadline:
+            app.logger.warning(f'Submission {submission.id} did not finish judging before its deadline')
+            expire_pending_results(submission)
+            finish_submission(submission)
+            break
+
+        # Wait two seconds, then go into the while loop again
+        sleep(2)
+
+    # Return the result and the submission's id
+    return submission_result(submission), submission.id
+
+
+# The Celery task (run every so often by celery beat) that sends the submissions in the judge outbox
+# again, once the judge has recovered
+@celery.task
+def drain_judge_outbox():
+    # If the judge is still down, leave the submissions in the outbox until next time
+    try:
+        get_executor().check()
+    except JudgeUnavailable:
+        return 0
+
+    entries = JudgeOutbox.query.filter(JudgeOutbox.next_attempt_date_time <= datetime.utcnow()) \
+        .order_by(JudgeOutbox.id).limit(app.config['JUDGE_OUTBOX_DRAIN_BATCH']).all()
+
+    # Don't send the submissions again until they've either been sent (which removes them from the outbox) or
+    # have failed again (which schedules their next attempt), so the next drain doesn't send them twice
+    for entry in entries:
+        entry.next_attempt_date_time = datetime.utcnow() + timedelta(seconds=app.config['JUDGE_DEADLINE_MIN'])
+
+    db.session.commit()
+
+    for entry in entries:
+        submission = entry.submission
+        send_to_judge(judge_job(entry.language, entry.code, submission.problem, submission.student_id,
+                                submission.id, submission.uuid))
+
+    # Also send any submissions waiting in the admission queue that the judge now has room for (they're normally
+    # sent as other submissions finish, but nothing finishes while the judge is down)
+    release_waiting()
+
+    return len(entries)
+
+
+# The route that Judge0 calls (with a PUT request) when each test case of a submission has finished
+@app.route('/judge0-callback/<key>', methods=['PUT'])
+@limiter.exempt
+def judge0_callback(key):
+    # Get the submission's id from the signed key, and if the key was tampered with, abort with 404
+    try:
+        submission_id = serializer.loads(key, salt=os.environ.get('SECRET_KEY') + 'judge0-callback')
+    except:
+        abort(404)
+
+    # Record the result (or keep it until the submission's pending results have been saved)
+    record_callback(submission_id, request.get_json(force=True))
+
+    return jsonify({'state': 'SUCCESS'})
+
+
+# The Celery task (run every so often by celery beat) that polls the test cases of the submissions whose results
+# Judge0 calls back with once their deadline has passed, and gives up on the ones that still haven't finished
+@celery.task
+def sweep_judge_callbacks():
+    return sweep_callback_submissions(get_executor())
+
+
+# The Celery task (run every so often by celery beat) that checks how many test cases Judge0 has queued or running,
+# then sends the submissions waiting in the admission queue that the judge now has room for
+@celery.task
+def check_judge_backlog():
+    backlog = refresh_judge_backlog()
+    release_waiting()
+
+    return backlog
 
 
 # Get the status of a submission
 @app.route('/status/<task_id>')
+@query_budget(5)
 @limiter.limit("4/second", override_defaults=False)
 def task_status(task_id):
     # Get the current submission
@@ -463,19 +525,18 @@ def task_status(task_id):
 
     # If the submission is done, don't query Celery!!
     if submission.done:
-        result = {'submissions': []}
-        for r in submission.results:
-            result['submissions'].append({"time": r.time,
-                                          "memory": r.memory,
-                                          "status": r.status.name,
-                                          "correct": r.correct,
-                                          "total_marks": r.marks_out_of,
-                                          "marks": r.marks})
+        return jsonify({'state': 'SUCCESS', 'result': submission_result(submission)})
 
-        result['total_marks_earned'] = submission.marks
-        result['total_marks'] = submission.problem.total_marks
+    # If the submission has been sent to Judge0, send back each test case's status
+    # so far, so the student can already see the ones that have finished
+    if submission.results:
+        return jsonify({'state': 'PROGRESS', 'result': submission_result(submission)})
 
-        return jsonify({'state': 'SUCCESS', 'result': result})
+    # If the submission is waiting in the admission queue, send back its
+    # position in the queue and about how many seconds it will wait
+    position = job_position(submission.id)
+    if position:
+        return jsonify({'state': 'QUEUED', 'position': position, 'eta': estimated_wait(position)})
 
     # Get the result of the student_judge_code Celery task
     task = student_judge_code.AsyncResult(task_id)
@@ -485,6 +546,11 @@ def task_status(task_id):
         # Get the submission id and the result Python dict
         result, submission_id = task.get()
 
+        # If the results are being sent to the callback route (or the submission is
+        # waiting in the judge outbox), they aren't all in yet
+        if result is None:
+            return jsonify({'state': 'PENDING'})
+
         # Get the submission DB object
         submission = Submission.query.filter_by(id=submission_id).first()
 
@@ -499,13 +565,45 @@ def task_status(task_id):
     return jsonify({'state': 'PENDING'})
 
 
+# Get a submission's status (the same as task_status's response) as a stream of
+# server-sent events, so the page gets each update without polling. It isn't rate limited, since a
+# whole class (behind one IP address) reconnects every EVENT_STREAM_MAX_DURATION seconds
+@app.route('/status/<task_id>/events')
+@limiter.exempt
+def task_status_events(task_id):
+    submission = Submission.query.filter_by(uuid=task_id).first_or_404()
+
+    # Subscribe before getting the current state, so no update is missed
+    pubsub = subscribe(f'submission:{submission.id}')
+
+    # The submission's position in the admission queue, if it's waiting to be sent to the judge
+    position = job_position(submission.id)
+
+    if submission.done:
+        initial = {'state': 'SUCCESS', 'result': submission_result(submission)}
+    elif submission.results:
+        initial = {'state': 'PROGRESS', 'result': submission_result(submission)}
+    elif position:
+        initial = {'state': 'QUEUED', 'position': position, 'eta': estimated_wait(position)}
+    else:
+        initial = {'state': 'PENDING'}
+
+    # Don't hold on to a database connection for as long as the stream is open
+    db.session.remove()
+
+    return event_stream(pubsub, initial)
+
+
 # View the results of a specific submission
 @app.route('/student/submission/<task_id>')
+@query_budget(4)
 @abort_student_not_found
 def student_submission(task_id):
     # Get the student, submission, and problem from the database
     student = Student.query.filter_by(identifier=session['student_id']).first_or_404()
-    submission = Submission.query.filter_by(uuid=task_id, student=student).first_or_404()
+    submission = Submission.query.filter_by(uuid=task_id, student=student).options(
+        db.joinedload(Submission.problem).joinedload(Problem.class_),
+        db.joinedload(Submission.problem).joinedload(Problem.user), db.joinedload(Submission.language)).first_or_404()
     problem = submission.problem
 
     # Generate the presigned URL for the code
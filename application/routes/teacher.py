@@ -10,12 +10,17 @@ from secrets import token_urlsafe
 from functools import wraps
 from cryptography.fernet import Fernet
 from flask import render_template, url_for, flash, redirect, request, abort, send_file, jsonify
-from application import app, db, bcrypt, mail, serializer, celery, limiter
+from application import app, db, bcrypt, mail, serializer, celery, limiter, redis_store
 from flask_login import login_user, current_user, logout_user, login_required
 from application.forms.teacher import *
 from application.settingssecrets import *
 from application.models.general import *
 from application.utils import *
+from application.registry import registry
+from application.events import publish_event, subscribe, event_stream
+from application.query_budget import query_budget
+from application.judge.grading import rescore_problem, refresh_scores
+from application.judge.rejudge import rejudge_candidates, rejudge_submissions
 
 # Initialize AWS's Python SDK (Boto3) resource (higher-level API) with the access key and secret access key
 s3 = boto3.resource('s3', aws_access_key_id=AWS_ACCESS_KEY_ID,
@@ -315,6 +320,7 @@ def teacher_delete_account():
 
 # A route to update the current user's account
 @app.route('/account', methods=['GET', 'POST'])
+@query_budget(3)
 @login_required
 @abort_teacher_not_confirmed
 def teacher_account():
@@ -340,17 +346,20 @@ def teacher_account():
 
 # The teacher's dashboard
 @app.route('/dashboard')
+@query_budget(6)
 @login_required
 @abort_teacher_not_confirmed
 def teacher_dashboard():
-    # Get all of the classes that are associated to the current user
-    # classes_ = Class_.query.filter_by(user=current_user).all()
-    classes_ = current_user.classes
+    # Get all of the classes that are associated to the current user, along with each one's teachers, students, and
+    # problems (which the dashboard shows), loaded for every class at once instead of one class at a time
+    classes_ = Class_.query.filter(Class_.users.any(id=current_user.id)).options(
+        db.selectinload(Class_.users), db.selectinload(Class_.students), db.selectinload(Class_.problems)).all()
     return render_template('teacher/general/dashboard.html', classes_=classes_, page_title='Dashboard')
 
 
 # Creating a new class
 @app.route('/new-class', methods=['GET', 'POST'])
+@query_budget(4)
 @login_required
 @abort_teacher_not_confirmed
 def new_class():
@@ -370,6 +379,7 @@ def new_class():
 
 # A class's homepage
 @app.route('/class/<string:identifier>/home')
+@query_budget(6)
 @login_required
 @abort_teacher_not_confirmed
 def teacher_class_home(identifier):
@@ -381,14 +391,13 @@ def teacher_class_home(identifier):
     # Get all of the problems associated to that class
     problems = Problem.query.filter_by(class_=class_).order_by(Problem.create_date_time.desc()).all()
 
-    # Call a utility function which, for each problem, gets the
-    # number of unique students that have submitted the problem
-    u = get_unique_students_problem(problems)
-    return render_template('teacher/classes/home.html', problems=problems, class_=class_, identifier=identifier, u=u,
+    # Each problem keeps count of the number of unique students that have submitted to it
+    return render_template('teacher/classes/home.html', problems=problems, class_=class_, identifier=identifier,
                            page_title=class_.name)
 
 
-# A route for deleting a class (uses hashing to ensure the user themselves requested the deletion
+# A route for deleting a class (uses hashing to ensure the user themselves requested the deletion. It has no query
+# budget, since it deletes each of the class's problems in a transaction of its own, so its queries grow with them)
 @app.route('/class/<string:identifier>/delete')
 def teacher_class_delete(identifier):
     # If the user isn't logged in, don't tell them that this page exists!
@@ -432,6 +441,7 @@ def teacher_class_delete(identifier):
 
 # The students from a particular class
 @app.route('/class/<string:identifier>/users', methods=['GET', 'POST'])
+@query_budget(8)
 @login_required
 @abort_teacher_not_confirmed
 def teacher_class_students(identifier):
@@ -456,12 +466,8 @@ def teacher_class_students(identifier):
     # Get all of the students associated to that class
     students = class_.students
 
-    marks = {}
-
-    # For each student, get their mark for each problem based
-    # on their highest submission by calling the utility function
-    for student in students:
-        marks[student] = get_student_mark(student, class_)
+    # Get each student's mark for each problem based on their highest submission, all at once
+    marks = get_gradebook(class_)
 
     key = serializer.dumps(class_.id, salt=os.environ.get('SECRET_KEY'))
 
@@ -472,6 +478,7 @@ def teacher_class_students(identifier):
 
 # Options route
 @app.route('/class/<string:identifier>/options', methods=['GET', 'POST'])
+@query_budget(6)
 @login_required
 @abort_teacher_not_confirmed
 def teacher_class_options(identifier):
@@ -517,6 +524,7 @@ def teacher_class_options(identifier):
 
 # Route to accept invite for a class
 @app.route('/class/<string:identifier>/invite', methods=['GET', 'POST'])
+@query_budget(6)
 @login_required
 @abort_teacher_not_confirmed
 def teacher_class_invite(identifier):
@@ -552,6 +560,7 @@ def teacher_class_invite(identifier):
 
 # Creating a new problem
 @app.route('/class/<string:identifier>/new-problem', methods=['GET', 'POST'])
+@query_budget(25)
 @login_required
 @abort_teacher_not_confirmed
 def teacher_class_new_problem(identifier):
@@ -587,6 +596,7 @@ def teacher_class_new_problem(identifier):
 
         allow_multiple_submissions = form.allow_multiple_submissions.data
         auto_grade = form.auto_grade.data
+        fail_fast = form.fail_fast.data
         visible = form.visible.data
 
         # Get each input and output file
@@ -605,6 +615,7 @@ def teacher_class_new_problem(identifier):
         # Create a new problem with the attributes provided by the form
         problem = Problem(user=current_user, title=title, description=description, total_marks=marks_out_of,
                           allow_multiple_submissions=allow_multiple_submissions, auto_grade=auto_grade,
+                          fail_fast=fail_fast,
                           identifier=token_urlsafe(8), class_=class_, description_html=description_html,
                           visible=visible)
 
@@ -618,8 +629,7 @@ def teacher_class_new_problem(identifier):
         # For every language that the user chose, get the corresponding database
         # object then create a relationship between that problem and language
         for lang in languages:
-            lang_object = Language.query.filter_by(number=int(lang)).first()
-            problem.languages.append(lang_object)
+            problem.languages.append(registry.attach(registry.language(lang)))
 
         # If the user selects the "auto grade" checkbox
         if auto_grade:
@@ -655,6 +665,7 @@ def teacher_class_new_problem(identifier):
 
 # Each problem's page
 @app.route('/class/<string:class_identifier>/problem/<string:problem_identifier>', methods=['GET', 'POST'])
+@query_budget(12)
 @login_required
 @abort_teacher_not_confirmed
 def teacher_class_problem(class_identifier, problem_identifier):
@@ -686,23 +697,26 @@ def teacher_class_problem(class_identifier, problem_identifier):
     student_submissions = {}
     not_submitted = []
 
+    # The students who have submitted to the problem are the ones with a score in it
+    scores = {score.student_id for score in StudentProblemScore.query.filter_by(problem_id=problem.id)}
+
+    # Get the problem's finished submissions in one query, sorted based on the date
+    # and time the submission was sent in descending order, and group them by student
+    submissions = Submission.query.filter_by(problem=problem, done=True).order_by(Submission.date_time.desc()).all()
+
     # For every student in the class:
     for student in class_.students:
-        # Take the intersection (common elements) from that student's submissions as well
-        # as that problem's submissions and sort the student's submissions based on the date
-        # and time the submission was sent in descending order
-        student_submissions_list = Submission.query.filter_by(problem=problem, student=student, done=True).all()
-
-        if not student_submissions_list:
+        if student.id not in scores:
             not_submitted.append(student)
             continue
 
         # Set that student's submissions to a list
         student_submissions[student] = []
 
-        for submission in sorted(student_submissions_list, key=lambda x: x.date_time,
-                                 reverse=True):
-            student_submissions[student].append(submission)
+    students = {student.id: student for student in student_submissions}
+    for submission in submissions:
+        if submission.student_id in students:
+            student_submissions[students[submission.student_id]].append(submission)
 
     # Since there are two tabs, problem info and student submissions, show the problem info as default
     show_student_submissions = 'dontshow'
@@ -739,11 +753,12 @@ def teacher_class_problem(class_identifier, problem_identifier):
                            active_student_submissions=active_student_submissions,
                            show_student_submissions=show_student_submissions, show_problem_info=show_problem_info,
                            active_show_problem=active_show_problem, page_title=f'{problem.title} - {class_.name}',
-                           form=plagiarism_form, not_submitted=not_submitted)
+                           form=plagiarism_form, not_submitted=not_submitted, rejudge_form=RejudgeProblemForm())
 
 
 # The page to show the MOSS links for each language in the problem
 @app.route('/class/<string:class_identifier>/problem/<string:problem_identifier>/plagiarism-check/<string:task_id>')
+@query_budget(4)
 def teacher_class_problem_plagiarism(class_identifier, problem_identifier, task_id):
     # Get the class and problem
     class_ = Class_.query.filter_by(identifier=class_identifier).first_or_404()
@@ -760,6 +775,18 @@ def teacher_class_problem_plagiarism(class_identifier, problem_identifier, task_
 # The background task to return MOSS links for checking plagiarism
 @celery.task(bind=True)
 def teacher_check_for_plagiarism(self, class_identifier, problem_identifier, user_id):
+    urls = check_for_plagiarism(problem_identifier, user_id)
+
+    # Let the plagiarism page know that the check has finished, with the same response as the status route
+    publish_event(f'plagiarism:{self.request.id}', {'state': 'SUCCESS',
+                                                     'urls': get_plagiarism_urls(self.request.id) or urls})
+
+    return urls
+
+
+# Send every submission of a problem to MOSS, returning the MOSS links
+# for each language (or the error message to show to the teacher)
+def check_for_plagiarism(problem_identifier, user_id):
     # Get the problem and the teacher that initiated the MOSS request
     problem = Problem.query.filter_by(identifier=problem_identifier).first()
     user = User.query.filter_by(id=user_id).first()
@@ -829,15 +856,10 @@ def teacher_check_for_plagiarism(self, class_identifier, problem_identifier, use
             # Create the MOSSResult db object
             moss_result = MOSSResult(link=urls[lang], uuid=celery.current_task.request.id, problem=problem)
 
-            # Get the languages that have the specific short name (for example,
-            # Clang++ and multiple versions of GCC for C++ have the same short name)
-            languages_db = Language.query.filter_by(short_name=lang).all()
-
-            # Add the languages that are common between the languages in the
-            # problem and the languages that are associated to that short_name
-            # (for example, if Clang++ has a short_name of cc, but is not a choice
+            # Add the problem's languages that have the specific short name (for example, Clang++ and
+            # multiple versions of GCC for C++ have the same short name, but if Clang++ is not a choice
             # in the problem, then don't add it)
-            moss_result.languages.extend(list(set(languages_db) & set(problem.languages)))
+            moss_result.languages.extend([l for l in problem.languages if l.short_name == lang])
             db.session.add(moss_result)
 
         # Remove each temp file
@@ -856,20 +878,30 @@ def teacher_check_for_plagiarism(self, class_identifier, problem_identifier, use
     return urls
 
 
-# Get the status of a plagiarism task
-@app.route('/plagiarism-status/<task_id>')
-def teacher_get_plagiarism_task_status(task_id):
+# Get the MOSS links of a plagiarism task from the database, or None if the task hasn't saved them
+def get_plagiarism_urls(task_id):
     # Get the MOSS results associated to that task id
-    moss_results = MOSSResult.query.filter_by(uuid=task_id).all()
+    moss_results = MOSSResult.query.filter_by(uuid=task_id).options(db.selectinload(MOSSResult.languages)).all()
+
+    if not moss_results:
+        return None
+
+    # Add the proper languages name (such as "C++ (GCC 7.8.0)" instead of "cc")
+    # to the urls dictionary as the key then add the URL as the value
+    urls = {}
+    for moss_r in moss_results:
+        urls[', '.join([lang.name for lang in moss_r.languages])] = moss_r.link
+
+    return urls
 
-    # If the db object exists, then add the proper languages name (such as
-    # "C++ (GCC 7.8.0)" instead of "cc") to the urls dictionary as the key
-    # then add the URL as the value
-    if moss_results:
-        urls = {}
-        for moss_r in moss_results:
-            urls[', '.join([lang.name for lang in moss_r.languages])] = moss_r.link
 
+# Get the status of a plagiarism task
+@app.route('/plagiarism-status/<task_id>')
+@query_budget(3)
+def teacher_get_plagiarism_task_status(task_id):
+    # If the db object exists, then return its URLs
+    urls = get_plagiarism_urls(task_id)
+    if urls:
         return jsonify({'state': 'SUCCESS', 'urls': urls})
 
     # If there are no associated db objects, then get the result
@@ -886,8 +918,148 @@ def teacher_get_plagiarism_task_status(task_id):
     return jsonify({'state': 'PENDING'})
 
 
+# Get the status of a plagiarism task as a stream of server-sent events, so the page is told when the task
+# finishes without polling (not rate limited, since the browser reconnects every EVENT_STREAM_MAX_DURATION seconds)
+@app.route('/plagiarism-status/<task_id>/events')
+@query_budget(2)
+@limiter.exempt
+def teacher_get_plagiarism_task_status_events(task_id):
+    # Subscribe before getting the current state, so the task finishing in between isn't missed
+    pubsub = subscribe(f'plagiarism:{task_id}')
+
+    urls = get_plagiarism_urls(task_id)
+    initial = {'state': 'SUCCESS', 'urls': urls} if urls else {'state': 'PENDING'}
+
+    # Don't hold on to a database connection for as long as the stream is open
+    db.session.remove()
+
+    return event_stream(pubsub, initial)
+
+
+# Rejudge a problem's submissions (such as after its test cases were fixed) in the background
+@app.route('/class/<string:class_identifier>/problem/<string:problem_identifier>/rejudge', methods=['POST'])
+@query_budget(6)
+@login_required
+@abort_teacher_not_confirmed
+def teacher_class_problem_rejudge(class_identifier, problem_identifier):
+    # Get the class and problem, and make sure the teacher is in the class
+    class_ = Class_.query.filter_by(identifier=class_identifier).first_or_404()
+    if class_ not in current_user.classes:
+        abort(404)
+
+    problem = Problem.query.filter_by(identifier=problem_identifier, class_=class_).first_or_404()
+
+    form = RejudgeProblemForm()
+
+    # Only auto graded problems have results to rejudge
+    if not problem.auto_grade or not form.validate_on_submit():
+        flash('The submissions could not be rejudged.', 'danger')
+        return redirect(url_for('teacher_class_problem', class_identifier=class_identifier,
+                                problem_identifier=problem_identifier))
+
+    # Call the Celery task to rejudge the submissions, and remember which problem it rejudges (for as long as Celery
+    # keeps its result), so that only the problem's teachers can see its progress. Then show its progress
+    task = teacher_rejudge_problem.delay(problem.id, form.submissions.data)
+    redis_store.set(f'rejudge:task:{task.id}', problem.id, ex=celery.conf.result_expires)
+
+    return redirect(url_for('teacher_class_problem_rejudge_progress', class_identifier=class_identifier,
+                            problem_identifier=problem_identifier, task_id=task.id))
+
+
+# Get the class and problem of a rejudge task, making sure the teacher is in the class and that the task rejudges
+# the problem (otherwise, abort with 404)
+def get_rejudge_problem(class_identifier, problem_identifier, task_id):
+    class_ = Class_.query.filter_by(identifier=class_identifier).first_or_404()
+    if class_ not in current_user.classes:
+        abort(404)
+
+    problem = Problem.query.filter_by(identifier=problem_identifier, class_=class_).first_or_404()
+
+    if redis_store.get(f'rejudge:task:{task_id}') != str(problem.id).encode():
+        abort(404)
+
+    return class_, problem
+
+
+# The page to show the progress of a rejudge
+@app.route('/class/<string:class_identifier>/problem/<string:problem_identifier>/rejudge/<string:task_id>')
+@query_budget(6)
+@login_required
+@abort_teacher_not_confirmed
+def teacher_class_problem_rejudge_progress(class_identifier, problem_identifier, task_id):
+    class_, problem = get_rejudge_problem(class_identifier, problem_identifier, task_id)
+
+    return render_template('teacher/classes/rejudge.html', task_id=task_id, class_=class_, problem=problem,
+                           page_title=f'Rejudge - {problem.title}')
+
+
+# The background task to rejudge a problem's submissions (all of them, or the ones chosen by the filter), all in
+# one task instead of one for each submission
+@celery.task(bind=True)
+def teacher_rejudge_problem(self, problem_id, which):
+    problem = Problem.query.filter_by(id=problem_id).first()
+    submissions = rejudge_candidates(problem, which)
+
+    # Let the rejudge page know how many submissions have been rejudged so far
+    def progress(done, total):
+        status = {'state': 'PROGRESS', 'done': done, 'total': total}
+        self.update_state(state='PROGRESS', meta=status)
+        publish_event(f'rejudge:{self.request.id}', status)
+
+    progress(0, len(submissions))
+
+    result = rejudge_submissions(problem, submissions, s3, bucket_name, progress)
+
+    publish_event(f'rejudge:{self.request.id}', {'state': 'SUCCESS', 'result': result})
+
+    return result
+
+
+# Get the status of a rejudge task, in the same format as the events it publishes
+def get_rejudge_status(task_id):
+    task = teacher_rejudge_problem.AsyncResult(task_id)
+
+    if task.state == 'SUCCESS':
+        return {'state': 'SUCCESS', 'result': task.get()}
+
+    if task.state == 'PROGRESS':
+        return task.info
+
+    return {'state': 'PENDING'}
+
+
+# Get the status of a rejudge task
+@app.route('/class/<string:class_identifier>/problem/<string:problem_identifier>/rejudge/<string:task_id>/status')
+@query_budget(4)
+@login_required
+@abort_teacher_not_confirmed
+def teacher_get_rejudge_task_status(class_identifier, problem_identifier, task_id):
+    get_rejudge_problem(class_identifier, problem_identifier, task_id)
+
+    return jsonify(get_rejudge_status(task_id))
+
+
+# Get the status of a rejudge task as a stream of server-sent events, so the page gets each update without polling
+@app.route('/class/<string:class_identifier>/problem/<string:problem_identifier>/rejudge/<string:task_id>/events')
+@query_budget(4)
+@login_required
+@abort_teacher_not_confirmed
+def teacher_get_rejudge_task_status_events(class_identifier, problem_identifier, task_id):
+    get_rejudge_problem(class_identifier, problem_identifier, task_id)
+
+    # Subscribe before getting the current state, so no update is missed
+    pubsub = subscribe(f'rejudge:{task_id}')
+    initial = get_rejudge_status(task_id)
+
+    # Don't hold on to a database connection for as long as the stream is open
+    db.session.remove()
+
+    return event_stream(pubsub, initial)
+
+
 # Route to delete a problem
 @app.route('/class/<string:class_identifier>/problem/<string:problem_identifier>/delete')
+@query_budget(30)
 def teacher_class_problem_delete(class_identifier, problem_identifier):
     if not current_user.is_authenticated:
         abort(404)
@@ -897,7 +1069,16 @@ def teacher_class_problem_delete(class_identifier, problem_identifier):
     if class_ not in current_user.classes:
         abort(404)
 
-    problem = Problem.query.filter_by(identifier=problem_identifier, class_=class_).first_or_404()
+    # Along with everything that deleting the problem deletes (each test case's and submission's results, and so on),
+    # in a query for each kind instead of one for each test case and submission
+    problem = Problem.query.filter_by(identifier=problem_identifier, class_=class_).options(
+        db.selectinload(Problem.input_files).selectinload(InputFile.results),
+        db.selectinload(Problem.input_files).selectinload(InputFile.output_file),
+        db.selectinload(Problem.output_files).selectinload(OutputFile.results),
+        db.selectinload(Problem.submissions).selectinload(Submission.results),
+        db.selectinload(Problem.submissions).selectinload(Submission.outbox),
+        db.selectinload(Problem.moss_results).selectinload(MOSSResult.languages),
+        db.selectinload(Problem.scores)).first_or_404()
 
     # Hash the same properties as was passed from the problem page
     sha_hash_contents = sha256(
@@ -926,6 +1107,7 @@ def teacher_class_problem_delete(class_identifier, problem_identifier):
 
 # Edit a problem
 @app.route('/class/<string:class_identifier>/problem/<string:problem_identifier>/edit', methods=['GET', 'POST'])
+@query_budget(20)
 @login_required
 @abort_teacher_not_confirmed
 def teacher_class_problem_edit(class_identifier, problem_identifier):
@@ -948,6 +1130,9 @@ def teacher_class_problem_edit(class_identifier, problem_identifier):
             problem.memory_limit = form.memory_limit.data
         if form.time_limit.data:
             problem.time_limit = form.time_limit.data
+        # Whether the problem's total marks are changing, in which case every submission is rescored
+        rescore = problem.total_marks != form.total_marks.data
+
         problem.title = form.title.data
         problem.description = form.description.data
         problem.description_html = mistune.html(form.description.data)
@@ -958,15 +1143,20 @@ def teacher_class_problem_edit(class_identifier, problem_identifier):
         # Reset, then change the problem's languages
         problem.languages = []
         for lang in form.languages.data:
-            lang_object = Language.query.filter_by(number=int(lang)).first()
-            problem.languages.append(lang_object)
+            problem.languages.append(registry.attach(registry.language(lang)))
 
         problem.allow_multiple_submissions = form.allow_multiple_submissions.data
         problem.allow_more_submissions = form.allow_more_submissions.data
+        problem.fail_fast = form.fail_fast.data
+        problem.priority = form.priority.data or 1
 
         # Commit the changes the database then flash
         db.session.commit()
 
+        # Bring the marks of every submission (and its results) to the new total marks
+        if rescore:
+            rescore_problem(problem)
+
         flash('The problem has been updated.', 'success')
 
         return redirect(url_for('teacher_class_problem', class_identifier=class_identifier,
@@ -982,6 +1172,8 @@ def teacher_class_problem_edit(class_identifier, problem_identifier):
     form.allow_multiple_submissions.data = problem.allow_multiple_submissions
     form.allow_more_submissions.data = problem.allow_more_submissions
     form.visible.data = problem.visible
+    form.fail_fast.data = problem.fail_fast
+    form.priority.data = problem.priority
 
     return render_template('teacher/classes/problem-edit.html', problem=problem, identifier=class_identifier, form=form,
                            class_=class_, page_title=f'Edit Problem - {problem.title} - {class_.name}')
@@ -989,11 +1181,17 @@ def teacher_class_problem_edit(class_identifier, problem_identifier):
 
 # View a student's submission to a problem
 @app.route('/teacher/submission/<task_id>', methods=['GET', 'POST'])
+@query_budget(12)
 @login_required
 @abort_teacher_not_confirmed
 def teacher_student_submission(task_id):
-    # Get the submission and problem from the URL
-    submission = Submission.query.filter_by(uuid=task_id, done=True).first_or_404()
+    # Get the submission and problem from the URL, along with everything the page shows about
+    # them (such as the status of each result), so none of it has to be loaded on its own
+    submission = Submission.query.filter_by(uuid=task_id, done=True).options(
+        db.joinedload(Submission.problem).joinedload(Problem.class_).selectinload(Class_.users),
+        db.joinedload(Submission.problem).joinedload(Problem.user), db.joinedload(Submission.student),
+        db.joinedload(Submission.language), db.selectinload(Submission.results).joinedload(Result.status)) \
+        .first_or_404()
     problem = submission.problem
 
     # If the user isn't in the class's teachers
@@ -1007,7 +1205,11 @@ def teacher_student_submission(task_id):
     if form.validate_on_submit():
         mark = form.mark.data
         submission.marks = round(float(mark), 2)
+        submission.marks_overridden = True
         db.session.commit()
+
+        # The student's best score in the problem may have changed
+        refresh_scores(problem, submission.student_id)
         flash('The mark has been updated.', 'success')
         return redirect(url_for('teacher_student_submission', task_id=task_id))
 
@@ -1035,6 +1237,7 @@ def teacher_student_submission(task_id):
 
 
 @app.route('/class/<string:class_identifier>/student/<string:student_identifier>', methods=['GET', 'POST'])
+@query_budget(9)
 @login_required
 @abort_teacher_not_confirmed
 def teacher_class_specific_student(class_identifier, student_identifier):
@@ -1046,18 +1249,16 @@ def teacher_class_specific_student(class_identifier, student_identifier):
     # Get the student
     student = Student.query.filter_by(identifier=student_identifier, class_=class_).first_or_404()
 
-    # Get the student's average mark
-    average_mark = get_student_mark(student, class_)
+    # Get the student's average mark, and their best score in each problem
+    gradebook = get_gradebook(class_, student)[student.id]
+    average_mark = gradebook['total']
 
-    # Get the student's submissions showing the latest one first
-    all_student_submissions = Submission.query.filter_by(student=student, done=True).all()
-    submissions = sorted(all_student_submissions, key=lambda s: s.date_time, reverse=True)
+    # Get the student's submissions showing the latest one first, along with the problem each one is to
+    submissions = Submission.query.filter_by(student=student, done=True).options(
+        db.joinedload(Submission.problem)).order_by(Submission.date_time.desc()).all()
 
-    # Get the problems that the student has not submitted to, using simple list comprehension
-    not_submitted = []
-
-    for problem in class_.problems:
-        not_submitted.append(problem) if student not in [s.student for s in problem.submissions] else None
+    # Get the problems that the student has not submitted to (the ones they don't have a score in)
+    not_submitted = [problem for problem in class_.problems if problem.id not in gradebook['problems']]
 
     return render_template('teacher/classes/student.html', class_=class_, student=student, average_mark=average_mark,
                            submissions=submissions, not_submitted=not_submitted,
@@ -1065,6 +1266,7 @@ def teacher_class_specific_student(class_identifier, student_identifier):
 
 
 @app.route('/class/<string:class_identifier>/student/<string:student_identifier>/delete')
+@query_budget(18)
 def teacher_class_delete_student(class_identifier, student_identifier):
     # If the user isn't logged in, don't tell them that this page exists!
     if not current_user.is_authenticated:
@@ -1075,7 +1277,12 @@ def teacher_class_delete_student(class_identifier, student_identifier):
     if class_ not in current_user.classes:
         abort(404)
 
-    student = Student.query.filter_by(identifier=student_identifier, class_=class_).first_or_404()
+    # Along with everything that deleting the student deletes, in a query for each kind instead of one for each of
+    # their submissions
+    student = Student.query.filter_by(identifier=student_identifier, class_=class_).options(
+        db.selectinload(Student.submissions).selectinload(Submission.results),
+        db.selectinload(Student.submissions).selectinload(Submission.outbox),
+        db.selectinload(Student.scores)).first_or_404()
 
     # Delete the student if the hashes match of the required attributes
     sha_hash_contents = sha256(f'{class_.id}{student.id}{current_user.password}'.encode('utf-8')).hexdigest()
@@ -1087,6 +1294,9 @@ def teacher_class_delete_student(class_identifier, student_identifier):
 
     db.session.commit()
 
+    # The student's submissions were deleted with them, so count the problems' submissions again
+    refresh_problem_counts(class_.problems)
+
     # Let the user know, then redirect
     flash('The student has been deleted.', 'success')
 
@@ -1,7 +1,12 @@
-from application.models.general import Language, Submission, InputFile, OutputFile
+from application.models.general import Problem, Submission, InputFile, OutputFile, Result, StudentProblemScore
 from application import db
+from sqlalchemy import case, distinct, func
+from application.judge.cache import test_case_cache
+from application.registry import registry
 import uuid
+import base64
 import time as tm
+from hashlib import sha256
 from mimetypes import guess_type
 from werkzeug.utils import secure_filename
 
@@ -9,34 +14,49 @@ from werkzeug.utils import secure_filename
 # Get a tuple of (language.id, language.name), the former of which will be
 # returned when the form is submitted and the latter of which will the shown to the user
 def get_languages_form():
-    langs = Language.query.all()
     languages = []
-    for l in langs:
+    for l in registry.languages():
         languages.append((l.number, l.name))
 
     return languages
 
 
-# Get the number of unique students that have submitted each problem
-def get_unique_students_problem(problems):
-    u = {}
+# Count a new submission in its problem's counters, along with its student if it's their first submission to the
+# problem. The counters are changed in one UPDATE, so submissions made at the same time can't overwrite each other's
+# counts (see refresh_problem_counts to repair them)
+def count_new_submission(submission):
+    earlier = db.session.query(Submission.id).filter(Submission.problem_id == submission.problem_id,
+                                                     Submission.student_id == submission.student_id,
+                                                     Submission.id != submission.id).exists()
 
-    # For every problem
-    for p in problems:
-        u[p] = []
+    Problem.query.filter_by(id=submission.problem_id).update(
+        {Problem.submissions_count: Problem.submissions_count + 1,
+         Problem.submitters_count: Problem.submitters_count + case([(earlier, 0)], else_=1)},
+        synchronize_session=False)
+
+
+# Count a submission that has just finished judging in its problem's counters
+def count_finished_submission(submission):
+    Problem.query.filter_by(id=submission.problem_id).update(
+        {Problem.done_submissions_count: Problem.done_submissions_count + 1}, synchronize_session=False)
+
+
+# Work out the counters of problems again from their submissions, in one query (such as after submissions were
+# deleted, or to repair them)
+def refresh_problem_counts(problems):
+    counts = {p.id: (0, 0, 0) for p in problems}
 
-        # Get all of the submission of the problem
-        submissions = Submission.query.filter_by(problem=p).all()
+    query = db.session.query(Submission.problem_id, func.count(distinct(Submission.student_id)),
+                             func.count(Submission.id), func.count(case([(Submission.done == True, 1)]))) \
+        .filter(Submission.problem_id.in_(counts)).group_by(Submission.problem_id)
 
-        # Only add that submission's student's identifier if it does not already exist
-        for s in submissions:
-            if s.student.identifier not in u[p]:
-                u[p].append(s.student.identifier)
+    for problem_id, *problem_counts in query:
+        counts[problem_id] = problem_counts
 
-        # Get the number of unique students that have submitted the problem, and not the students themselves
-        u[p] = len(u[p])
+    for p in problems:
+        p.submitters_count, p.submissions_count, p.done_submissions_count = counts[p.id]
 
-    return u
+    db.session.commit()
 
 
 # Upload the input and it's corresponding output file
@@ -57,22 +77,30 @@ def upload_input_output_file(num, input_file_object, output_file_object, class_,
     input_file_path = f'classes/{class_.identifier}/problems/{problem.identifier}/input_files/input{num}.txt'
 
     # Create the input file's database object with its attributes, then associate it to the problem
-    inp = InputFile(number=num, file_path=input_file_path, file_size=len(input_file_data), problem=problem)
+    inp = InputFile(number=num, file_path=input_file_path, file_size=len(input_file_data), problem=problem,
+                    content_hash=sha256(input_file_data).hexdigest(), payload_path=f'{input_file_path}.b64')
 
     # Upload the input file to AWS S3 with the mimetype being "text/plain"
     # so the user can view the file without needing to download it
     s3_object = s3.Object(bucket_name, input_file_path)
     s3_object.put(Body=input_file_data, ContentType='text/plain')
 
+    # Also upload it base64 encoded, so the judge can send it without encoding it on every run
+    s3.Object(bucket_name, inp.payload_path).put(Body=base64.b64encode(input_file_data), ContentType='text/plain')
+
     # Create the output file's database object with its attributes, then associate it to the problem
     output_file_path = f'classes/{class_.identifier}/problems/{problem.identifier}/output_files/output{num}.txt'
-    out = OutputFile(number=num, file_path=output_file_path, file_size=len(output_file_data), problem=problem)
+    out = OutputFile(number=num, file_path=output_file_path, file_size=len(output_file_data), problem=problem,
+                     content_hash=sha256(output_file_data).hexdigest(), payload_path=f'{output_file_path}.b64')
 
     # Upload the output file to AWS S3 with the mimetype being "text/plain"
     # so the user can view the file without needing to download it
     s3_object = s3.Object(bucket_name, output_file_path)
     s3_object.put(Body=output_file_data, ContentType='text/plain')
 
+    # Also upload it base64 encoded, like the input file
+    s3.Object(bucket_name, out.payload_path).put(Body=base64.b64encode(output_file_data), ContentType='text/plain')
+
     # Associate the output file with the input file
     inp.output_file = out
 
@@ -82,6 +110,9 @@ def upload_input_output_file(num, input_file_object, output_file_object, class_,
 
     db.session.commit()
 
+    # The problem's files have changed, so drop any of its files that this worker has cached
+    test_case_cache.invalidate(problem.id)
+
 
 # Ipload the student's submission file
 def upload_submission_file(language, submission_file_object, class_, problem, s3, bucket_name, student,
@@ -99,7 +130,7 @@ def upload_submission_file(language, submission_file_object, class_, problem, s3
         return 'The maximum file size you can add is 1 megabyte.'
 
     # Get the language that the student submitted in
-    language = Language.query.filter_by(number=language).first()
+    language = registry.language(language)
 
     # Create the file path to be stored in AWS based on the class, problem,
     # student, and the current UNIX Timestamp (seconds from Jan 1, 1970)
@@ -115,54 +146,66 @@ def upload_submission_file(language, submission_file_object, class_, problem, s3
 
     # Create the submission DB object, then add and commit it
     submission = Submission(file_path=submission_file_path, file_size=len(submission_file_data), problem=problem,
-                            student=student, language=language, uuid=uuid_)
+                            student=student, language_id=language.id, uuid=uuid_,
+                            source_hash=sha256(submission_file_data).hexdigest())
     db.session.add(submission)
+    db.session.flush()
+
+    # Count the submission in its problem's counters in the same transaction
+    count_new_submission(submission)
     db.session.commit()
 
     # Return the submission and the UUID (has an _ to prevent the name from clashing with the module UUID)
     return submission, uuid_
 
 
-# Get a given student's average mark based on their highest submission for each problem
-def get_student_mark(student, class_):
-    # Get every problem associated to the class
-    problems = class_.problems
-    marks = [0, 0, '0%']
+# Get the gradebook of a class (or of one of its students): each student's highest mark in each problem that they've
+# submitted to, and their total (a list of the marks they earned, the total marks of those problems, and their average
+# percentage). Every student's highest marks are read from their scores in one query. Returns a dict of each
+# student's id and their gradebook entry, a dict with their "problems" (each problem's id and their highest mark in
+# it) and "total"
+def get_gradebook(class_, student=None):
+    students = [student] if student else class_.students
+    gradebook = {s.id: {'problems': {}, 'total': [0, 0, '0%']} for s in students}
 
-    # Iterate over each problem
-    for p in problems:
-        try:
-            # Filter the submissions in the problem such that the user that submitted
-            # it is the student to get the highest mark from, then get the highest mark
-            # using the max function and the key to check being the marks that the submission earned
-            submissions = Submission.query.filter_by(problem=p, done=True).all()
-            max_mark_submissions = max(list(filter(lambda a: a.student == student, submissions)),
-                                       key=lambda s: s.marks)
-
-        # This error occurs if the student has made no submissions to the
-        # problem, since you cannot file the max element of an empty list
-        except ValueError:
+    total_marks = {p.id: p.total_marks for p in class_.problems}
+
+    query = StudentProblemScore.query.filter(StudentProblemScore.problem_id.in_(total_marks))
+
+    if student:
+        query = query.filter(StudentProblemScore.student_id == student.id)
+
+    for score in query:
+        if score.student_id not in gradebook:
             continue
 
-        # Add the highest submission's marks as well as the total marks of the problem to the list to return
-        marks[0] += max_mark_submissions.marks
-        marks[1] += p.total_marks
+        entry = gradebook[score.student_id]
+        entry['problems'][score.problem_id] = score.best_marks
 
-    # If the student has done at least one problem, calculate their average
+        # Add the highest submission's marks as well as the total marks of the problem to the student's total
+        entry['total'][0] = round(entry['total'][0] + score.best_marks, 2)
+        entry['total'][1] += total_marks[score.problem_id]
+
+    # If a student has done at least one problem, calculate their average
     # percentage, else keep it as 0 to avoid throwing a ZeroDivisionError
-    if marks[1] != 0:
-        marks[2] = f'{round(marks[0] / marks[1] * 100, 2)}%'
+    for entry in gradebook.values():
+        if entry['total'][1] != 0:
+            entry['total'][2] = f"{round(entry['total'][0] / entry['total'][1] * 100, 2)}%"
 
-    return marks
+    return gradebook
 
 
 # Delete all input and output files associated with a problem
 def delete_input_output_files(problem, s3, bucket_name):
-    for input_file in problem.input_files:
-        s3.Object(bucket_name, input_file.file_path).delete()
+    for file in problem.input_files + problem.output_files:
+        s3.Object(bucket_name, file.file_path).delete()
+
+        # Along with its base64 encoded copy
+        if file.payload_path:
+            s3.Object(bucket_name, file.payload_path).delete()
 
-    for output_file in problem.output_files:
-        s3.Object(bucket_name, output_file.file_path).delete()
+    # Drop the deleted files from this worker's test case cache
+    test_case_cache.invalidate(problem.id)
 
 
 # Delete all submission files associated with a problem
@@ -172,3 +215,15 @@ def delete_submission_files(problem, s3, bucket_name, files=None):
 
     for submission in files:
         s3.Object(bucket_name, submission.file_path).delete()
+
+    # Along with the outputs of their results that were stored in S3. Identical outputs (and the results copied from
+    # an identical submission) share one file, so the files that other submissions' results still use are kept
+    submission_ids = [s.id for s in files]
+    output_paths = {path for path, in db.session.query(Result.output_path).distinct()
+                    .filter(Result.submission_id.in_(submission_ids), Result.output_path.isnot(None))}
+
+    still_used = {path for path, in db.session.query(Result.output_path).distinct()
+                  .filter(Result.output_path.in_(output_paths), Result.submission_id.notin_(submission_ids))}
+
+    for output_path in output_paths - still_used:
+        s3.Object(bucket_name, output_path).delete()
@@ -0,0 +1,21 @@
+from application import db
+from application.models.general import Problem, Submission
+from application.judge.grading import refresh_scores
+from application.utils import refresh_problem_counts
+
+# Work out every student's best score in every problem from their finished submissions again (one problem at a time,
+# so this can be run at any time to fix the scores). The table of scores is created and first filled in by the
+# migrations ("flask db upgrade"), which must be run before this
+problems = Problem.query.order_by(Problem.id).all()
+
+for i, problem in enumerate(problems, start=1):
+    # The submissions of a problem that isn't auto graded are done as soon as they're submitted (older ones weren't
+    # marked as done), so they're counted in the problem's counters too
+    if not problem.auto_grade:
+        Submission.query.filter(Submission.problem_id == problem.id, Submission.done.isnot(True)) \
+            .update({Submission.done: True}, synchronize_session=False)
+        db.session.commit()
+        refresh_problem_counts([problem])
+
+    refresh_scores(problem)
+    print(f'Backfilled the scores of problem {problem.id} ({i}/{len(problems)})')
@@ -0,0 +1,160 @@
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+# Benchmark the queries that the routes look rows up with, on a seeded database, before and after the migration that
+# indexes them: the query plan of each one and how long it takes. The database is a new SQLite file unless a database
+# URL is given (such as "python benchmark_query_plans.py postgresql://localhost/codeio_benchmark"), which must be empty
+if len(sys.argv) > 1:
+    os.environ['SQLALCHEMY_DATABASE'] = sys.argv[1]
+else:
+    os.environ['SQLALCHEMY_DATABASE'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'benchmark.db')}"
+
+from flask_migrate import upgrade
+from application import app, db
+from application.models.general import *
+
+# The migration before the indexes were added
+BEFORE_INDEXES = '056a3552fe89'
+
+# The size of the seeded database
+CLASSES = 20
+STUDENTS_PER_CLASS = 30
+PROBLEMS_PER_CLASS = 10
+SUBMISSIONS_PER_STUDENT_PROBLEM = 3
+TEST_CASES_PER_PROBLEM = 5
+
+# The number of times each query is run to time it
+RUNS = 200
+
+
+# Fill the database with classes, their students and problems, and every student's submissions (with their results)
+# to every problem, inserting each table's rows in one statement
+def seed():
+    db.session.execute(User.__table__.insert(), [{'id': 1, 'email': 'benchmark@codeio.tech', 'password': '',
+                                                  'name': 'Benchmark'}])
+    db.session.execute(Status.__table__.insert(), [{'id': i, 'number': i, 'name': f'Status {i}'} for i in range(1, 16)])
+    db.session.execute(Language.__table__.insert(), [{'id': 1, 'number': 71, 'name': 'Python', 'file_extension': 'py'}])
+
+    classes, students, problems, input_files, output_files, submissions, results, moss_results = \
+        [], [], [], [], [], [], [], []
+
+    for c in range(1, CLASSES + 1):
+        classes.append({'id': c, 'identifier': f'class{c}', 'name': f'Class {c}'})
+
+        for s in range(STUDENTS_PER_CLASS):
+            students.append({'id': len(students) + 1, 'name': f'Student {s}', 'identifier': f'student{c}-{s}',
+                             'class_id': c})
+
+        for p in range(PROBLEMS_PER_CLASS):
+            problem_id = len(problems) + 1
+            problems.append({'id': problem_id, 'identifier': f'problem{c}-{p}', 'title': f'Problem {p}',
+                             'description': '', 'description_html': '', 'time_limit': 1, 'memory_limit': 128,
+                             'total_marks': 10, 'auto_grade': True, 'visible': True, 'class_id': c, 'user_id': 1})
+            moss_results.append({'id': problem_id, 'uuid': f'moss{problem_id}', 'link': '', 'problem_id': problem_id})
+
+            for t in range(TEST_CASES_PER_PROBLEM):
+                file_id = len(input_files) + 1
+                input_files.append({'id': file_id, 'number': t + 1, 'file_path': '', 'problem_id': problem_id})
+                output_files.append({'id': file_id, 'number': t + 1, 'file_path': '', 'problem_id': problem_id,
+                                     'input_id': file_id})
+
+            for student in students[-STUDENTS_PER_CLASS:]:
+                for _ in range(SUBMISSIONS_PER_STUDENT_PROBLEM):
+                    submission_id = len(submissions) + 1
+                    submissions.append({'id': submission_id, 'uuid': f'submission{submission_id}', 'file_path': '',
+                                        'marks': submission_id % 11, 'done': True, 'problem_id': problem_id,
+                                        'student_id': student['id'], 'language_id': 1,
+                                        'judge_key': f'key{submission_id}'})
+
+                    for file in input_files[-TEST_CASES_PER_PROBLEM:]:
+                        results.append({'id': len(results) + 1, 'input_id': file['id'], 'output_id': file['id'],
+                                        'token': '', 'correct': True, 'marks': 2, 'marks_out_of': 2,
+                                        'submission_id': submission_id, 'status_id': 3})
+
+    for model, rows in ((Class_, classes), (Student, students), (Problem, problems), (MOSSResult, moss_results),
+                        (InputFile, input_files), (OutputFile, output_files), (Submission, submissions),
+                        (Result, results)):
+        db.session.execute(model.__table__.insert(), rows)
+
+    db.session.commit()
+
+    print(f'Seeded {len(classes)} classes, {len(students)} students, {len(problems)} problems, '
+          f'{len(submissions)} submissions, and {len(results)} results')
+
+
+# The queries to benchmark, each looking up a row in the middle of the seeded data
+def queries():
+    middle_class = CLASSES // 2
+    middle_student = CLASSES * STUDENTS_PER_CLASS // 2
+    middle_problem = CLASSES * PROBLEMS_PER_CLASS // 2
+    middle_submission = middle_problem * STUDENTS_PER_CLASS * SUBMISSIONS_PER_STUDENT_PROBLEM
+
+    return {
+        'Class by identifier': Class_.query.filter_by(identifier=f'class{middle_class}'),
+        'Problem by identifier in a class': Problem.query.filter_by(identifier=f'problem{middle_class}-0',
+                                                                    class_id=middle_class),
+        "A class's problems": Problem.query.filter_by(class_id=middle_class),
+        'Student by identifier': Student.query.filter_by(identifier=f'student{middle_class}-0'),
+        'Submission by UUID': Submission.query.filter_by(uuid=f'submission{middle_submission}'),
+        "A student's finished submissions to a problem": Submission.query.filter_by(
+            problem_id=middle_problem, student_id=middle_student, done=True),
+        'Identical submission by judge key': Submission.query.filter_by(judge_key=f'key{middle_submission}',
+                                                                       done=True),
+        "A submission's results": Result.query.filter_by(submission_id=middle_submission),
+        'Status by number': Status.query.filter_by(number=3),
+        'Language by number': Language.query.filter_by(number=71),
+        'MOSS results by task id': MOSSResult.query.filter_by(uuid=f'moss{middle_problem}'),
+    }
+
+
+# Get the query plan of a query, as the database describes it
+def query_plan(query):
+    sql = str(query.statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+
+    if db.engine.dialect.name == 'sqlite':
+        return [row[-1] for row in db.session.execute(f'EXPLAIN QUERY PLAN {sql}')]
+
+    return [row[0] for row in db.session.execute(f'EXPLAIN {sql}')]
+
+
+# Get the average time (in milliseconds) that a query takes
+def time_query(query):
+    start = perf_counter()
+
+    for _ in range(RUNS):
+        db.session.execute(query.statement).fetchall()
+
+    return (perf_counter() - start) / RUNS * 1000
+
+
+# Print the query plan and the average time of every query, returning the times
+def benchmark(title):
+    db.session.execute('ANALYZE')
+
+    print(f'\n{title}\n{"=" * len(title)}')
+
+    times = {}
+    for name, query in queries().items():
+        times[name] = time_query(query)
+
+        print(f'\n{name}: {times[name]:.3f} ms')
+        for line in query_plan(query):
+            print(f'    {line}')
+
+    return times
+
+
+if __name__ == '__main__':
+    with app.app_context():
+        upgrade(revision=BEFORE_INDEXES)
+        seed()
+        before = benchmark('Before the indexes')
+
+        upgrade()
+        after = benchmark('After the indexes')
+
+    print(f'\n{"Query":<48}{"Before (ms)":>12}{"After (ms)":>12}{"Speedup":>10}')
+    for name in before:
+        print(f'{name:<48}{before[name]:>12.3f}{after[name]:>12.3f}{before[name] / after[name]:>9.1f}x')
@@ -0,0 +1,13 @@
+import asyncio
+import boto3
+from application import app
+from application.settingssecrets import JUDGE0_AUTHN_TOKEN, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_BUCKET_NAME
+from application.judge.dispatcher import JudgeDispatcher
+
+# Initialize AWS's Python SDK (Boto3) resource, used to download the test case files
+s3 = boto3.resource('s3', aws_access_key_id=AWS_ACCESS_KEY_ID,
+                    aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
+
+# Run the judge dispatcher (submissions are only sent to it if JUDGE_DISPATCHER is set)
+if __name__ == '__main__':
+    asyncio.run(JudgeDispatcher(s3, AWS_BUCKET_NAME, JUDGE0_AUTHN_TOKEN).run())
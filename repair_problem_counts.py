@@ -0,0 +1,10 @@
+from application.models.general import Problem
+from application.utils import refresh_problem_counts
+
+# Count every problem's submitters and submissions again from its submissions (such as for problems created before the
+# counters were added, or if the counters ever drift), in batches of problems
+problems = Problem.query.order_by(Problem.id).all()
+
+for i in range(0, len(problems), 100):
+    refresh_problem_counts(problems[i:i + 100])
+    print(f'Repaired the counters of {min(i + 100, len(problems))}/{len(problems)} problems')
@@ -1,9 +1,9 @@
-import requests
-import json
-from application import db
-from application.settingssecrets import JUDGE0_AUTHN_TOKEN, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_BUCKET_NAME
+from application import app, db
+from application.settingssecrets import AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_BUCKET_NAME
 from application.models.general import *
+from application.judge.client import get_judge0_client
 import boto3
+from flask_migrate import stamp
 
 try:
     db.session.commit()
@@ -67,6 +67,12 @@ status = [
     {
         "id": 14,
         "description": "Exec Format Error"
+    },
+    # Not a Judge0 status: the test cases that were never run because an earlier
+    # one failed in a problem that stops judging at the first failed test case
+    {
+        "id": 15,
+        "description": "Skipped"
     }
 ]
 
@@ -91,19 +97,21 @@ db.session.remove()
 db.drop_all()
 db.create_all()
 
-base_url = 'https://judge0-fhwnc7.vishnus.me'
+# The database was created with the latest schema, so mark it as being at the latest migration
+with app.app_context():
+    stamp()
 
-languages = requests.get(f'{base_url}/languages/', headers={'X-Auth-Token': JUDGE0_AUTHN_TOKEN})
+# Get every language from Judge0, reusing one connection for every request
+client = get_judge0_client()
 
-languages = json.loads(languages.text)
+languages = client.languages()
 
 for l in languages:
     l_id = l['id']
     if int(l_id) == 89:
         continue
     l_name = l['name']
-    lang = requests.get(f'{base_url}/languages/{l_id}', headers={'X-Auth-Token': JUDGE0_AUTHN_TOKEN})
-    lang = json.loads(lang.text)
+    lang = client.language(l_id)
     l_file_ext = lang['source_file'].split('.')[-1]
     lang_db = Language(number=l_id, name=l_name, file_extension=l_file_ext)
     if l_id == 49 or l_id == 50 or l_id == 48 or l_id == 75:
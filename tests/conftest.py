@@ -0,0 +1,106 @@
+import os
+import sys
+import base64
+import types
+import tempfile
+import pytest
+import redis
+import fakeredis
+from cryptography.fernet import Fernet
+
+# The app reads its settings when it's imported, so point it at a throwaway database and in-memory services first
+os.environ.setdefault('SECRET_KEY', 'test')
+os.environ.setdefault('FERNET_KEY', Fernet.generate_key().decode())
+os.environ.setdefault('CELERY_BROKER_URL', 'memory://')
+os.environ['SQLALCHEMY_DATABASE'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}"
+
+# The secrets file isn't checked in, and the tests never reach AWS, Judge0, or the mail server
+if not os.path.exists(os.path.join(os.path.dirname(__file__), '..', 'application', 'settingssecrets.py')):
+    secrets = types.ModuleType('application.settingssecrets')
+    secrets.MAIL_EMAIL = 'test@codeio.tech'
+    secrets.MAIL_PASSWORD = secrets.JUDGE0_AUTHN_TOKEN = 'test'
+    secrets.AWS_ACCESS_KEY_ID = secrets.AWS_SECRET_ACCESS_KEY = secrets.AWS_BUCKET_NAME = 'test'
+    sys.modules['application.settingssecrets'] = secrets
+
+
+# An in-memory Redis that only has the commands of the installed (pinned) redis client, so using a command that the
+# client doesn't have fails here the same way it would in production, even though fakeredis has it
+class PinnedRedis:
+    def __init__(self):
+        self._redis = fakeredis.FakeStrictRedis()
+
+    def __getattr__(self, name):
+        if not hasattr(redis.Redis, name):
+            raise AttributeError(f'redis {redis.__version__} has no {name}')
+
+        return getattr(self._redis, name)
+
+
+redis.Redis.from_url = classmethod(lambda cls, *args, **kwargs: PinnedRedis())
+
+from application import app as flask_app, db, redis_store, limiter
+from application.models.general import Status, Language, User, Class_, Student, Problem, InputFile, OutputFile, \
+    Submission
+from application.registry import registry
+
+
+@pytest.fixture
+def app():
+    flask_app.config['TESTING'] = True
+    flask_app.config['WTF_CSRF_ENABLED'] = False
+    limiter.enabled = False
+
+    with flask_app.app_context():
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+        db.drop_all()
+
+    redis_store.flushall()
+
+
+# The judge's statuses by their Judge0 id, along with the "Skipped" status (see reset_database.py)
+STATUSES = ['In Queue', 'Processing', 'Accepted', 'Wrong Answer', 'Time Limit Exceeded', 'Compilation Error',
+            'Runtime Error (SIGSEGV)', 'Runtime Error (SIGXFSZ)', 'Runtime Error (SIGFPE)', 'Runtime Error (SIGABRT)',
+            'Runtime Error (NZEC)', 'Runtime Error (Other)', 'Internal Error', 'Exec Format Error', 'Skipped']
+
+
+# A teacher's class with a student, and an auto graded problem with two test cases
+@pytest.fixture
+def problem(app):
+    for number, name in enumerate(STATUSES, start=1):
+        db.session.add(Status(number=number, name=name))
+
+    language = Language(number=71, name='Python (3.8.1)', short_name='python', file_extension='py')
+    user = User(email='teacher@codeio.tech', password='', name='Teacher', confirm=True)
+    class_ = Class_(identifier='class', name='Class', users=[user])
+    student = Student(name='Student', identifier='student', class_=class_)
+    problem = Problem(identifier='problem', title='Problem', description='', description_html='', total_marks=10,
+                      auto_grade=True, visible=True, time_limit=1, user=user, class_=class_, languages=[language])
+
+    for number in (1, 2):
+        input_file = InputFile(number=number, file_path=f'input{number}', problem=problem)
+        db.session.add(OutputFile(number=number, file_path=f'output{number}', problem=problem, input_file=input_file))
+
+    db.session.add_all([student, problem])
+    db.session.commit()
+    registry.reload()
+
+    return problem
+
+
+# Make a submission to a problem by its class's (first) student
+def make_submission(problem, **fields):
+    submission = Submission(uuid=fields.pop('uuid', str(Submission.query.count())), file_path='submission.py',
+                            problem=problem, student=fields.pop('student', problem.class_.students[0]),
+                            language_id=registry.language(71).id, **fields)
+    db.session.add(submission)
+    db.session.commit()
+
+    return submission
+
+
+# A finished test case in Judge0's format
+def judge0_result(token, status=3, stdout=''):
+    return {'token': token, 'status': {'id': status}, 'stdout': base64.b64encode(stdout.encode()).decode(),
+            'stderr': None, 'compile_output': None, 'time': '0.01', 'memory': 1000}
@@ -0,0 +1,50 @@
+import types
+import pytest
+import application.judge.admission as admission
+from application.judge.admission import has_capacity, refresh_judge_backlog
+from application.judge.executor import JudgeUnavailable
+
+
+# A Judge0 pool whose nodes have the given numbers of test cases outstanding (or whose nodes are all down)
+class FakePool:
+    def __init__(self, *outstanding, down=False):
+        self.nodes = [types.SimpleNamespace(outstanding=n) for n in outstanding]
+        self.down = down
+        self.checks = 0
+
+    def choose(self):
+        self.checks += 1
+
+        if self.down:
+            raise JudgeUnavailable('Every Judge0 node is out of rotation')
+
+        return self.nodes
+
+
+@pytest.fixture
+def judge0(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'JUDGE_EXECUTOR', 'judge0')
+    monkeypatch.setitem(app.config, 'JUDGE_MAX_BACKLOG', 100)
+
+    def use(pool):
+        monkeypatch.setattr(admission, 'get_judge0_client', lambda: pool)
+        return pool
+
+    return use
+
+
+# Admitting a submission only reads the backlog that was last checked, without asking Judge0
+def test_admission_uses_the_last_checked_backlog(judge0):
+    pool = judge0(FakePool(60, 50))
+
+    assert has_capacity()
+    assert refresh_judge_backlog() == 110
+    assert not has_capacity()
+    assert pool.checks == 1
+
+
+def test_admission_waits_while_the_judge_is_down(judge0):
+    judge0(FakePool(down=True))
+    refresh_judge_backlog()
+
+    assert not has_capacity()
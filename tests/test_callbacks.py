@@ -0,0 +1,78 @@
+from time import time
+import pytest
+from application import db, redis_store
+from application.models.general import Result, Status
+from application.registry import registry
+from application.judge.grading import CALLBACK_SUBMISSIONS, MissingStatus, create_pending_results, record_callback, \
+    record_early_callbacks, skip_remaining_results, sweep_callback_submissions
+from conftest import make_submission, judge0_result
+
+
+class FakeJudge0:
+    def __init__(self, batch):
+        self.batch = batch
+        self.tokens = None
+
+    def get_batch(self, tokens, nodes=None):
+        self.tokens = tokens
+        return self.batch
+
+
+def test_callback_before_the_results_are_saved_is_recorded(problem):
+    submission = make_submission(problem)
+
+    # Judge0 calls back with the first test case before the worker has saved the pending results
+    record_callback(submission.id, judge0_result('a'))
+    assert Result.query.count() == 0
+
+    results = create_pending_results(submission, problem, [{'token': 'a'}, {'token': 'b'}])
+    record_early_callbacks(submission, problem, results, time() + 60)
+    assert [r.status.number for r in results] == [3, 1]
+
+    record_callback(submission.id, judge0_result('b', status=4))
+    assert submission.done and submission.marks == 5
+
+
+def test_callback_isnt_recorded_twice(problem):
+    submission = make_submission(problem)
+    results = create_pending_results(submission, problem, [{'token': 'a'}, {'token': 'b'}])
+
+    record_callback(submission.id, judge0_result('a'))
+    record_early_callbacks(submission, problem, results, time() + 60)
+
+    assert not redis_store.hgetall(f'judge:callbacks:early:{submission.id}')
+    assert [r.status.number for r in results] == [3, 1]
+
+
+def test_sweep_polls_lost_callbacks_and_expires_the_rest(problem):
+    submission = make_submission(problem)
+    results = create_pending_results(submission, problem, [{'token': 'a'}, {'token': 'b'}])
+    record_early_callbacks(submission, problem, results, time() - 1)
+
+    judge0 = FakeJudge0([judge0_result('a'), judge0_result('b', status=2)])
+    assert sweep_callback_submissions(judge0) == 1
+
+    db.session.refresh(submission)
+    assert sorted(judge0.tokens) == ['a', 'b']
+    assert [r.status.number for r in sorted(submission.results, key=lambda r: r.id)] == [3, 13]
+    assert submission.done and submission.marks == 5
+    assert not redis_store.zcard(CALLBACK_SUBMISSIONS)
+
+
+def test_sweep_waits_for_the_deadline(problem):
+    submission = make_submission(problem)
+    results = create_pending_results(submission, problem, [{'token': 'a'}, {'token': 'b'}])
+    record_early_callbacks(submission, problem, results, time() + 60)
+
+    assert sweep_callback_submissions(FakeJudge0([])) == 0
+    assert not submission.done
+
+
+# A database that the migrations weren't run on has no "Skipped" status, which skipping says instead of crashing
+def test_skipping_without_the_skipped_status_fails_loudly(problem):
+    Status.query.filter_by(number=15).delete()
+    db.session.commit()
+    registry.reload()
+
+    with pytest.raises(MissingStatus, match='flask db upgrade'):
+        skip_remaining_results(make_submission(problem), problem, 1)
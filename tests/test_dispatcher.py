@@ -0,0 +1,151 @@
+import zlib
+import asyncio
+from application import db
+from application.models.general import Result, JudgeOutbox
+from application.registry import registry
+from application.judge.executor import Executor
+from application.judge.dispatcher import JudgeDispatcher
+from conftest import make_submission, judge0_result
+
+
+# An executor that runs every test case right away, and rejects the ones in an unknown language the way Judge0 does
+class FakeExecutor(Executor):
+    def __init__(self):
+        self.tokens = 0
+
+    def create_batch(self, submissions):
+        judge0_tokens = []
+        for s in submissions:
+            if s['language_id'] == 71:
+                self.tokens += 1
+                judge0_tokens.append({'token': f'token{self.tokens}'})
+            else:
+                judge0_tokens.append({'language_id': [f"language with id {s['language_id']} doesn't exist"]})
+
+        return judge0_tokens
+
+    def get_batch(self, tokens, nodes=None):
+        return [judge0_result(token) for token in tokens]
+
+
+# A dispatcher that runs test cases with the given executor instead of Judge0
+def make_dispatcher(executor):
+    dispatcher = JudgeDispatcher(None, 'bucket', 'token', max_in_flight=10, poll_interval=0.01, coalesce_wait=0)
+    dispatcher.executor = executor
+    dispatcher.judge0 = False
+
+    return dispatcher
+
+
+# A queued submission and its runs, one in the given language for each test case
+def queued(submission, *languages):
+    job = {'submission': submission.id, 'problem': submission.problem_id, 'file': 'print(1)', 'language': 71}
+    return job, [{'language_id': language} for language in languages]
+
+
+# Send the runs of the jobs to the judge in one batch, with a slot taken for each of them
+async def send(dispatcher, jobs):
+    dispatcher._slots = asyncio.Semaphore(10)
+
+    for job, _ in jobs:
+        await dispatcher._slots.acquire()
+        dispatcher.deadlines[job['submission']] = float('inf')
+
+    await dispatcher._send(jobs)
+
+
+# Send the runs of the jobs, then poll their tokens for a while
+async def send_and_poll(dispatcher, jobs):
+    await send(dispatcher, jobs)
+
+    try:
+        await asyncio.wait_for(dispatcher._poll_forever(), 0.5)
+    except asyncio.TimeoutError:
+        pass
+
+
+# Make a method of the dispatcher fail the first given number of times it's called (after running, if it's late)
+def fail_first(dispatcher, name, times, late=False):
+    method, calls = getattr(dispatcher, name), []
+
+    def flaky(*args):
+        calls.append(args)
+
+        if len(calls) > times:
+            return method(*args)
+
+        if late:
+            method(*args)
+
+        raise Exception('The database is restarting')
+
+    setattr(dispatcher, name, flaky)
+    return calls
+
+
+def test_a_rejected_test_case_only_fails_its_submission(problem):
+    first, second = make_submission(problem), make_submission(problem)
+    dispatcher = make_dispatcher(FakeExecutor())
+
+    asyncio.run(send(dispatcher, [queued(first, 71, 71), queued(second, 71, 999)]))
+
+    assert len(dispatcher.in_flight[first.id]) == 2
+    assert len(dispatcher.in_flight[second.id]) == 1
+
+    rejected = Result.query.filter_by(submission_id=second.id, token='').one()
+    assert registry.status_by_id(rejected.status_id).number == 13
+    assert zlib.decompress(rejected.stderr_data).decode() == "language_id: language with id 999 doesn't exist"
+
+
+def test_a_submission_with_every_test_case_rejected_is_done(problem):
+    submission = make_submission(problem)
+    dispatcher = make_dispatcher(FakeExecutor())
+
+    asyncio.run(send(dispatcher, [queued(submission, 999, 999)]))
+
+    assert submission.id not in dispatcher.in_flight
+    assert dispatcher._slots._value == 10
+
+    db.session.refresh(submission)
+    assert submission.done
+
+
+def test_results_that_cant_be_recorded_stay_in_flight(app, problem, monkeypatch):
+    monkeypatch.setitem(app.config, 'JUDGE_BACKOFF_BASE', 0.01)
+    submission = make_submission(problem)
+    dispatcher = make_dispatcher(FakeExecutor())
+    calls = fail_first(dispatcher, '_record', 1)
+
+    asyncio.run(send_and_poll(dispatcher, [queued(submission, 71, 71)]))
+
+    assert len(calls) == 2
+    assert not dispatcher.in_flight
+    assert dispatcher._slots._value == 10
+
+    db.session.refresh(submission)
+    assert submission.done
+
+
+def test_results_that_were_saved_before_failing_arent_saved_again(app, problem, monkeypatch):
+    monkeypatch.setitem(app.config, 'JUDGE_BACKOFF_BASE', 0.01)
+    submission = make_submission(problem)
+    dispatcher = make_dispatcher(FakeExecutor())
+    fail_first(dispatcher, '_create_results', 1, late=True)
+
+    asyncio.run(send(dispatcher, [queued(submission, 71, 71)]))
+
+    assert len(dispatcher.in_flight[submission.id]) == 2
+    assert Result.query.filter_by(submission_id=submission.id).count() == 2
+
+
+def test_a_submission_whose_results_cant_be_saved_goes_to_the_outbox(app, problem, monkeypatch):
+    monkeypatch.setitem(app.config, 'JUDGE_BACKOFF_BASE', 0.01)
+    submission = make_submission(problem)
+    dispatcher = make_dispatcher(FakeExecutor())
+    fail_first(dispatcher, '_create_results', app.config['JUDGE_BACKOFF_ATTEMPTS'])
+
+    asyncio.run(send(dispatcher, [queued(submission, 71, 71)]))
+
+    assert submission.id not in dispatcher.in_flight
+    assert dispatcher._slots._value == 10
+    assert JudgeOutbox.query.filter_by(submission_id=submission.id).count() == 1
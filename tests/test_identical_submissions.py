@@ -0,0 +1,71 @@
+import types
+from application import db
+from application.models.general import Result
+from application.registry import registry
+from application.judge.grading import copy_identical_results, get_judge_key
+from application.utils import delete_submission_files
+from conftest import make_submission
+
+
+# An S3 resource that remembers which objects were deleted
+class FakeS3:
+    def __init__(self):
+        self.deleted = set()
+
+    def Object(self, bucket_name, key):
+        return types.SimpleNamespace(delete=lambda: self.deleted.add(key))
+
+
+# Make a finished submission of some code, with a result of each status
+def judged_submission(problem, statuses):
+    submission = make_submission(problem, done=True, marks=0, judge_key=get_judge_key(problem, 'print(1)', 71))
+
+    for input_file, status in zip(problem.input_files, statuses):
+        submission.results.append(Result(input_file=input_file, output_file=input_file.output_file, token='',
+                                         status_id=registry.status(status).id, correct=status == 3, marks=0,
+                                         marks_out_of=5))
+
+    return submission
+
+
+def test_identical_results_are_copied(problem):
+    judged_submission(problem, [3, 4])
+    submission = make_submission(problem)
+
+    assert copy_identical_results(submission, problem, 'print(1)', 71)
+    assert [r.status.number for r in submission.results] == [3, 4]
+    assert submission.done and submission.marks == 5
+
+
+def test_internal_errors_arent_copied(problem):
+    judged_submission(problem, [3, 13])
+    submission = make_submission(problem)
+
+    assert not copy_identical_results(submission, problem, 'print(1)', 71)
+    assert not submission.results
+
+
+def test_the_last_clean_submission_is_copied(problem):
+    judged_submission(problem, [3, 3])
+    judged_submission(problem, [13, 13])
+    submission = make_submission(problem)
+
+    assert copy_identical_results(submission, problem, 'print(1)', 71)
+    assert [r.status.number for r in submission.results] == [3, 3]
+
+
+# The outputs stored in S3 are shared with the copies, so they're only deleted once no submission uses them
+def test_shared_outputs_are_kept_until_no_submission_uses_them(problem):
+    previous = judged_submission(problem, [3, 3])
+    previous.results[0].output_path = 'outputs/shared'
+    db.session.commit()
+
+    submission = make_submission(problem)
+    copy_identical_results(submission, problem, 'print(1)', 71)
+
+    s3 = FakeS3()
+    delete_submission_files(problem, s3, 'bucket', files=[previous])
+    assert 'outputs/shared' not in s3.deleted
+
+    delete_submission_files(problem, s3, 'bucket')
+    assert 'outputs/shared' in s3.deleted
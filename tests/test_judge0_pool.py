@@ -0,0 +1,77 @@
+import pytest
+from requests import Response
+from requests.exceptions import ConnectionError, HTTPError
+from application.judge.client import Judge0Pool
+from application.judge.executor import JudgeUnavailable
+
+
+# A Judge0 client whose requests all fail with the given error
+class FailingClient:
+    def __init__(self, error):
+        self.error = error
+
+    def workers(self):
+        raise self.error
+
+    def create_batch(self, submissions):
+        raise self.error
+
+    def get_batch(self, tokens):
+        raise self.error
+
+    def languages(self):
+        raise self.error
+
+
+# An error for a response with the given status code
+def http_error(status_code):
+    response = Response()
+    response.status_code = status_code
+    return HTTPError(f'{status_code} error', response=response)
+
+
+# A pool of one node, whose client fails with the given error
+def failing_pool(error):
+    pool = Judge0Pool(['http://judge0'], 'token', 1, 1, 0)
+    pool.nodes[0].client = FailingClient(error)
+
+    return pool
+
+
+# Each request that the pool sends to a node
+REQUESTS = [lambda pool: pool.create_batch([{}]), lambda pool: pool.get_batch(['token']), lambda pool: pool.languages()]
+
+
+@pytest.mark.parametrize('request_', REQUESTS)
+@pytest.mark.parametrize('error', [ConnectionError('refused'), http_error(500)])
+def test_transport_and_server_errors_count_against_the_node(app, monkeypatch, error, request_):
+    monkeypatch.setitem(app.config, 'JUDGE_BACKOFF_ATTEMPTS', 1)
+    pool = failing_pool(error)
+
+    with pytest.raises(Exception):
+        request_(pool)
+
+    assert pool.nodes[0].errors == 1
+
+
+@pytest.mark.parametrize('request_', REQUESTS)
+@pytest.mark.parametrize('error', [http_error(422), JudgeUnavailable('Judge0 returned an invalid batch')])
+def test_rejected_requests_dont_count_against_the_node(app, error, request_):
+    pool = failing_pool(error)
+
+    with pytest.raises(Exception):
+        request_(pool)
+
+    assert pool.nodes[0].errors == 0
+
+
+# A node whose queue can't be checked (such as when the token isn't allowed to see it) stays in rotation
+def test_a_node_whose_queue_cant_be_checked_stays_in_rotation(app):
+    pool = failing_pool(http_error(401))
+
+    for _ in range(app.config['JUDGE0_NODE_MAX_ERRORS'] + 1):
+        pool.nodes[0].checked_at = None
+        assert pool.choose() == pool.nodes
+
+    assert pool.nodes[0].errors == 0
+    assert pool.nodes[0].queue_depth is None
@@ -0,0 +1,59 @@
+import os
+import time
+import base64
+import tempfile
+import pytest
+from application.judge import local
+from application.judge.local import LocalExecutor
+
+
+def run(source, language_id=71, stdin=b'', expected_output=b''):
+    executor = LocalExecutor(1)
+    token = executor.create_batch([{'language_id': language_id, 'source_code': base64.b64encode(source).decode(),
+                                    'stdin': base64.b64encode(stdin).decode(),
+                                    'expected_output': base64.b64encode(expected_output).decode(),
+                                    'cpu_time_limit': 1, 'memory_limit': 256000}])[0]['token']
+
+    while True:
+        s = executor.get_batch([token])[0]
+        if s['status']['id'] > 2:
+            return s
+
+        time.sleep(0.05)
+
+
+def output(s, field='stdout'):
+    return base64.b64decode(s[field] or '').decode()
+
+
+def test_programs_dont_get_the_workers_environment(app):
+    s = run(b'import os\nprint(sorted(os.environ))')
+
+    assert s['status']['id'] == 4
+    assert 'SECRET_KEY' not in output(s) and 'FERNET_KEY' not in output(s)
+
+
+@pytest.mark.skipif(os.geteuid() != 0, reason='switching users needs root')
+def test_programs_run_as_the_judge_user(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'LOCAL_JUDGE_USER', 'nobody')
+
+    private = tempfile.mkdtemp()
+    with open(os.path.join(private, 'secret'), 'w') as f:
+        f.write('secret')
+
+    s = run(f"print(open('{private}/secret').read())".encode())
+
+    assert s['status']['id'] == 11
+    assert 'Permission denied' in output(s, 'stderr')
+
+
+def test_compiling_has_a_wall_clock_limit(app, monkeypatch):
+    monkeypatch.setattr(local, 'COMPILE_TIME_LIMIT', 1)
+    monkeypatch.setitem(local.LANGUAGES, 1000, {'source_file': 'main', 'compile': ['sleep', '30'], 'run': ['true']})
+
+    start = time.monotonic()
+    s = run(b'', language_id=1000)
+
+    assert s['status']['id'] == 6
+    assert output(s, 'compile_output') == 'Compilation took too long'
+    assert time.monotonic() - start < 10
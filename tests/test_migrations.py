@@ -0,0 +1,75 @@
+import os
+import logging
+import pytest
+from flask_migrate import upgrade, downgrade
+from application import db
+
+# The app's migrations, wherever the tests are run from
+MIGRATIONS = os.path.join(os.path.dirname(__file__), '..', 'migrations')
+
+
+# Migrate the database to a revision, keeping the app's loggers (the migrations' logging config disables them)
+def migrate(migration, revision):
+    loggers = {name: logger.disabled for name, logger in logging.root.manager.loggerDict.items()
+               if isinstance(logger, logging.Logger)}
+
+    try:
+        migration(directory=MIGRATIONS, revision=revision)
+    finally:
+        for name, disabled in loggers.items():
+            logging.getLogger(name).disabled = disabled
+
+
+# An empty database at the baseline schema, with the statuses that Judge0 had before "Skipped" was added
+@pytest.fixture
+def baseline(app):
+    db.drop_all()
+    db.engine.execute('DROP TABLE IF EXISTS alembic_version')
+    migrate(upgrade, 'e1980730fe6f')
+
+    for number in range(1, 15):
+        db.engine.execute('INSERT INTO status (number, name) VALUES (?, ?)', number, f'Status {number}')
+
+    yield
+
+    migrate(downgrade, 'base')
+    db.engine.execute('DROP TABLE alembic_version')
+
+
+def skipped_statuses():
+    return db.engine.execute('SELECT name FROM status WHERE number = 15').fetchall()
+
+
+def test_upgrading_adds_the_skipped_status(baseline):
+    migrate(upgrade, 'head')
+    assert skipped_statuses() == [('Skipped',)]
+
+    migrate(downgrade, 'e1980730fe6f')
+    assert skipped_statuses() == []
+
+
+def test_upgrading_keeps_an_existing_skipped_status(baseline):
+    db.engine.execute("INSERT INTO status (number, name) VALUES (15, 'Skipped')")
+
+    migrate(upgrade, 'head')
+    assert skipped_statuses() == [('Skipped',)]
+
+
+# The submissions of a problem that isn't auto graded weren't marked as done, but are counted once they're upgraded
+def test_upgrading_counts_the_submissions_of_problems_that_arent_auto_graded(baseline):
+    db.engine.execute("INSERT INTO user (id, email, password, name) VALUES (1, 'teacher@codeio.tech', '', 'Teacher')")
+    db.engine.execute("INSERT INTO class_ (id, identifier, name) VALUES (1, 'class', 'Class')")
+    db.engine.execute("INSERT INTO student (id, name, identifier, class_id) VALUES (1, 'Student', 'student', 1)")
+    db.engine.execute("INSERT INTO language (id, number, name, file_extension) VALUES (1, 71, 'Python', 'py')")
+    db.engine.execute("INSERT INTO problem (id, identifier, title, description, description_html, time_limit, "
+                      "memory_limit, total_marks, auto_grade, allow_multiple_submissions, allow_more_submissions, "
+                      "visible, user_id, class_id) VALUES (1, 'problem', 'Problem', '', '', 1, 128, 10, 0, 1, 1, 1, "
+                      "1, 1)")
+    db.engine.execute("INSERT INTO submission (uuid, file_path, marks, done, problem_id, student_id, language_id) "
+                      "VALUES ('submission', 'submission.py', 10, 0, 1, 1, 1)")
+
+    migrate(upgrade, 'head')
+
+    assert db.engine.execute('SELECT done FROM submission').fetchall() == [(1,)]
+    assert db.engine.execute('SELECT submissions_count, done_submissions_count FROM problem').fetchall() == [(1, 1)]
+    assert db.engine.execute('SELECT best_marks, solved FROM student_problem_score').fetchall() == [(10, 1)]
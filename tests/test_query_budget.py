@@ -0,0 +1,137 @@
+import os
+import io
+import types
+from hashlib import sha256
+import pytest
+from application import db, serializer
+from application.models.general import User, Student, Result, MOSSResult
+from application.registry import registry
+from application.judge.grading import refresh_scores
+from application.utils import refresh_problem_counts
+import application.routes.teacher as teacher
+from conftest import make_submission
+
+
+# An S3 resource that keeps nothing, since the tests never reach AWS
+class FakeS3:
+    def Object(self, bucket_name, key):
+        return types.SimpleNamespace(put=lambda **kwargs: None, delete=lambda: None)
+
+
+# Give the problem's class a number of students, each with a judged submission (with a result for each test case)
+def seed(problem, students):
+    for i in range(students):
+        student = Student(name=f'Student {i}', identifier=f'student{i}', class_=problem.class_)
+        submission = make_submission(problem, uuid=f'submission{i}', student=student, done=True, marks=i % 10)
+
+        for input_file in problem.input_files:
+            db.session.add(Result(submission=submission, input_file=input_file, output_file=input_file.output_file,
+                                  token='', status_id=registry.status(3).id, correct=True, marks=5, marks_out_of=5,
+                                  time=0.01, memory=1000))
+
+    # Along with a teacher to invite to the class, and a plagiarism check of the problem
+    db.session.add(User(email='invited@codeio.tech', password='', name='Invited', confirm=True))
+    db.session.add(MOSSResult(uuid='moss', link='https://moss.stanford.edu', problem=problem,
+                              languages=problem.languages))
+    db.session.commit()
+
+    refresh_scores(problem)
+    refresh_problem_counts([problem])
+
+
+# Every budgeted view, requested the way its page uses it by a user (the ones that delete are last)
+def budgeted_requests(problem):
+    class_, teacher_user = problem.class_, problem.user
+    invited = User.query.filter_by(email='invited@codeio.tech').one()
+    invite_key = serializer.dumps(class_.id, salt=os.environ.get('SECRET_KEY'))
+    student = Student.query.filter_by(identifier='student0').one()
+    problem_url = f'/class/{class_.identifier}/problem/{problem.identifier}'
+    edit = {'title': 'Problem', 'description': 'A problem', 'total_marks': 12, 'time_limit': 1, 'memory_limit': 128,
+            'languages': ['71']}
+    new_problem = {'title': 'New problem', 'description': 'A problem', 'total_marks': 5, 'languages': ['71'],
+                   'auto_grade': 'y'}
+
+    for number in range(1, 6):
+        new_problem[f'input{number}file'] = (io.BytesIO(b'1'), 'input.txt')
+        new_problem[f'output{number}file'] = (io.BytesIO(b'2'), 'output.txt')
+
+    student_hash = sha256(f'{class_.id}{student.id}{teacher_user.password}'.encode()).hexdigest()
+    problem_hash = sha256(f'{class_.identifier}{class_.id}{problem.identifier}{problem.id}'
+                          f'{teacher_user.password}'.encode()).hexdigest()
+
+    requests = [
+        ('GET', '/account', None),
+        ('POST', '/account', {'name': 'Teacher'}),
+        ('GET', '/dashboard', None),
+        ('GET', '/new-class', None),
+        ('POST', '/new-class', {'name': 'New class', 'description': 'A class'}),
+        ('GET', f'/class/{class_.identifier}/home', None),
+        ('GET', f'/class/{class_.identifier}/users', None),
+        ('POST', f'/class/{class_.identifier}/users', {'name': 'New student'}),
+        ('GET', f'/class/{class_.identifier}/options', None),
+        ('POST', f'/class/{class_.identifier}/options', {'name': 'Class', 'description': 'A class'}),
+        ('GET', f'/class/{class_.identifier}/new-problem', None),
+        ('POST', f'/class/{class_.identifier}/new-problem', new_problem),
+        ('GET', problem_url, None),
+        ('GET', f'{problem_url}/plagiarism-check/moss', None),
+        ('GET', '/plagiarism-status/moss', None),
+        ('GET', '/plagiarism-status/moss/events', None),
+        ('POST', f'{problem_url}/rejudge', {'submissions': 'all'}),
+        ('GET', f'{problem_url}/rejudge/rejudge', None),
+        ('GET', f'{problem_url}/rejudge/rejudge/status', None),
+        ('GET', f'{problem_url}/rejudge/rejudge/events', None),
+        ('GET', f'{problem_url}/edit', None),
+        ('POST', f'{problem_url}/edit', edit),
+        ('GET', '/teacher/submission/submission0', None),
+        ('POST', '/teacher/submission/submission0', {'mark': 5}),
+        ('GET', f'/class/{class_.identifier}/student/{student.identifier}', None),
+        ('GET', '/student-dashboard', None),
+        ('GET', '/status/submission0', None),
+        ('GET', '/student/submission/submission0', None),
+        ('GET', f'/class/{class_.identifier}/student/{student.identifier}/delete?hash={student_hash}', None),
+        ('GET', f'{problem_url}/delete?hash={problem_hash}', None),
+    ]
+
+    return [(invited, 'GET', f'/class/{class_.identifier}/invite?key={invite_key}', None),
+            (invited, 'POST', f'/class/{class_.identifier}/invite?key={invite_key}', {'submit': 'y'})] + \
+        [(teacher_user, *request) for request in requests]
+
+
+# A test client logged in as a teacher, who is also signed in as the first seeded student
+def log_in(app, user):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+        session['_fresh'] = True
+        session['student_id'] = 'student0'
+
+    return client
+
+
+# Each budgeted view stays within its budget, whether the class has a few students or twice as many
+@pytest.mark.parametrize('students', [5, 10])
+def test_views_stay_within_their_budgets(app, problem, monkeypatch, students):
+    app.config['QUERY_BUDGET_STRICT'] = True
+    monkeypatch.setattr(teacher, 's3', FakeS3())
+    monkeypatch.setattr(teacher.teacher_rejudge_problem, 'delay', lambda *args: types.SimpleNamespace(id='rejudge'))
+    monkeypatch.setattr(teacher.teacher_rejudge_problem, 'AsyncResult',
+                        lambda task_id: types.SimpleNamespace(state='PENDING'))
+    seed(problem, students)
+
+    clients = {}
+
+    try:
+        for user, method, url, data in budgeted_requests(problem):
+            client = clients.setdefault(user.id, log_in(app, user))
+            response = client.open(url, method=method, data=data, content_type='multipart/form-data')
+            assert response.status_code in (200, 302), f'{method} {url}'
+            response.close()
+    finally:
+        app.config['QUERY_BUDGET_STRICT'] = False
+
+
+# Every view of a class's pages has a budget, other than deleting a whole class (see its route)
+def test_class_views_have_budgets(app):
+    for rule in app.url_map.iter_rules():
+        if rule.rule.startswith('/class/') and rule.endpoint != 'teacher_class_delete':
+            assert getattr(app.view_functions[rule.endpoint], 'query_budget', None) is not None, rule.endpoint
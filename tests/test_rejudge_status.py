@@ -0,0 +1,51 @@
+import types
+import pytest
+from application import db
+from application.models.general import User, Class_, Problem
+import application.routes.teacher as teacher
+
+
+# A test client logged in as a user
+def log_in(app, user):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+        session['_fresh'] = True
+
+    return client
+
+
+# Start rejudging a problem as its teacher, with the task's status always in progress
+@pytest.fixture
+def rejudge(app, problem, monkeypatch):
+    monkeypatch.setattr(teacher.teacher_rejudge_problem, 'delay', lambda *args: types.SimpleNamespace(id='rejudge'))
+    monkeypatch.setattr(teacher.teacher_rejudge_problem, 'AsyncResult',
+                        lambda task_id: types.SimpleNamespace(state='PROGRESS', info={'state': 'PROGRESS'}))
+
+    log_in(app, problem.user).post('/class/class/problem/problem/rejudge', data={'submissions': 'all'})
+
+
+# A teacher with a class and problem of their own
+def other_teacher(app):
+    user = User(email='other@codeio.tech', password='', name='Other', confirm=True)
+    class_ = Class_(identifier='other', name='Other', users=[user])
+    db.session.add(Problem(identifier='other', title='Other', description='', description_html='', total_marks=10,
+                           auto_grade=True, visible=True, time_limit=1, user=user, class_=class_))
+    db.session.commit()
+
+    return log_in(app, user)
+
+
+@pytest.mark.parametrize('view', ['status', 'events'])
+def test_the_problems_teacher_can_see_the_rejudge(app, problem, rejudge, view):
+    response = log_in(app, problem.user).get(f'/class/class/problem/problem/rejudge/rejudge/{view}')
+    assert response.status_code == 200
+    response.close()
+
+
+@pytest.mark.parametrize('view', ['status', 'events'])
+def test_other_teachers_cant_see_the_rejudge(app, problem, rejudge, view):
+    client = other_teacher(app)
+
+    assert client.get(f'/class/class/problem/problem/rejudge/rejudge/{view}').status_code == 404
+    assert client.get(f'/class/other/problem/other/rejudge/rejudge/{view}').status_code == 404
@@ -0,0 +1,50 @@
+from collections import Counter
+from application.judge.scheduler import add_job, take_job, job_position
+
+
+def job(submission, problem, class_, priority=1):
+    return {'submission': submission, 'problem': problem, 'class': class_, 'priority': priority}
+
+
+def test_job_position_counts_the_jobs_ahead(app):
+    for submission in range(1, 5):
+        add_job(job(submission, problem=1, class_=1), 0)
+
+    assert [job_position(submission) for submission in range(1, 5)] == [1, 2, 3, 4]
+
+    take_job()
+    assert job_position(1) is None
+    assert [job_position(submission) for submission in range(2, 5)] == [1, 2, 3]
+
+
+def test_job_position_counts_other_classes_turns(app):
+    for submission in range(1, 4):
+        add_job(job(submission, problem=1, class_=1), 0)
+    for submission in range(4, 10):
+        add_job(job(submission, problem=2, class_=2), 0)
+
+    # Each class takes a turn at a time, so the third job of class 1 waits for (up to) three jobs of class 2
+    assert job_position(3) == 6
+
+    taken = [take_job()['submission'] for _ in range(6)]
+    assert 3 in taken
+
+
+def test_priority_doesnt_slow_down_other_classes(app):
+    for submission in range(1, 21):
+        add_job(job(submission, problem=1, class_=1, priority=10), 0)
+    for submission in range(21, 41):
+        add_job(job(submission, problem=2, class_=2), 0)
+
+    classes = Counter(take_job()['class'] for _ in range(20))
+    assert classes == {1: 10, 2: 10}
+
+
+def test_priority_shares_turns_within_a_class(app):
+    for submission in range(1, 21):
+        add_job(job(submission, problem=1, class_=1, priority=3), 0)
+    for submission in range(21, 41):
+        add_job(job(submission, problem=2, class_=1), 0)
+
+    problems = Counter(take_job()['problem'] for _ in range(16))
+    assert problems == {1: 12, 2: 4}
@@ -0,0 +1,30 @@
+import logging
+from application.judge.cache import TestCaseCache as Cache
+
+
+# An invalidation in one process (such as the web process, when a problem is deleted) reaches every other process
+def test_invalidations_reach_every_process(app):
+    web, worker = Cache(1000), Cache(1000)
+
+    worker.receive_invalidations()
+    worker.put('input', 1, 'data')
+    worker.put('other', 2, 'data')
+
+    web.invalidate(1)
+    worker.receive_invalidations()
+
+    assert worker.get('input') is None
+    assert worker.get('other') == 'data'
+
+
+def test_stats_are_logged(app, monkeypatch, caplog):
+    monkeypatch.setitem(app.config, 'TEST_CASE_CACHE_LOG_INTERVAL', 0)
+    cache = Cache(1000)
+    cache.put('input', 1, 'data')
+    cache.get('input')
+    cache.get('output')
+
+    with caplog.at_level(logging.INFO):
+        cache.log_stats()
+
+    assert '1 hits, 1 misses (50% hit rate), 1 files, 4 of 1000 bytes' in caplog.text